@@ -28,10 +28,93 @@ MULTICARDS_PASSWORD = os.getenv("MULTICARDS_PASSWORD")
 # Базовый URL захардкожен в services/ecards.py (как у AdsCard).
 ECARDS_TOKEN = os.getenv("ECARDS_TOKEN")
 
+# Общий пул HTTP-соединений к внешним API (services/http_client.py)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))                  # всего соединений
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))  # на один хост
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))            # сек
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))   # сек
+
+# eCards: не больше стольких одновременных запросов к API (services/ecards.py)
+ECARDS_MAX_CONCURRENCY = int(os.getenv("ECARDS_MAX_CONCURRENCY", "5"))
+# eCards: сколько страниц пагинации запрашивать заранее, если известно их число
+ECARDS_PREFETCH_WINDOW = int(os.getenv("ECARDS_PREFETCH_WINDOW", "4"))
+# Локальный журнал операций eCards (services/ecards_ledger.py)
+ECARDS_LEDGER_RECHECK_WINDOW = int(os.getenv("ECARDS_LEDGER_RECHECK_WINDOW", str(3 * 24 * 3600)))  # сек
+ECARDS_LEDGER_MIN_SYNC_INTERVAL = int(os.getenv("ECARDS_LEDGER_MIN_SYNC_INTERVAL", "60"))          # сек
+
+# Справочник карт банков в памяти (services/card_directory.py)
+CARD_DIRECTORY_REFRESH_INTERVAL = int(os.getenv("CARD_DIRECTORY_REFRESH_INTERVAL", "600"))  # сек
+CARD_DIRECTORY_MISS_COOLDOWN = int(os.getenv("CARD_DIRECTORY_MISS_COOLDOWN", "30"))         # сек
+
+# Single-flight (services/singleflight.py): сколько секунд отдавать успешный
+# результат одинаковым запросам к API из памяти
+SINGLEFLIGHT_TTL = float(os.getenv("SINGLEFLIGHT_TTL", "5"))
+
+# Лимиты API luboydomen (services/luboydomen.py): запросов в минуту на IP / на токен
+# и сколько запросов можно отправить пачкой без интервала
+LUBOYDOMEN_RATE_PER_IP = int(os.getenv("LUBOYDOMEN_RATE_PER_IP", "10"))
+LUBOYDOMEN_RATE_PER_TOKEN = int(os.getenv("LUBOYDOMEN_RATE_PER_TOKEN", "20"))
+LUBOYDOMEN_RATE_BURST = int(os.getenv("LUBOYDOMEN_RATE_BURST", "2"))
+# Массовым операциям (покупка, автопродление) — не больше стольких запросов в минуту,
+# остаток лимита — запас для интерактивных запросов (SMS, список номеров)
+LUBOYDOMEN_BULK_PER_MIN = int(os.getenv("LUBOYDOMEN_BULK_PER_MIN", "6"))
+# Справочник номеров luboydomen в памяти (services/number_directory.py)
+NUMBER_DIRECTORY_REFRESH_INTERVAL = int(os.getenv("NUMBER_DIRECTORY_REFRESH_INTERVAL", "600"))  # сек
+NUMBER_DIRECTORY_MISS_COOLDOWN = int(os.getenv("NUMBER_DIRECTORY_MISS_COOLDOWN", "60"))         # сек
+# Слежение за новыми SMS (services/sms_watcher.py): срок слежения, адаптивный интервал
+# опроса одного номера и общий бюджет опросов всех номеров в минуту
+SMS_WATCH_TIMEOUT = int(os.getenv("SMS_WATCH_TIMEOUT", "600"))            # сек
+SMS_WATCH_MIN_INTERVAL = int(os.getenv("SMS_WATCH_MIN_INTERVAL", "10"))   # сек
+SMS_WATCH_MAX_INTERVAL = int(os.getenv("SMS_WATCH_MAX_INTERVAL", "60"))   # сек
+SMS_WATCH_POLLS_PER_MIN = int(os.getenv("SMS_WATCH_POLLS_PER_MIN", "5"))
+# Сколько номеров покупать одним запросом (1 — по одному; больше — только если
+# API luboydomen принимает поле quantity и возвращает список numbers)
+LUBOYDOMEN_PURCHASE_BATCH = int(os.getenv("LUBOYDOMEN_PURCHASE_BATCH", "1"))
+
 # ID пользователей
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 TEAMLEADER_ID = int(os.getenv("TEAMLEADER_ID"))
 
+# Каталог локальных данных бота (SQLite: очереди, задачи, кэши)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+# Шлюз Google Sheets (services/sheets.py): потоков для блокирующих вызовов gspread
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "4"))
+# Очередь отложенной записи строк (services/sheets_queue.py)
+SHEETS_FLUSH_DELAY = float(os.getenv("SHEETS_FLUSH_DELAY", "2"))   # сек, окно сбора пачки
+SHEETS_FLUSH_BATCH = int(os.getenv("SHEETS_FLUSH_BATCH", "500"))   # строк за один append_rows
+# Фоновые массовые задачи (services/jobs.py): не чаще раза в столько секунд
+# редактировать сообщение о прогрессе
+JOBS_PROGRESS_INTERVAL = float(os.getenv("JOBS_PROGRESS_INTERVAL", "5"))
+
+# Рассылки (services/broadcaster.py): сообщений в секунду на всю рассылку,
+# параллельных получателей, интервал между сообщениями в один чат и число повторов
+BROADCAST_RATE_PER_SEC = int(os.getenv("BROADCAST_RATE_PER_SEC", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "25"))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", "1"))   # сек
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+
+# Кэш списка разрешённых пользователей (utils.is_user_allowed)
+ALLOWLIST_REFRESH_INTERVAL = int(os.getenv("ALLOWLIST_REFRESH_INTERVAL", "300"))              # сек
+ALLOWLIST_FORCE_REFRESH_COOLDOWN = int(os.getenv("ALLOWLIST_FORCE_REFRESH_COOLDOWN", "30"))  # сек
+
+# Снимок листа расходов (handlers/expenses.py)
+EXPENSES_REFRESH_INTERVAL = int(os.getenv("EXPENSES_REFRESH_INTERVAL", "600"))               # сек
+EXPENSES_FORCE_REFRESH_COOLDOWN = int(os.getenv("EXPENSES_FORCE_REFRESH_COOLDOWN", "60"))    # сек
+
+# Перевод лендингов (handlers/translation.py): не больше стольких одновременных
+# запросов к OpenAI на все переводы и не чаще раза в столько секунд — прогресс
+TRANSLATION_MAX_CONCURRENCY = int(os.getenv("TRANSLATION_MAX_CONCURRENCY", "8"))
+TRANSLATION_PROGRESS_INTERVAL = float(os.getenv("TRANSLATION_PROGRESS_INTERVAL", "3"))  # сек
+# Режим перевода HTML: "dom" — только текст и переводимые атрибуты пачками сегментов
+# не длиннее TRANSLATION_SEGMENT_BATCH_CHARS, "markup" — чанками разметки целиком
+TRANSLATION_HTML_MODE = os.getenv("TRANSLATION_HTML_MODE", "dom")
+TRANSLATION_SEGMENT_BATCH_CHARS = int(os.getenv("TRANSLATION_SEGMENT_BATCH_CHARS", "4000"))
+# Память переведённых фрагментов (services/translation_memory.py): предельный размер на диске
+TRANSLATION_MEMORY_MAX_MB = int(os.getenv("TRANSLATION_MEMORY_MAX_MB", "200"))
+# Готовые переводы лендингов целиком (services/translation_results.py): предельный объём архивов
+TRANSLATION_RESULTS_MAX_MB = int(os.getenv("TRANSLATION_RESULTS_MAX_MB", "500"))
+
 # Настройка Bugsnag
 import bugsnag
 if BUGSNAG_TOKEN:
@@ -1,7 +1,6 @@
 """
 Обработчики для включения/выключения автопродления номеров (только для админа и тимлидера)
 """
-import asyncio
 import logging
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
@@ -10,14 +9,20 @@ from aiogram.fsm.context import FSMContext
 from states import Form
 from keyboards import cancel_kb, get_menu_keyboard
 from utils import last_messages, delete_last_messages
-from config import ADMIN_ID, TEAMLEADER_ID
-from services.luboydomen import get_all_phone_numbers, toggle_auto_renewal
+from config import ADMIN_ID, TEAMLEADER_ID, LUBOYDOMEN_BULK_PER_MIN
+from services import jobs, number_directory
+from services.luboydomen import toggle_auto_renewal
+from services.rate_limit import PRIORITY_BULK
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Задержка между API запросами для избежания rate limit (в секундах)
-API_REQUEST_DELAY = 6
+# Примерный интервал между запросами (сек) — для оценки времени. Темп задаёт
+# ограничитель luboydomen (LUBOYDOMEN_BULK_PER_MIN запросов в минуту).
+API_REQUEST_DELAY = 60 // LUBOYDOMEN_BULK_PER_MIN
+
+# Вид фоновой задачи (services/jobs)
+AUTO_RENEWAL_JOB = "auto_renewal"
 
 # Максимальная длина сообщения в Telegram
 MAX_MESSAGE_LENGTH = 4000
@@ -45,45 +50,6 @@ def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list:
     return parts
 
 
-def find_numbers_by_queries(queries: list[str], all_numbers: list[dict]) -> tuple[list[dict], list[str]]:
-    """Ищет номера по списку запросов (номер телефона или custom_name).
-    Возвращает (найденные_номера, ненайденные_запросы)."""
-    found = []
-    not_found = []
-    found_ids = set()
-
-    for query in queries:
-        query_lower = query.lower().strip()
-        query_clean = query_lower.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-
-        matched = False
-        for number in all_numbers:
-            if number["piv_num_id"] in found_ids:
-                continue
-
-            phone = number.get("phone_number", "").replace(" ", "").replace("-", "")
-            custom_name = number.get("custom_name", "").lower()
-
-            # Поиск по номеру телефона
-            if query_clean and (query_clean in phone or phone.endswith(query_clean)):
-                found.append(number)
-                found_ids.add(number["piv_num_id"])
-                matched = True
-                break
-
-            # Поиск по custom_name
-            if query_lower and (query_lower == custom_name or query_lower in custom_name):
-                found.append(number)
-                found_ids.add(number["piv_num_id"])
-                matched = True
-                break
-
-        if not matched:
-            not_found.append(query)
-
-    return found, not_found
-
-
 @router.message(F.text == "🔄 Автопродление номеров")
 async def start_auto_renewal(message: Message, state: FSMContext):
     """Начинает процесс управления автопродлением (только для админа и тимлидера)"""
@@ -183,7 +149,7 @@ async def process_auto_renewal_numbers_input(message: Message, state: FSMContext
     progress_msg = await message.answer("🔄 Загружаю список номеров и ищу совпадения...")
 
     try:
-        result = await get_all_phone_numbers()
+        error = await number_directory.ensure()
     except Exception as e:
         try:
             await progress_msg.delete()
@@ -196,13 +162,12 @@ async def process_auto_renewal_numbers_input(message: Message, state: FSMContext
         await state.clear()
         return
 
-    try:
-        await progress_msg.delete()
-    except:
-        pass
-
-    if not result.get("success"):
-        error_detail = result.get("error", "") or result.get("detail", "")
+    if error is not None:
+        try:
+            await progress_msg.delete()
+        except:
+            pass
+        error_detail = error.get("error", "") or error.get("detail", "")
         await message.answer(
             f"❌ Не удалось получить список номеров.\n{error_detail}",
             reply_markup=get_menu_keyboard(message.from_user.id)
@@ -210,9 +175,11 @@ async def process_auto_renewal_numbers_input(message: Message, state: FSMContext
         await state.clear()
         return
 
-    all_numbers = result.get("data", {}).get("numbers", [])
-
-    if not all_numbers:
+    if not number_directory.count():
+        try:
+            await progress_msg.delete()
+        except:
+            pass
         await message.answer(
             "📭 Список номеров пуст.",
             reply_markup=get_menu_keyboard(message.from_user.id)
@@ -220,8 +187,13 @@ async def process_auto_renewal_numbers_input(message: Message, state: FSMContext
         await state.clear()
         return
 
-    # Ищем номера по введённым запросам
-    found_numbers, not_found_queries = find_numbers_by_queries(queries, all_numbers)
+    # Ищем номера по введённым запросам (по индексам справочника)
+    found_numbers, not_found_queries = await number_directory.find_many(queries)
+
+    try:
+        await progress_msg.delete()
+    except:
+        pass
 
     if not found_numbers:
         not_found_text = "\n".join(f"• {q}" for q in not_found_queries)
@@ -261,6 +233,11 @@ async def process_auto_renewal_numbers_input(message: Message, state: FSMContext
         name_text = f" ({custom_name})" if custom_name else ""
         confirm_text += f"{status_emoji} <code>{phone}</code>{name_text} — сейчас: {current_auto}\n"
 
+    unchanged_count = sum(1 for n in found_numbers if bool(n.get("auto_renew")) == auto_renew)
+    if unchanged_count:
+        confirm_text += (f"\n⏭ Уже в нужном состоянии: <b>{unchanged_count}</b> — "
+                         f"запросы для них не отправляются.\n")
+
     if not_found_queries:
         confirm_text += f"\n⚠️ <b>Не найдены ({len(not_found_queries)}):</b>\n"
         for q in not_found_queries:
@@ -302,7 +279,7 @@ async def cancel_auto_renewal_confirm(message: Message, state: FSMContext):
 
 @router.callback_query(F.data == "auto_renew_confirm", Form.confirming_auto_renewal)
 async def execute_auto_renewal(query: CallbackQuery, state: FSMContext):
-    """Запускает процесс изменения автопродления"""
+    """Ставит в очередь изменение автопродления (только для номеров, где оно меняется)"""
     data = await state.get_data()
     auto_renew = data.get("auto_renew", False)
     selected_numbers = data.get("selected_numbers", [])
@@ -315,91 +292,147 @@ async def execute_auto_renewal(query: CallbackQuery, state: FSMContext):
     await query.answer("🚀 Запускаю...")
 
     await delete_last_messages(query.from_user.id, query.message.bot)
+    await state.clear()
+
+    # Сверяем желаемое состояние со справочником — PATCH только для тех, где оно меняется
+    to_change, unchanged = [], []
+    for number in selected_numbers:
+        current = number_directory.get(number["piv_num_id"]) or number
+        (unchanged if bool(current.get("auto_renew")) == auto_renew else to_change).append(number)
+
+    if not to_change:
+        await query.message.answer(
+            f"⏭ <b>Все {len(unchanged)} номеров уже в нужном состоянии</b> — ничего менять не нужно.",
+            parse_mode="HTML",
+            reply_markup=get_menu_keyboard(query.from_user.id)
+        )
+        return
 
     action_text = "Включение" if auto_renew else "Выключение"
-    estimated_time = len(selected_numbers) * API_REQUEST_DELAY
+    estimated_time = len(to_change) * API_REQUEST_DELAY
 
     progress_msg = await query.message.answer(
         f"🔄 <b>{action_text} автопродления...</b>\n\n"
-        f"📊 Номеров: <b>{len(selected_numbers)}</b>\n"
+        f"📊 Номеров к изменению: <b>{len(to_change)}</b>\n"
+        f"⏭ Уже в нужном состоянии: <b>{len(unchanged)}</b>\n"
         f"⏱️ Примерное время: <b>~{estimated_time} сек.</b>\n\n"
-        f"Обработано: <b>0/{len(selected_numbers)}</b>\n"
-        f"<i>Пожалуйста, подождите...</i>",
+        f"Обработано: <b>0/{len(to_change)}</b>",
         parse_mode="HTML"
     )
 
-    success_list = []
-    error_list = []
+    # Изменение идёт фоновой задачей (services/jobs): переживает перезапуск бота,
+    # темп задаёт ограничитель luboydomen
+    job_id = jobs.enqueue(
+        AUTO_RENEWAL_JOB,
+        query.from_user.id,
+        query.message.chat.id,
+        {"auto_renew": auto_renew, "unchanged": unchanged},
+        to_change,
+        message_id=progress_msg.message_id,
+    )
 
-    for i, number in enumerate(selected_numbers):
-        try:
-            result = await toggle_auto_renewal(number["piv_num_id"], auto_renew)
-            logger.info(f"[auto_renewal] number={number['phone_number']} "
-                        f"piv_num_id={number['piv_num_id']} "
-                        f"auto_renew={auto_renew} result={result}")
-
-            # Проверяем ошибки
-            if result.get("error") or result.get("success") is False:
-                error_msg = result.get("error") or result.get("detail") or result.get("details") or str(result)
-                error_list.append(f"{number['phone_number']}: {error_msg}")
-                logger.warning(f"[auto_renewal] FAILED for {number['phone_number']}: {result}")
-            elif result.get("success") is True:
-                # Дополнительно проверяем, что auto_renew реально изменился в ответе
-                response_data = result.get("data", {})
-                actual_auto_renew = response_data.get("auto_renew")
-                if actual_auto_renew is not None and actual_auto_renew != auto_renew:
-                    error_list.append(
-                        f"{number['phone_number']}: API вернул success, но auto_renew={actual_auto_renew} "
-                        f"(ожидали {auto_renew})"
-                    )
-                    logger.warning(f"[auto_renewal] MISMATCH for {number['phone_number']}: "
-                                   f"expected auto_renew={auto_renew}, got {actual_auto_renew}")
-                else:
-                    success_list.append(number)
-            else:
-                # Неизвестный формат ответа
-                error_list.append(f"{number['phone_number']}: Неожиданный ответ: {str(result)[:200]}")
-                logger.warning(f"[auto_renewal] UNEXPECTED RESPONSE for {number['phone_number']}: {result}")
-        except Exception as e:
-            error_list.append(f"{number['phone_number']}: {str(e)}")
-            logger.exception(f"[auto_renewal] EXCEPTION for {number['phone_number']}")
-
-        # Обновляем прогресс
-        try:
-            await progress_msg.edit_text(
-                f"🔄 <b>{action_text} автопродления...</b>\n\n"
-                f"📊 Номеров: <b>{len(selected_numbers)}</b>\n\n"
-                f"Обработано: <b>{i + 1}/{len(selected_numbers)}</b>\n"
-                f"✅ Успешно: <b>{len(success_list)}</b>\n"
-                f"❌ Ошибок: <b>{len(error_list)}</b>\n"
-                f"<i>Пожалуйста, подождите...</i>",
-                parse_mode="HTML"
-            )
-        except Exception:
-            pass
+    await query.message.answer(
+        f"🆔 Задача <code>{job_id}</code>: итог пришлю сюда, когда всё будет готово.",
+        parse_mode="HTML",
+        reply_markup=get_menu_keyboard(query.from_user.id)
+    )
 
-        # Задержка между запросами (кроме последнего)
-        if i < len(selected_numbers) - 1:
-            await asyncio.sleep(API_REQUEST_DELAY)
 
-    # Удаляем сообщение о прогрессе
-    try:
-        await progress_msg.delete()
-    except:
-        pass
+async def _toggle_unit(bot, params: dict, number: dict) -> dict:
+    """Переключает автопродление одного номера — одна единица задачи"""
+    auto_renew = params["auto_renew"]
+    result = await toggle_auto_renewal(number["piv_num_id"], auto_renew)
+    logger.info(f"[auto_renewal] number={number['phone_number']} "
+                f"piv_num_id={number['piv_num_id']} "
+                f"auto_renew={auto_renew} result={result}")
+
+    # Проверяем ошибки
+    if result.get("error") or result.get("success") is False:
+        error_msg = result.get("error") or result.get("detail") or result.get("details") or str(result)
+        logger.warning(f"[auto_renewal] FAILED for {number['phone_number']}: {result}")
+        return {"ok": False, "error": error_msg}
+    if result.get("success") is not True:
+        # Неизвестный формат ответа
+        logger.warning(f"[auto_renewal] UNEXPECTED RESPONSE for {number['phone_number']}: {result}")
+        return {"ok": False, "error": f"Неожиданный ответ: {str(result)[:200]}"}
+
+    # Дополнительно проверяем, что auto_renew реально изменился в ответе
+    actual_auto_renew = result.get("data", {}).get("auto_renew")
+    if actual_auto_renew is not None and actual_auto_renew != auto_renew:
+        logger.warning(f"[auto_renewal] MISMATCH for {number['phone_number']}: "
+                       f"expected auto_renew={auto_renew}, got {actual_auto_renew}")
+        return {"ok": False,
+                "error": f"API вернул success, но auto_renew={actual_auto_renew} (ожидали {auto_renew})"}
+
+    number_directory.set_auto_renew(number["piv_num_id"], auto_renew)
+    return {"ok": True}
+
+
+def _toggle_progress(job: dict, units: list[dict]) -> str:
+    auto_renew = job["params"]["auto_renew"]
+    action_text = "Включение" if auto_renew else "Выключение"
+    processed = sum(1 for u in units if u["status"] in ("done", "failed"))
+    succeeded = sum(1 for u in units if u["status"] == "done")
+    title = f"✅ <b>{action_text} автопродления завершено</b>" if processed == len(units) \
+        else f"🔄 <b>{action_text} автопродления...</b>"
+    return (
+        f"{title}\n\n"
+        f"🆔 Задача: <code>{job['id']}</code>\n"
+        f"📊 Номеров к изменению: <b>{len(units)}</b>\n"
+        f"⏭ Уже в нужном состоянии: <b>{len(job['params']['unchanged'])}</b>\n\n"
+        f"Обработано: <b>{processed}/{len(units)}</b>\n"
+        f"✅ Успешно: <b>{succeeded}</b>\n"
+        f"❌ Ошибок: <b>{processed - succeeded}</b>"
+    )
 
-    # Формируем итоговое сообщение
-    action_done = "включено" if auto_renew else "выключено"
 
-    if success_list:
-        response = f"✅ <b>Автопродление {action_done} для {len(success_list)} номеров:</b>\n\n"
-        for number in success_list:
-            name_text = f" ({number['custom_name']})" if number.get("custom_name") else ""
-            response += f"• <code>{number['phone_number']}</code>{name_text}\n"
+def _number_line(number: dict) -> str:
+    name_text = f" ({number['custom_name']})" if number.get("custom_name") else ""
+    return f"• <code>{number['phone_number']}</code>{name_text}\n"
 
-        parts = split_message(response)
-        for part in parts:
-            await query.message.answer(part, parse_mode="HTML")
+
+async def _toggle_finish(bot, job: dict, units: list[dict]) -> None:
+    """Итог с проверкой: список номеров перечитывается одним проходом и сверяется"""
+    chat_id = job["chat_id"]
+    auto_renew = job["params"]["auto_renew"]
+    action_done = "включено" if auto_renew else "выключено"
+
+    # Свой запрос после переключений: фоновое обновление, начатое раньше, вернуло бы прежнее состояние
+    refresh_error = await number_directory.refresh(PRIORITY_BULK, fresh=True)
+
+    verified, not_confirmed, error_list = [], [], []
+    for unit in units:
+        number = unit["payload"]
+        if unit["status"] != "done":
+            error_list.append(f"{number['phone_number']}: {(unit['result'] or {}).get('error')}")
+            continue
+        current = number_directory.get(number["piv_num_id"]) if refresh_error is None else None
+        if current is not None and bool(current.get("auto_renew")) != auto_renew:
+            not_confirmed.append(number)
+        else:
+            verified.append(number)
+
+    if verified:
+        response = f"✅ <b>Автопродление {action_done} для {len(verified)} номеров:</b>\n\n"
+        response += "".join(_number_line(number) for number in verified)
+        if refresh_error is not None:
+            response += "\n<i>Не удалось перечитать список номеров — результат по ответам API.</i>\n"
+        for part in split_message(response):
+            await bot.send_message(chat_id, part, parse_mode="HTML")
+
+    unchanged = job["params"]["unchanged"]
+    if unchanged:
+        response = f"⏭ <b>Уже было {action_done} ({len(unchanged)}):</b>\n\n"
+        response += "".join(_number_line(number) for number in unchanged)
+        for part in split_message(response):
+            await bot.send_message(chat_id, part, parse_mode="HTML")
+
+    if not_confirmed:
+        response = (f"⚠️ <b>API ответил успехом, но в списке номеров автопродление "
+                    f"не {action_done} ({len(not_confirmed)}):</b>\n\n")
+        response += "".join(_number_line(number) for number in not_confirmed)
+        for part in split_message(response):
+            await bot.send_message(chat_id, part, parse_mode="HTML")
 
     if error_list:
         errors_text = f"❌ <b>Ошибки ({len(error_list)}):</b>\n\n"
@@ -407,17 +440,12 @@ async def execute_auto_renewal(query: CallbackQuery, state: FSMContext):
             errors_text += f"• {error}\n"
         if len(error_list) > 10:
             errors_text += f"<i>...и еще {len(error_list) - 10} ошибок</i>\n"
-        await query.message.answer(errors_text, parse_mode="HTML")
+        await bot.send_message(chat_id, errors_text, parse_mode="HTML")
 
-    if not success_list and not error_list:
-        await query.message.answer(
-            "❌ Не удалось обработать ни одного номера.",
-            parse_mode="HTML"
-        )
-
-    await query.message.answer(
-        "Выберите действие:",
-        reply_markup=get_menu_keyboard(query.from_user.id)
-    )
-    await state.clear()
 
+jobs.register(
+    AUTO_RENEWAL_JOB,
+    run_unit=_toggle_unit,
+    progress_text=_toggle_progress,
+    finish=_toggle_finish,
+)
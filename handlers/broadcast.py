@@ -1,18 +1,24 @@
 """
 Система рассылки сообщений (доступно только админу и тимлидеру)
 """
-import gspread
+import logging
+
 import bugsnag
 from aiogram import Router, F
-from aiogram.types import Message, ContentType
+from aiogram.types import Message, CallbackQuery, ContentType, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 
 from states import Form
 from keyboards import cancel_kb, get_menu_keyboard
-from utils import last_messages, get_user_ids_from_sheet
-from config import ADMIN_ID, TEAMLEADER_ID
+from utils import last_messages, get_allowed_user_ids
+from config import ADMIN_ID, TEAMLEADER_ID, BROADCAST_WORKERS
+from services import broadcaster, jobs
 
 router = Router()
+logger = logging.getLogger(__name__)
+
+# Вид фоновой задачи (services/jobs)
+BROADCAST_JOB = "broadcast"
 
 @router.message(F.text == "📢 Сделать рассылку")
 async def admin_broadcast_start(message: Message, state: FSMContext):
@@ -55,7 +61,7 @@ async def send_broadcast(message: Message, state: FSMContext):
         return
 
     await status_msg.edit_text("📋 Получение списка пользователей...")
-    user_ids = get_user_ids_from_sheet()
+    user_ids = await get_allowed_user_ids()
 
     if not user_ids:
         await status_msg.edit_text("⚠️ Список пользователей пуст. Рассылка отменена.")
@@ -63,78 +69,132 @@ async def send_broadcast(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    total_users = len(user_ids)
-    success_count = 0
-    fail_count = 0
+    # Заблокировавшим бота в прошлых рассылках не пишем
+    blocked = broadcaster.blocked_user_ids()
+    skipped = sum(1 for user_id in user_ids if user_id in blocked)
+    user_ids = [user_id for user_id in user_ids if user_id not in blocked]
 
     # Определяем от кого рассылка
     sender_name = "👑 админа" if message.from_user.id == ADMIN_ID else "👨‍💼 тимлидера"
+    parts = [{"text": f"*📢 Сообщение от {sender_name}*", "parse_mode": "Markdown"}]
+    parts += [{"from_chat_id": msg["chat_id"], "message_id": msg["message_id"]} for msg in messages]
+
+    await status_msg.edit_text(f"📢 Начинаю рассылку для {len(user_ids)} пользователей...")
+
+    # Рассылка — фоновая задача (services/jobs): ссылки на сообщения и снимок списка
+    # получателей хранятся на диске, после перезапуска отправка продолжится
+    job_id = jobs.enqueue(
+        BROADCAST_JOB,
+        message.from_user.id,
+        message.chat.id,
+        {"parts": parts, "skipped": skipped},
+        [{"chat_id": user_id} for user_id in user_ids],
+        message_id=status_msg.message_id,
+    )
+    logger.info("[broadcast] задача %s: получателей %s, пропущено %s", job_id, len(user_ids), skipped)
+
+    await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
+    await state.clear()
+
+
+async def _deliver_unit(bot, params: dict, payload: dict) -> dict:
+    """Доставляет рассылку одному получателю — одна единица задачи.
+
+    payload["start"] — сколько частей уже доставлено (при повторе после ошибки
+    отправка продолжается со следующей части, без дублей).
+    """
+    user_id = payload["chat_id"]
+    status, sent, error = await broadcaster.send_to_chat(bot, user_id, params["parts"], payload.get("start", 0))
+    if status == broadcaster.BLOCKED:
+        broadcaster.mark_blocked(user_id, error)
+    elif status == broadcaster.FAILED:
+        bugsnag.notify(Exception(error), meta_data={
+            "function": "send_broadcast",
+            "user_id": user_id,
+            "parts_sent": sent,
+        })
+    return {"ok": status == broadcaster.SENT, "status": status, "parts_sent": sent, "error": error,
+            "resume": {"start": sent}}
+
+
+def _delivery_counts(units: list[dict]) -> dict:
+    counts = {broadcaster.SENT: 0, broadcaster.FAILED: 0, broadcaster.BLOCKED: 0, "pending": 0}
+    for unit in units:
+        counts[unit["status"] if unit["status"] in counts else "pending"] += 1
+    return counts
+
+
+def _broadcast_progress(job: dict, units: list[dict]) -> str:
+    counts = _delivery_counts(units)
+    total_users = len(units)
+    done = total_users - counts["pending"]
+    return (
+        f"📢 Рассылка в процессе...\n"
+        f"🆔 Задача: {job['id']}\n"
+        f"Прогресс: {done}/{total_users}\n"
+        f"✅ Отправлено: {counts[broadcaster.SENT]}\n"
+        f"❌ Ошибок: {counts[broadcaster.FAILED] + counts[broadcaster.BLOCKED]}"
+    )
 
-    await status_msg.edit_text(f"📢 Начинаю рассылку для {total_users} пользователей...")
-
-    for i, user_id in enumerate(user_ids, 1):
-        user_success = True
-        try:
-            # Отправляем заголовок
-            await message.bot.send_message(
-                user_id,
-                text=f"*📢 Сообщение от {sender_name}*",
-                parse_mode="Markdown"
-            )
-
-            # Отправляем все сообщения рассылки
-            for msg in messages:
-                try:
-                    await message.bot.copy_message(
-                        chat_id=user_id,
-                        from_chat_id=msg["chat_id"],
-                        message_id=msg["message_id"]
-                    )
-                except Exception as e:
-                    bugsnag.notify(e, meta_data={
-                        "function": "send_broadcast",
-                        "user_id": user_id,
-                        "message_id": msg["message_id"],
-                        "error_type": "message_copy_error"
-                    })
-                    print(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
-                    user_success = False
-                    break
-
-        except Exception as e:
-            bugsnag.notify(e, meta_data={
-                "function": "send_broadcast",
-                "user_id": user_id,
-                "error_type": "header_send_error"
-            })
-            print(f"Ошибка при отправке заголовка пользователю {user_id}: {e}")
-            user_success = False
-
-        if user_success:
-            success_count += 1
-        else:
-            fail_count += 1
-
-        # Обновляем прогресс каждые 10 пользователей или в конце
-        if i % 10 == 0 or i == total_users:
-            await status_msg.edit_text(
-                f"📢 Рассылка в процессе...\n"
-                f"Прогресс: {i}/{total_users}\n"
-                f"✅ Отправлено: {success_count}\n"
-                f"❌ Ошибок: {fail_count}"
-            )
-
-    await status_msg.edit_text(
+
+async def _broadcast_finish(bot, job: dict, units: list[dict]) -> None:
+    """Итог рассылки; при ошибках доставки — кнопка повтора только для них"""
+    counts = _delivery_counts(units)
+    total_users = len(units)
+    success_count = counts[broadcaster.SENT]
+    text = (
         f"✅ Рассылка завершена!\n\n"
         f"📊 Статистика:\n"
+        f"🆔 Задача: {job['id']}\n"
         f"👥 Всего пользователей: {total_users}\n"
         f"✅ Успешно отправлено: {success_count}\n"
-        f"❌ Не доставлено: {fail_count}\n"
-        f"📈 Успешность: {round(success_count/total_users*100, 1)}%"
+        f"❌ Не доставлено: {counts[broadcaster.FAILED]}\n"
+        f"🚫 Заблокировали бота: {counts[broadcaster.BLOCKED]}\n"
+        f"⏭ Пропущено (заблокировали ранее): {job['params']['skipped']}\n"
+        f"📈 Успешность: {round(success_count/max(total_users, 1)*100, 1)}%"
     )
+    markup = None
+    if counts[broadcaster.FAILED]:
+        markup = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+            text=f"🔁 Повторить для не получивших ({counts[broadcaster.FAILED]})",
+            callback_data=f"broadcast_retry:{job['id']}",
+        )]])
+    try:
+        await bot.edit_message_text(text, chat_id=job["chat_id"], message_id=job["message_id"],
+                                    reply_markup=markup)
+    except Exception:
+        await bot.send_message(job["chat_id"], text, reply_markup=markup)
+
+
+@router.callback_query(F.data.startswith("broadcast_retry:"))
+async def retry_broadcast(query: CallbackQuery):
+    """Повторяет рассылку только для получателей с ошибкой доставки"""
+    if query.from_user.id not in [ADMIN_ID, TEAMLEADER_ID]:
+        await query.answer("❌ У вас нет доступа к этой функции.", show_alert=True)
+        return
 
-    await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
-    await state.clear()
+    job_id = query.data.split(":", 1)[1]
+    status_msg = await query.message.answer("🔄 Повтор рассылки...")
+    count = jobs.retry_failed(job_id, message_id=status_msg.message_id)
+    if not count:
+        await status_msg.edit_text("⚠️ Повторять нечего: рассылка ещё идёт или все получили сообщения.")
+        await query.answer()
+        return
+
+    try:
+        await query.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await query.answer(f"🔁 Повторяю для {count} получателей")
+
+
+jobs.register(
+    BROADCAST_JOB,
+    run_unit=_deliver_unit,
+    progress_text=_broadcast_progress,
+    finish=_broadcast_finish,
+    concurrency=BROADCAST_WORKERS,
+)
 
 @router.message(Form.broadcast_collecting, F.text == "❌ Отмена")
 async def cancel_broadcast(message: Message, state: FSMContext):
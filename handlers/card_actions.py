@@ -41,10 +41,13 @@ CARD_STATES = (
     Form.card_actions_choose_period,
     Form.card_actions_enter_period,
 )
+from config import ADMIN_ID, TEAMLEADER_ID
 from utils import last_messages, delete_last_messages
 import services.adscard as adscard
 import services.multicards as multicards
 import services.ecards as ecards
+import services.ecards_ledger as ecards_ledger
+import services.card_directory as card_directory
 
 logger = logging.getLogger(__name__)
 
@@ -57,6 +60,8 @@ ADSCARD_TRANSACTIONS_TIME = "month"
 # сколько показывать на одной странице листалки (◀ ▶).
 ECARDS_GROUP_TX_LIMIT = 50
 ECARDS_TX_PAGE = 5
+# Сколько последних строк «день/валюта» показывать админу в разбивке расхода.
+MAX_SPEND_DAYS = 62
 
 BANK_LABELS = {"adscard": "AdsCard", "multicards": "MultiCards", "ecards": "eCards"}
 
@@ -202,11 +207,8 @@ def format_card_summary(bank: str, card: dict) -> str:
 
 
 async def _find_card(bank: str, number: str):
-    if bank == "adscard":
-        return await adscard.find_card_by_number(number)
-    if bank == "ecards":
-        return await ecards.find_card_by_number(number)
-    return await multicards.find_card_by_number(number)
+    # Поиск по справочнику карт в памяти; API банка — только при промахе.
+    return await card_directory.find_card(bank, number)
 
 
 async def _show_action_menu(target, user_id: int, state: FSMContext, bank: str, card_number) -> None:
@@ -374,28 +376,34 @@ async def _run_group_spend(target, user_id: int, state: FSMContext, start: str,
         await _safe_delete(progress)
         return
 
-    operations = []
-    failed = False
-    for gid, _ in my_groups:
-        result = await ecards.get_all_group_operations(gid, start, end)
-        if _is_error(result):
-            failed = True
-            break
-        operations.extend(result if isinstance(result, list) else [])
+    fetched = await ecards_ledger.get_spend([gid for gid, _ in my_groups], start, end)
+    failed = fetched["failed"]
     await _safe_delete(progress)
 
-    if failed:
+    if len(failed) == len(my_groups):
         await target.answer("❌ Не удалось получить операции. Попробуйте позже.")
         await _ecards_show_group_menu(target, user_id, state)
         return
 
-    totals = ecards.sum_spend_by_currency(operations)
+    totals = fetched["totals"]
     lines = ["💸 <b>Расход по вашим картам</b>", f"Период: {_fmt_period(start, end)}", ""]
     if not totals:
         lines.append("Расход за период отсутствует.")
     else:
         for currency, amount in sorted(totals.items()):
             lines.append(f"<b>{round(amount, 2)}</b> {currency}")
+    if failed:
+        failed_titles = ", ".join(name for gid, name in my_groups if gid in failed)
+        lines += ["", f"⚠️ Не удалось загрузить группы: {failed_titles}. "
+                      "Итог неполный — попробуйте позже."]
+    if fetched["truncated"]:
+        lines += ["", "⚠️ Операций слишком много — учтены не все (предел выгрузки). "
+                      "Выберите период короче."]
+    if user_id in (ADMIN_ID, TEAMLEADER_ID) and fetched["days"]:
+        # Админам — разбивка по дням (готовые дневные итоги журнала).
+        lines += ["", "📅 <b>По дням:</b>"]
+        for day, currency, amount in fetched["days"][-MAX_SPEND_DAYS:]:
+            lines.append(f"{day[8:10]}.{day[5:7]}: {round(amount, 2)} {currency}")
 
     await target.answer("\n".join(lines), parse_mode="HTML")
     await _ecards_show_group_menu(target, user_id, state)
@@ -413,19 +421,14 @@ async def _run_group_transactions(target, user_id: int, state: FSMContext,
         await _safe_delete(progress)
         return
 
-    operations = []
-    failed = False
-    for gid, _ in my_groups:
-        result = await ecards.get_card_operations(
-            start, end, group_ids=[gid], limit=ECARDS_GROUP_TX_LIMIT
-        )
-        if _is_error(result):
-            failed = True
-            break
-        operations.extend(ecards._as_list(result))
+    # Одним запросом по всем группам: API сортирует по дате, первой страницы хватает.
+    result = await ecards.get_card_operations(
+        start, end, group_ids=[gid for gid, _ in my_groups], limit=ECARDS_GROUP_TX_LIMIT
+    )
+    operations = [] if _is_error(result) else ecards._as_list(result)
     await _safe_delete(progress)
 
-    if failed:
+    if _is_error(result):
         await target.answer("❌ Не удалось получить транзакции. Попробуйте позже.")
         await _ecards_show_group_menu(target, user_id, state)
         return
@@ -913,6 +916,7 @@ async def card_limit_entered(message: Message, state: FSMContext):
     if _is_error(result):
         await message.answer("❌ Не удалось изменить лимит. Попробуйте позже.")
     else:
+        card_directory.invalidate(bank)
         applied = _applied_limit(bank, kind, result, limit)
         kind_label = {"adscard": "Лимит", "total": "Глобальный лимит", "daily": "Дневной лимит"}[kind]
         await message.answer(
@@ -978,6 +982,9 @@ async def card_block_confirmed(query: CallbackQuery, state: FSMContext):
     except Exception:
         pass
 
+    if not _is_error(result):
+        card_directory.invalidate(bank)
+
     if _is_error(result):
         await query.message.answer("❌ Не удалось заблокировать карту. Попробуйте позже.")
     elif not _block_confirmed(bank, result):
@@ -16,6 +16,7 @@ from aiogram.types import Message
 from keyboards import get_menu_keyboard
 from utils import is_user_allowed
 import services.ecards as ecards
+import services.ecards_ledger as ecards_ledger
 
 logger = logging.getLogger(__name__)
 
@@ -29,7 +30,7 @@ def _is_error(result) -> bool:
 @router.message(F.text == "💸 Расход по группе")
 async def show_group_expenses(message: Message):
     """Считает и показывает нетто-расход по группам байера за текущий месяц."""
-    if not is_user_allowed(message.from_user.id):
+    if not await is_user_allowed(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
 
@@ -66,28 +67,22 @@ async def show_group_expenses(message: Message):
         return
 
     start, end = ecards.current_cycle_period()
-    operations = []
-    failed = False
-    for gid, _ in my_groups:
-        ops_result = await ecards.get_all_group_operations(gid, start, end)
-        if _is_error(ops_result):
-            failed = True
-            break
-        operations.extend(ops_result if isinstance(ops_result, list) else [])
+    fetched = await ecards_ledger.get_spend([gid for gid, _ in my_groups], start, end)
+    failed = fetched["failed"]
 
     try:
         await progress.delete()
     except Exception:
         pass
 
-    if failed:
+    if len(failed) == len(my_groups):
         await message.answer(
             "❌ Не удалось получить операции по картам. Попробуйте позже.",
             reply_markup=menu_kb,
         )
         return
 
-    totals = ecards.sum_spend_by_currency(operations)
+    totals = fetched["totals"]
     group_titles = ", ".join(name for _, name in my_groups)
     period = f"{ecards.kyiv_date(start)} — {ecards.kyiv_date(end)}"
 
@@ -104,4 +99,13 @@ async def show_group_expenses(message: Message):
             # Нетто = списания минус возвраты; округляем до 2 знаков.
             lines.append(f"<b>{round(amount, 2)}</b> {currency}")
 
+    if failed:
+        # Частичный результат: суммы выше — без этих групп.
+        failed_titles = ", ".join(name for gid, name in my_groups if gid in failed)
+        lines += ["", f"⚠️ Не удалось загрузить группы: {failed_titles}. "
+                      "Итог неполный — попробуйте позже."]
+    if fetched["truncated"]:
+        lines += ["", "⚠️ Операций слишком много — учтены не все (предел выгрузки). "
+                      "Обратитесь к администратору."]
+
     await message.answer("\n".join(lines), parse_mode="HTML", reply_markup=menu_kb)
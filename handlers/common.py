@@ -10,12 +10,15 @@ from keyboards import get_menu_keyboard, cancel_kb
 from utils import (last_messages, delete_last_messages, update_linked_messages,
                      send_notification_to_admins)
 from config import ADMIN_ID, TEAMLEADER_ID
+from services import broadcaster, luboydomen, translation_memory
 
 router = Router()
 
 @router.message(Command("start"))
 async def send_welcome(message: Message):
     """Обрабатывает команду /start"""
+    # Пользователь снова пишет боту — если он был в списке заблокировавших, рассылки возобновляются
+    broadcaster.unblock(message.from_user.id)
     if message.from_user.id == ADMIN_ID:
         await message.answer("👑 Админ-панель:", reply_markup=get_menu_keyboard(message.from_user.id))
     elif message.from_user.id == TEAMLEADER_ID:
@@ -23,6 +26,31 @@ async def send_welcome(message: Message):
     else:
         await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
 
+@router.message(Command("stats"))
+async def show_stats(message: Message):
+    """Показывает админам состояние очередей к внешним API (/stats)"""
+    if message.from_user.id not in (ADMIN_ID, TEAMLEADER_ID):
+        return
+
+    lines = ["📈 <b>Очередь запросов luboydomen</b>"]
+    stats = luboydomen.limiter_stats()
+    if not stats:
+        lines.append("Запросов ещё не было.")
+    for label, item in stats.items():
+        lines.append(
+            f"{label}: в очереди {item['queued']}, обслужено {item['served']}, "
+            f"ожидание ср. {item['avg_wait']:.1f} с / макс. {item['max_wait']:.1f} с"
+        )
+
+    memory = translation_memory.stats()
+    lines.append("")
+    lines.append("♻️ <b>Память переводов</b>")
+    lines.append(
+        f"фрагментов {memory['entries']} ({memory['bytes'] / 1024 / 1024:.1f} МБ), "
+        f"с запуска: из памяти {memory['hits']}, переведено {memory['misses']}"
+    )
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
 @router.callback_query(F.data.startswith("approve:"))
 async def approve_request(query: CallbackQuery):
     """Одобряет заявку пользователя"""
@@ -1,77 +1,126 @@
 """
 Обработчики для системы получения данных по расходам
 """
+import asyncio
+import time
+from typing import Dict, Optional
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
-import gspread
 import bugsnag
-from config import GOOGLE_SHEET_ID, ADMIN_ID, TEAMLEADER_ID
+from config import (ADMIN_ID, TEAMLEADER_ID,
+                    EXPENSES_REFRESH_INTERVAL, EXPENSES_FORCE_REFRESH_COOLDOWN)
 from utils import is_user_allowed, last_messages, delete_last_messages
 from keyboards import cancel_kb, get_menu_keyboard
 from states import Form
+from services import sheets
 
 router = Router()
 
-def get_expense_data(user_id: int) -> str:
-    """Получает данные по расходу пользователя из 3-й таблицы Google Sheets"""
-    try:
-        gc = gspread.service_account(filename='credentials.json')
-        table = gc.open_by_key(GOOGLE_SHEET_ID)
-        worksheet = table.get_worksheet(3)  # Таблица под индексом 3
-
-        # Получаем все значения первого столбца начиная со второй строки
-        user_ids_column = worksheet.col_values(1)[1:]  # Пропускаем заголовок
-
-        # Ищем пользователя по ID
-        for i, cell_value in enumerate(user_ids_column, start=2):  # +2 потому что пропустили заголовок и индекс начинается с 1
-            if cell_value.strip() == str(user_id):
-                # Получаем значение из второго столбца той же строки
-                expense_value = worksheet.cell(i, 2).value
-                if expense_value:
-                    return f"💸 Ваш расход за текущий период: ${expense_value}"
-                else:
-                    return "Данные не найдены. Обратитесь к администратору."
+# Снимок листа расходов: ID байера -> строка листа (ID, Расход, Имя, ...).
+# Загружается одним get_all_values и обновляется фоновой задачей
+# expenses_refresher; обработчики читают его из памяти. Если байера нет в
+# снимке — внеочередное обновление (не чаще EXPENSES_FORCE_REFRESH_COOLDOWN).
+_snapshot: Dict[str, list] = {}
+_snapshot_loaded_at: float = 0.0     # unix-время последнего успешного обновления
+_last_forced_refresh: float = 0.0    # monotonic-время последнего внеочередного обновления
+_snapshot_lock = asyncio.Lock()
+_background_refresh: Optional[asyncio.Task] = None
+
+
+async def refresh_expenses_snapshot() -> bool:
+    """Перечитывает лист расходов в снимок. True при успехе (иначе снимок прежний)."""
+    global _snapshot, _snapshot_loaded_at
+    async with _snapshot_lock:
+        try:
+            all_data = (await sheets.get_all_values(sheets.WS_EXPENSES))[1:]  # Пропускаем заголовок
+        except Exception as e:
+            bugsnag.notify(e, meta_data={"context": "refresh_expenses_snapshot"})
+            return False
+
+        snapshot = {}
+        for row in all_data:
+            if row and row[0].strip():
+                snapshot[row[0].strip()] = row
+        _snapshot = snapshot
+        _snapshot_loaded_at = time.time()
+        return True
+
+
+async def _ensure_snapshot() -> bool:
+    """Гарантирует, что снимок загружен; устаревший обновляет в фоне. False — данных нет."""
+    global _background_refresh
+    if not _snapshot_loaded_at:
+        return await refresh_expenses_snapshot()
+    if time.time() - _snapshot_loaded_at > EXPENSES_REFRESH_INTERVAL * 2:
+        if _background_refresh is None or _background_refresh.done():
+            _background_refresh = asyncio.create_task(refresh_expenses_snapshot())
+    return True
+
+
+async def _refresh_if_missing(buyer_ids: list) -> None:
+    """Обновляет снимок по требованию, если кого-то из байеров в нём нет."""
+    global _last_forced_refresh
+    if all(bid in _snapshot for bid in buyer_ids):
+        return
+    now = time.monotonic()
+    if now - _last_forced_refresh >= EXPENSES_FORCE_REFRESH_COOLDOWN:
+        _last_forced_refresh = now
+        await refresh_expenses_snapshot()
+
 
-        return "Данные не найдены. Обратитесь к администратору."
-    except Exception as e:
-        bugsnag.notify(e, meta_data={"context": "get_expense_data", "user_id": user_id})
+def snapshot_age_text() -> str:
+    """Возраст снимка для ответа пользователю."""
+    age = int(time.time() - _snapshot_loaded_at)
+    if age < 60:
+        return "🕒 Данные обновлены только что"
+    if age < 3600:
+        return f"🕒 Данные обновлены {age // 60} мин. назад"
+    return f"🕒 Данные обновлены {age // 3600} ч. назад"
+
+
+async def expenses_refresher():
+    """Фоновая задача: периодически обновляет снимок листа расходов."""
+    while True:
+        await refresh_expenses_snapshot()
+        await asyncio.sleep(EXPENSES_REFRESH_INTERVAL)
+
+
+async def get_expense_data(user_id: int) -> str:
+    """Получает данные по расходу пользователя из снимка 3-й таблицы Google Sheets"""
+    if not await _ensure_snapshot():
         return "Ошибка при получении данных о расходе."
 
-def get_multiple_expenses_data(user_ids: list) -> dict:
-    """Получает данные по расходу для нескольких пользователей из 3-й таблицы Google Sheets"""
-    try:
-        gc = gspread.service_account(filename='credentials.json')
-        table = gc.open_by_key(GOOGLE_SHEET_ID)
-        worksheet = table.get_worksheet(3)  # Таблица под индексом 3
+    await _refresh_if_missing([str(user_id)])
+    row = _snapshot.get(str(user_id))
+    expense_value = row[1] if row and len(row) > 1 else None
+    if expense_value:
+        return f"💸 Ваш расход за текущий период: ${expense_value}\n{snapshot_age_text()}"
 
-        # Получаем все данные из первых трех столбцов (ID, Расход, Имя)
-        all_data = worksheet.get_all_values()[1:]  # Пропускаем заголовок
+    return "Данные не найдены. Обратитесь к администратору."
 
-        result = {}
-        for row in all_data:
-            if len(row) >= 3 and row[0].strip():
-                row_id = row[0].strip()
-                if row_id in user_ids:
-                    result[row_id] = {
-                        'expense': row[1] if len(row) > 1 else 'N/A',
-                        'name': row[2] if len(row) > 2 else 'N/A'
-                    }
-
-        return result
-    except Exception as e:
-        bugsnag.notify(e, meta_data={"context": "get_multiple_expenses_data", "user_ids": user_ids})
+async def get_multiple_expenses_data(user_ids: list) -> dict:
+    """Получает данные по расходу для нескольких пользователей из снимка 3-й таблицы Google Sheets"""
+    if not await _ensure_snapshot():
         return {}
 
+    await _refresh_if_missing(user_ids)
+    result = {}
+    for bid in user_ids:
+        row = _snapshot.get(bid)
+        if row is not None and len(row) >= 3:
+            result[bid] = {'expense': row[1], 'name': row[2]}
+    return result
+
 @router.message(F.text == "💸 Получить данные по расходу")
 async def get_expense_info(message: Message):
     """Обрабатывает запрос на получение данных по расходу"""
-    if not is_user_allowed(message.from_user.id):
+    if not await is_user_allowed(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
 
     user_id = message.from_user.id
-    expense_info = get_expense_data(user_id)
+    expense_info = await get_expense_data(user_id)
     await message.answer(expense_info)
 
 @router.message(F.text == "📊 Получить расход по байеру")
@@ -112,7 +161,7 @@ async def process_buyer_id(message: Message, state: FSMContext):
     # Если один ID - используем старую логику
     if len(buyer_ids) == 1:
         buyer_id = buyer_ids[0]
-        expense_info = get_expense_data(buyer_id)
+        expense_info = await get_expense_data(buyer_id)
 
         if "Данные не найдены" in expense_info:
             await message.answer(f"❌ Байер с ID {buyer_id} не найден в системе.\nПроверьте правильность введенного ID или проверьте таблицу.")
@@ -121,7 +170,7 @@ async def process_buyer_id(message: Message, state: FSMContext):
     else:
         # Получаем данные для нескольких ID
         buyer_ids_str_list = [str(bid) for bid in buyer_ids]
-        expenses_data = get_multiple_expenses_data(buyer_ids_str_list)
+        expenses_data = await get_multiple_expenses_data(buyer_ids_str_list)
 
         if not expenses_data:
             await message.answer("❌ Не удалось получить данные. Проверьте подключение к таблице.")
@@ -159,6 +208,7 @@ async def process_buyer_id(message: Message, state: FSMContext):
                 response += f"\n❌ Не найдены: {', '.join(not_found)}"
 
             response += f"\n\n✅ Найдено: {found_count} из {len(buyer_ids)}"
+            response += f"\n{snapshot_age_text()}"
 
             await message.answer(response)
 
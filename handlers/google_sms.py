@@ -2,42 +2,57 @@
 Обработчики для получения SMS кодов Google Ads
 """
 from datetime import datetime
-from aiogram import Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from states import Form
 from keyboards import cancel_kb, get_menu_keyboard, get_google_sms_keyboard
 from utils import last_messages, delete_last_messages
-from services.luboydomen import get_all_phone_numbers, get_sms_messages
+from config import SMS_WATCH_TIMEOUT
+from services import number_directory, sms_watcher
+from services.luboydomen import get_sms_messages
 
 router = Router()
 
 
 async def find_number_by_query(query: str) -> dict | None:
-    """Ищет номер по номеру телефона или custom_name"""
-    result = await get_all_phone_numbers()
+    """Ищет номер по номеру телефона или custom_name (справочник номеров в памяти)"""
+    return await number_directory.find(query)
 
-    if not result.get("success") or not result.get("data", {}).get("numbers"):
-        return None
 
-    query_lower = query.lower().strip()
-    # Удаляем пробелы и дефисы для сравнения номеров
-    query_clean = query_lower.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-
-    for number in result["data"]["numbers"]:
-        phone = number.get("phone_number", "").replace(" ", "").replace("-", "")
-        custom_name = number.get("custom_name", "").lower()
-
-        # Поиск по номеру телефона
-        if query_clean in phone or phone.endswith(query_clean):
-            return number
-
-        # Поиск по custom_name
-        if query_lower == custom_name or query_lower in custom_name:
-            return number
+def format_sms_time(received_at: str) -> str:
+    """Время получения SMS в формате ДД.ММ.ГГГГ ЧЧ:ММ:СС"""
+    if not received_at:
+        return "Неизвестно"
+    try:
+        dt = datetime.fromisoformat(received_at.replace("+00:00", "+00:00"))
+        return dt.strftime("%d.%m.%Y %H:%M:%S")
+    except:
+        return received_at
+
+
+def start_sms_watch(bot: Bot, user_id: int, number_id, phone_number: str) -> None:
+    """Ставит номер на слежение: новые SMS приходят пользователю сами"""
+
+    async def on_sms(sms: dict):
+        code = sms.get("verification_code")
+        text = f"📩 <b>Новое SMS на {phone_number}</b>\n\n"
+        text += f"📤 От: <b>{sms.get('from_number', 'Неизвестно')}</b>\n"
+        text += f"⏰ Время: <b>{format_sms_time(sms.get('received_at', ''))}</b>\n"
+        if code:
+            text += f"🔑 <b>КОД: <code>{code}</code></b>\n"
+        text += f"💬 Текст: {sms.get('message_body', '')}"
+        await bot.send_message(user_id, text, parse_mode="HTML")
+
+    async def on_expire():
+        await bot.send_message(
+            user_id,
+            f"⌛ Ожидание новых SMS на {phone_number} завершено. "
+            f"Чтобы ждать ещё, нажмите «🔔 Ждать новые коды».",
+        )
 
-    return None
+    sms_watcher.watch(user_id, number_id, on_sms, on_expire)
 
 
 @router.message(F.text == "📱 Получить SMS Google Ads")
@@ -149,12 +164,16 @@ async def process_sms_count(message: Message, state: FSMContext):
     data = await state.get_data()
     phone_number = data.get("phone_number")
 
+    # Сразу ставим номер на слежение — новые коды придут без нажатий
+    start_sms_watch(message.bot, message.from_user.id, data.get("number_id"), phone_number)
+
     m1 = await message.answer(
         f"📱 <b>Номер: {phone_number}</b>\n"
         f"📊 Показывать: <b>{sms_count}</b> последних SMS\n\n"
+        f"🔔 Новые коды пришлю сюда автоматически в течение {SMS_WATCH_TIMEOUT // 60} мин.\n"
         f"Нажмите кнопку ниже, чтобы получить SMS код:",
         parse_mode="HTML",
-        reply_markup=get_google_sms_keyboard()
+        reply_markup=get_google_sms_keyboard(watching=True)
     )
     m2 = await message.answer("❌ В любой момент нажмите 'Отмена', чтобы выйти", reply_markup=cancel_kb)
     last_messages[message.from_user.id] = [m1.message_id, m2.message_id]
@@ -187,7 +206,7 @@ async def get_google_sms_code(query: CallbackQuery, state: FSMContext):
     if not sms_result.get("success"):
         await query.message.answer(
             "❌ Не удалось получить SMS. Попробуйте позже.",
-            reply_markup=get_google_sms_keyboard()
+            reply_markup=get_google_sms_keyboard(sms_watcher.is_watching(query.from_user.id, number_id))
         )
         return
 
@@ -198,7 +217,7 @@ async def get_google_sms_code(query: CallbackQuery, state: FSMContext):
             f"📭 <b>SMS для номера {phone_number} не найдены</b>\n\n"
             "Возможно, сообщение еще не пришло. Попробуйте нажать кнопку еще раз через несколько секунд.",
             parse_mode="HTML",
-            reply_markup=get_google_sms_keyboard()
+            reply_markup=get_google_sms_keyboard(sms_watcher.is_watching(query.from_user.id, number_id))
         )
         return
 
@@ -211,15 +230,7 @@ async def get_google_sms_code(query: CallbackQuery, state: FSMContext):
         received_at = sms.get("received_at", "")
         message_body = sms.get("message_body", "")
 
-        # Форматируем время
-        if received_at:
-            try:
-                dt = datetime.fromisoformat(received_at.replace("+00:00", "+00:00"))
-                time_str = dt.strftime("%d.%m.%Y %H:%M:%S")
-            except:
-                time_str = received_at
-        else:
-            time_str = "Неизвестно"
+        time_str = format_sms_time(received_at)
 
         response_text += f"<b>━━━ SMS #{i} ━━━</b>\n"
         response_text += f"📤 От: <b>{from_number}</b>\n"
@@ -237,10 +248,39 @@ async def get_google_sms_code(query: CallbackQuery, state: FSMContext):
     await query.message.answer(
         response_text,
         parse_mode="HTML",
-        reply_markup=get_google_sms_keyboard()
+        reply_markup=get_google_sms_keyboard(sms_watcher.is_watching(query.from_user.id, number_id))
     )
 
 
+@router.callback_query(F.data == "sms_watch:start", Form.waiting_for_sms_request)
+async def start_watch_callback(query: CallbackQuery, state: FSMContext):
+    """Ставит выбранный номер на слежение за новыми SMS"""
+    data = await state.get_data()
+    number_id = data.get("number_id")
+    if not number_id:
+        await query.answer("❌ Ошибка: номер не найден", show_alert=True)
+        return
+
+    start_sms_watch(query.bot, query.from_user.id, number_id, data.get("phone_number"))
+    await query.answer(f"🔔 Жду новые SMS {SMS_WATCH_TIMEOUT // 60} мин.")
+    try:
+        await query.message.edit_reply_markup(reply_markup=get_google_sms_keyboard(watching=True))
+    except Exception:
+        pass
+
+
+@router.callback_query(F.data == "sms_watch:stop")
+async def stop_watch_callback(query: CallbackQuery, state: FSMContext):
+    """Снимает слежение за новыми SMS"""
+    data = await state.get_data()
+    sms_watcher.unwatch(query.from_user.id, data.get("number_id"))
+    await query.answer("🔕 Больше не жду новые SMS")
+    try:
+        await query.message.edit_reply_markup(reply_markup=get_google_sms_keyboard(watching=False))
+    except Exception:
+        pass
+
+
 @router.message(Form.waiting_for_sms_request)
 async def handle_sms_request_text(message: Message, state: FSMContext):
     """Обрабатывает текстовые сообщения в состоянии ожидания SMS"""
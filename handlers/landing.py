@@ -2,7 +2,7 @@
 Обработчики для системы создания и починки лендингов
 """
 import re
-import gspread
+import bugsnag
 import shortuuid
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
@@ -13,7 +13,7 @@ from keyboards import (get_landing_category_keyboard, get_admin_processing_keybo
                          cancel_kb, get_menu_keyboard, ready_kb)
 from utils import (is_user_allowed, last_messages, send_notification_with_buttons,
                      send_document_to_admins, send_photo_to_admins, delete_last_messages)
-from config import GOOGLE_SHEET_ID
+from services import sheets, sheets_queue
 
 router = Router()
 
@@ -23,7 +23,7 @@ VALID_LINK_REGEX = re.compile(r"^https:\/\/chatgpt\.com\/canvas\/shared\/[a-zA-Z
 @router.message(F.text == "🌐 Создать/починить лендинг")
 async def create_landing(message: Message, state: FSMContext):
     """Начинает процесс создания или починки лендинга"""
-    if not is_user_allowed(message.from_user.id):
+    if not await is_user_allowed(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
 
@@ -237,14 +237,11 @@ async def finalize_landing_request(message: Message, state: FSMContext):
         reply_markup=kb
     )
 
-    # Сохраняем в Google Sheets
+    # Сохраняем в Google Sheets через очередь записи (строка не теряется, если Google недоступен)
     try:
-        gc = gspread.service_account(filename='credentials.json')
-        table = gc.open_by_key(GOOGLE_SHEET_ID)
-        worksheet = table.get_worksheet(0)
-        worksheet.append_row([order_id, username, user_id, offer_name, category, specification, canvas_link])
-    except Exception:
-        pass  # Если не удалось сохранить в таблицу, продолжаем работу
+        sheets_queue.enqueue_row(sheets.WS_LANDINGS, [order_id, username, user_id, offer_name, category, specification, canvas_link])
+    except Exception as e:
+        bugsnag.notify(e, meta_data={"context": "finalize_landing_request", "order_id": order_id})
 
     await message.answer(f"Ваша заявка {order_id} отправлена администратору.", reply_markup=get_menu_keyboard(message.from_user.id))
     await state.clear()
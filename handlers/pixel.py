@@ -2,7 +2,6 @@
 Система добавления пикселей
 """
 import re
-import gspread
 import bugsnag
 from aiogram import Router, F
 from aiogram.types import Message
@@ -11,14 +10,14 @@ from aiogram.fsm.context import FSMContext
 from states import Form
 from keyboards import cancel_kb, get_menu_keyboard
 from utils import is_user_allowed, last_messages, send_notification_to_admins
-from config import GOOGLE_SHEET_ID
+from services import sheets, sheets_queue
 
 router = Router()
 
 @router.message(F.text == "📊 Добавить пиксель в систему")
 async def add_pixel_to_system(message: Message, state: FSMContext):
     """Начинает процесс добавления пикселя в систему"""
-    if not is_user_allowed(message.from_user.id):
+    if not await is_user_allowed(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
 
@@ -73,13 +72,8 @@ async def receive_pixel_key(message: Message, state: FSMContext):
     username = message.from_user.username or "нет username"
 
     try:
-        # Добавляем пиксель в Google таблицу
-        gc = gspread.service_account(filename='credentials.json')
-        table = gc.open_by_key(GOOGLE_SHEET_ID)
-        worksheet = table.get_worksheet(2)
-
-        # Добавляем новую строку с Pixel ID и Pixel Key
-        worksheet.append_row([pixel_id, pixel_key])
+        # Ставим строку с Pixel ID и Pixel Key в очередь записи в Google таблицу
+        sheets_queue.enqueue_row(sheets.WS_PIXELS, [pixel_id, pixel_key])
 
         # Уведомляем администратора и тимлидера о добавлении нового пикселя
         await send_notification_to_admins(
@@ -1,7 +1,6 @@
 """
 Обработчики для покупки номеров телефонов
 """
-import asyncio
 from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
@@ -10,12 +9,19 @@ from aiogram.fsm.context import FSMContext
 from states import Form
 from keyboards import cancel_kb, get_menu_keyboard, get_purchase_country_keyboard
 from utils import last_messages, delete_last_messages
+from config import LUBOYDOMEN_BULK_PER_MIN, LUBOYDOMEN_PURCHASE_BATCH
+from services import jobs, number_directory
 from services.luboydomen import get_all_phone_numbers, purchase_number
 
 router = Router()
 
-# Задержка между API запросами для избежания rate limit (в секундах)
-API_REQUEST_DELAY = 6  # 10 запросов в минуту = 1 запрос каждые 6 секунд минимум
+# Примерный интервал между покупками (сек) — для оценки времени. Темп задаёт
+# ограничитель luboydomen (LUBOYDOMEN_BULK_PER_MIN запросов в минуту).
+API_REQUEST_DELAY = 60 // LUBOYDOMEN_BULK_PER_MIN
+
+# Номеров в одном запросе покупки и вид фоновой задачи (services/jobs)
+PURCHASE_BATCH = max(1, LUBOYDOMEN_PURCHASE_BATCH)
+PURCHASE_JOB = "purchase_numbers"
 
 # Максимальная длина сообщения в Telegram
 MAX_MESSAGE_LENGTH = 4000
@@ -148,83 +154,115 @@ async def process_quantity(message: Message, state: FSMContext):
     country_label = COUNTRY_LABELS[country_code]
 
     # Примерное время на покупку (с учетом rate limit)
-    estimated_time = quantity * API_REQUEST_DELAY
+    estimated_time = -(-quantity // PURCHASE_BATCH) * API_REQUEST_DELAY
 
-    # Отправляем сообщение о начале покупки
+    # Сообщение о прогрессе — его дальше редактирует фоновая задача
     progress_msg = await message.answer(
-        f"🔄 <b>Покупка номеров началась...</b>\n\n"
+        f"🔄 <b>Покупка номеров поставлена в очередь...</b>\n\n"
         f"🌍 Страна: <b>{country_label}</b>\n"
         f"📊 Количество: <b>{quantity}</b>\n"
         f"📅 Срок аренды: <b>{DURATION_MONTHS} мес.</b>\n"
         f"⏱️ Примерное время: <b>~{estimated_time} сек.</b>\n\n"
-        f"Куплено: <b>0/{quantity}</b>\n"
-        f"<i>Пожалуйста, подождите...</i>",
+        f"Куплено: <b>0/{quantity}</b>",
         parse_mode="HTML"
     )
 
-    # Покупаем номера по одному с задержкой
-    purchased_numbers = []
-    errors = []
-    total_cost = 0
-    last_purchased_count = 0
-    last_errors_count = 0
+    # Покупка идёт фоновой задачей (services/jobs): переживает перезапуск бота,
+    # темп задаёт ограничитель luboydomen
+    batches = [min(PURCHASE_BATCH, quantity - i) for i in range(0, quantity, PURCHASE_BATCH)]
+    job_id = jobs.enqueue(
+        PURCHASE_JOB,
+        message.from_user.id,
+        message.chat.id,
+        {"country_code": country_code, "quantity": quantity},
+        [{"quantity": batch} for batch in batches],
+        message_id=progress_msg.message_id,
+    )
 
-    for i in range(quantity):
-        try:
-            # Генерируем уникальное имя с датой и временем
-            custom_name = generate_custom_name()
-
-            result = await purchase_number(custom_name, country_code, DURATION_MONTHS, AUTO_RENEW)
-
-            if result.get("success"):
-                numbers = result.get("numbers", [])
-                purchased_numbers.extend(numbers)
-                total_cost += result.get("cost", 0)
-            else:
-                error_msg = result.get("error") or result.get("detail") or "Неизвестная ошибка"
-                errors.append(f"Номер {i+1}: {error_msg}")
-
-            # Обновляем прогресс только если что-то изменилось
-            if len(purchased_numbers) != last_purchased_count or len(errors) != last_errors_count:
-                last_purchased_count = len(purchased_numbers)
-                last_errors_count = len(errors)
-                try:
-                    await progress_msg.edit_text(
-                        f"🔄 <b>Покупка номеров...</b>\n\n"
-                        f"🌍 Страна: <b>{country_label}</b>\n"
-                        f"📊 Количество: <b>{quantity}</b>\n"
-                        f"📅 Срок аренды: <b>{DURATION_MONTHS} мес.</b>\n\n"
-                        f"Куплено: <b>{len(purchased_numbers)}/{quantity}</b>\n"
-                        f"Ошибок: <b>{len(errors)}</b>\n"
-                        f"<i>Пожалуйста, подождите...</i>",
-                        parse_mode="HTML"
-                    )
-                except Exception:
-                    pass
-
-            # Задержка между запросами (кроме последнего)
-            if i < quantity - 1:
-                await asyncio.sleep(API_REQUEST_DELAY)
-
-        except Exception as e:
-            errors.append(f"Номер {i+1}: {str(e)}")
-            if i < quantity - 1:
-                await asyncio.sleep(API_REQUEST_DELAY)
-
-    # Удаляем сообщение о прогрессе
-    try:
-        await progress_msg.delete()
-    except:
-        pass
+    await message.answer(
+        f"🆔 Задача <code>{job_id}</code>: номера пришлю сюда, когда покупка завершится.",
+        parse_mode="HTML",
+        reply_markup=get_menu_keyboard(message.from_user.id)
+    )
+
+    await state.clear()
+
+
+def _purchase_label(unit: dict) -> str:
+    quantity = unit["payload"].get("quantity", 1)
+    if quantity == 1:
+        return f"Номер {unit['seq'] + 1}"
+    return f"Партия {unit['seq'] + 1} ({quantity} шт.)"
+
+
+def _prepare_purchase(params: dict, payload: dict) -> dict:
+    """Имя генерируется перед запросом и сохраняется — по нему recover найдёт номер"""
+    return {**payload, "custom_name": generate_custom_name()}
+
+
+async def _purchase_unit(bot, params: dict, payload: dict) -> dict:
+    """Покупает номер (или партию номеров) — одна единица задачи"""
+    result = await purchase_number(payload["custom_name"], params["country_code"], DURATION_MONTHS,
+                                   AUTO_RENEW, quantity=payload.get("quantity", 1))
+    if not result.get("success"):
+        return {"ok": False, "error": result.get("error") or result.get("detail") or "Неизвестная ошибка"}
+    numbers = result.get("numbers", [])
+    number_directory.add_numbers(numbers)
+    return {"ok": True, "numbers": numbers, "cost": result.get("cost", 0)}
+
+
+async def _recover_purchase(params: dict, payload: dict) -> dict | None:
+    """Покупка прервана перезапуском посреди запроса: ищем номер по сохранённому имени"""
+    if await number_directory.refresh() is not None:
+        # Не знаем, прошла ли покупка, — не рискуем купить второй раз
+        return {"ok": False, "error": "прервано перезапуском, проверьте «📋 Список номеров»"}
+    numbers = number_directory.numbers_named(payload["custom_name"])
+    if not numbers:
+        return None
+    return {"ok": True, "numbers": numbers, "cost": 0}
+
+
+def _purchase_totals(units: list[dict]) -> tuple[list, list, int]:
+    purchased, errors, total_cost = [], [], 0
+    for unit in units:
+        result = unit["result"] or {}
+        if unit["status"] == "done":
+            purchased.extend(result.get("numbers", []))
+            total_cost += result.get("cost", 0)
+        elif unit["status"] == "failed":
+            errors.append(f"{_purchase_label(unit)}: {result.get('error')}")
+    return purchased, errors, total_cost
+
+
+def _purchase_progress(job: dict, units: list[dict]) -> str:
+    params = job["params"]
+    purchased, errors, _ = _purchase_totals(units)
+    finished = all(unit["status"] in ("done", "failed") for unit in units)
+    title = "✅ <b>Покупка номеров завершена</b>" if finished else "🔄 <b>Покупка номеров...</b>"
+    return (
+        f"{title}\n\n"
+        f"🆔 Задача: <code>{job['id']}</code>\n"
+        f"🌍 Страна: <b>{COUNTRY_LABELS.get(params['country_code'], params['country_code'])}</b>\n"
+        f"📊 Количество: <b>{params['quantity']}</b>\n"
+        f"📅 Срок аренды: <b>{DURATION_MONTHS} мес.</b>\n\n"
+        f"Куплено: <b>{len(purchased)}/{params['quantity']}</b>\n"
+        f"Ошибок: <b>{len(errors)}</b>"
+    )
+
+
+async def _purchase_finish(bot, job: dict, units: list[dict]) -> None:
+    """Итог покупки: стоимость, список номеров, ошибки"""
+    chat_id = job["chat_id"]
+    country_label = COUNTRY_LABELS.get(job["params"]["country_code"], job["params"]["country_code"])
+    purchased_numbers, errors, total_cost = _purchase_totals(units)
 
-    # Формируем итоговое сообщение
     if purchased_numbers:
         response_text = f"✅ <b>Покупка завершена!</b>\n\n"
         response_text += f"🌍 Страна: <b>{country_label}</b>\n"
         response_text += f"💰 Общая стоимость: <b>{total_cost} кредитов</b>\n"
         response_text += f"📊 Куплено номеров: <b>{len(purchased_numbers)}</b>\n\n"
 
-        await message.answer(response_text, parse_mode="HTML")
+        await bot.send_message(chat_id, response_text, parse_mode="HTML")
 
         # Формируем простой список номеров (каждый номер с новой строки)
         numbers_text = ""
@@ -235,7 +273,7 @@ async def process_quantity(message: Message, state: FSMContext):
         # Разбиваем на части и отправляем
         parts = split_message(numbers_text.strip())
         for part in parts:
-            await message.answer(part)
+            await bot.send_message(chat_id, part)
 
         if errors:
             errors_text = f"<b>⚠️ Ошибки ({len(errors)}):</b>\n"
@@ -243,7 +281,7 @@ async def process_quantity(message: Message, state: FSMContext):
                 errors_text += f"• {error}\n"
             if len(errors) > 5:
                 errors_text += f"<i>...и еще {len(errors) - 5} ошибок</i>\n"
-            await message.answer(errors_text, parse_mode="HTML")
+            await bot.send_message(chat_id, errors_text, parse_mode="HTML")
     else:
         response_text = f"❌ <b>Не удалось купить номера</b>\n\n"
         if errors:
@@ -252,14 +290,17 @@ async def process_quantity(message: Message, state: FSMContext):
                 response_text += f"• {error}\n"
             if len(errors) > 10:
                 response_text += f"<i>...и еще {len(errors) - 10} ошибок</i>\n"
-        await message.answer(response_text, parse_mode="HTML")
+        await bot.send_message(chat_id, response_text, parse_mode="HTML")
 
-    await message.answer(
-        "Выберите действие:",
-        reply_markup=get_menu_keyboard(message.from_user.id)
-    )
 
-    await state.clear()
+jobs.register(
+    PURCHASE_JOB,
+    run_unit=_purchase_unit,
+    prepare=_prepare_purchase,
+    recover=_recover_purchase,
+    progress_text=_purchase_progress,
+    finish=_purchase_finish,
+)
 
 
 @router.message(F.text == "📋 Список номеров")
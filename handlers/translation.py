@@ -7,6 +7,7 @@ import zipfile
 import tempfile
 import re
 import asyncio
+import json
 from typing import List, Dict, Optional
 import gspread
 import bugsnag
@@ -15,11 +16,14 @@ import openai
 from aiogram import Router, F
 from aiogram.types import Message, BufferedInputFile
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 
 from states import Form
 from keyboards import cancel_kb, get_menu_keyboard
 from utils import is_user_allowed, last_messages
-from config import OPENAI_API_KEY
+from config import (OPENAI_API_KEY, TRANSLATION_MAX_CONCURRENCY, TRANSLATION_PROGRESS_INTERVAL,
+                    TRANSLATION_HTML_MODE, TRANSLATION_SEGMENT_BATCH_CHARS)
+from services import html_segments, translation_memory, translation_results
 
 
 
@@ -31,9 +35,16 @@ client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 # Расширения файлов для перевода
 TRANSLATABLE_EXTENSIONS = {'.html', '.htm', '.php', '.js'}
-SEM_LIMIT = 4   # сколько запросов одновременно максимум
+# Расширения, которые в режиме "dom" переводятся сегментами (PHP-код html.parser не разберёт)
+DOM_EXTENSIONS = {'.html', '.htm'}
 CHUNK_SIZE = 15000  # Увеличен размер для лучшего контекста
 
+# Версия промптов и проверок перевода: входит в ключ памяти переводов.
+# Увеличить, если перевод меняется не только через текст промптов (модель, проверки ответа)
+PROMPT_VERSION = "1"
+
+_FAILED_MARKER = "<!-- TRANSLATION_FAILED"
+
 # Папка с архивами лендингов
 LANDINGS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "landings")
 
@@ -279,7 +290,12 @@ def is_inside_js_block(code: str) -> bool:
             open_brackets != close_brackets)
 
 
-async def translate_chunk(idx, chunk, system_prompt, base_prompt, sem):
+# Общий пул запросов к OpenAI: все чанки всех файлов всех переводов идут через
+# него на event loop бота (не больше TRANSLATION_MAX_CONCURRENCY одновременно)
+_translation_sem = asyncio.Semaphore(TRANSLATION_MAX_CONCURRENCY)
+
+
+async def translate_chunk(idx, chunk, system_prompt, base_prompt, sem=_translation_sem):
     """Перевод одного чанка с контролем параллельности"""
     async with sem:
         max_retries = 4  # Увеличил количество попыток
@@ -330,10 +346,52 @@ async def translate_chunk(idx, chunk, system_prompt, base_prompt, sem):
             return idx, translated
 
 
-async def translate_text_with_chatgpt_async(text: str, filename: str, target_language: str, target_country: str, offer_name: str = None, offer_price: str = None) -> str:
-    """Асинхронный перевод файла по чанкам с семафором"""
+async def translate_segment_batch(segments: list, system_prompt: str, segment_prompt: str, sem=_translation_sem) -> list:
+    """Перевод пачки сегментов [(вид, текст), ...] одним запросом.
+
+    Сегменты уходят JSON-объектом {номер: текст}, ответ — такой же объект.
+    Непереведённые сегменты переспрашиваются; что так и не перевелось — None.
+    """
+    payload = {}
+    for i, (kind, text) in enumerate(segments):
+        payload[f"lang{i}" if kind == html_segments.LANG else str(i)] = text
+
+    translated = {}
+    async with sem:
+        max_retries = 4
+        for attempt in range(max_retries):
+            missing = {key: text for key, text in payload.items() if key not in translated}
+            response = await client.chat.completions.create(
+                model="gpt-5-mini",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": segment_prompt + json.dumps(missing, ensure_ascii=False)},
+                ],
+                response_format={"type": "json_object"},
+                max_completion_tokens=30000
+            )
+
+            try:
+                data = json.loads(response.choices[0].message.content or "")
+            except ValueError:
+                data = None
+
+            if isinstance(data, dict):
+                for key in missing:
+                    value = data.get(key)
+                    if isinstance(value, str) and value.strip():
+                        translated[key] = value.strip()
+
+            if len(translated) == len(payload):
+                break
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)
 
-    chunks = split_into_chunks(text, CHUNK_SIZE, filename)
+    return [translated.get(key) for key in payload]
+
+
+def build_prompts(filename: str, target_language: str, target_country: str, offer_name: str = None, offer_price: str = None) -> tuple:
+    """Системный промпт и промпт-префикс для чанков файла (по его расширению)"""
     file_ext = os.path.splitext(filename)[1].lower()
 
     # Динамический системный промпт на основе выбранного языка и страны
@@ -480,28 +538,231 @@ async def translate_text_with_chatgpt_async(text: str, filename: str, target_lan
 Фрагмент:
 """
 
-    # Семафор для ограничения количества одновременных запросов
-    sem = asyncio.Semaphore(SEM_LIMIT)
+    return system_prompt, base_prompt
 
-    # Стартуем параллельные задачи
-    tasks = [
-        translate_chunk(idx, chunk, system_prompt, base_prompt, sem)
-        for idx, chunk in enumerate(chunks)
-    ]
 
-    # Дожидаемся всех
-    results = await asyncio.gather(*tasks)
+def build_segment_prompt(target_language: str, target_country: str) -> str:
+    """Промпт-префикс для пачки HTML-сегментов (режим "dom")"""
+    return f"""
+Переведи на {target_language} язык значения этого JSON-объекта. Это тексты веб-страницы
+(текст между тегами, alt/title/placeholder, кнопки, <title>, мета-описания) в порядке
+следования на странице — соседние значения используй как контекст.
+
+ОБЯЗАТЕЛЬНО локализуй для страны {target_country}:
+- Все имена людей на типичные для {target_country} имена
+- Все фамилии на характерные для {target_country} фамилии
+- Все города на крупные города {target_country}
+- Любые компании и бренды на известные в {target_country} аналоги
+
+Правила:
+- Верни JSON-объект с ТЕМИ ЖЕ ключами и переведёнными значениями, без пропусков.
+- Значение с ключом, начинающимся на "lang", — атрибут lang тега <html>: верни код языка
+  {target_language} (например: польский - pl, испанский - es, немецкий - de).
+- HTML-сущности (&amp;, &nbsp;, &#169; и т.п.), URL, e-mail и плейсхолдеры вида {{{{...}}}}, %s оставляй как есть.
+- Не добавляй разметку и комментарии.
+
+JSON:
+"""
 
-    # Результаты нужно отсортировать по индексу
-    results.sort(key=lambda x: x[0])
 
-    return "".join(part for _, part in results)
+def _dom_segments(filename: str, text: str) -> Optional[list]:
+    """Сегменты файла для перевода по сегментам или None — переводить чанками разметки"""
+    if TRANSLATION_HTML_MODE != "dom" or os.path.splitext(filename)[1].lower() not in DOM_EXTENSIONS:
+        return None
+    try:
+        return html_segments.extract_segments(text)
+    except Exception as e:
+        bugsnag.notify(e, meta_data={
+            "function": "_dom_segments",
+            "filename": filename,
+            "error_type": "html_segments_error"
+        })
+        return None
 
 
-def translate_text_with_chatgpt(text: str, filename: str, target_language: str, target_country: str, offer_name: str = None, offer_price: str = None) -> str:
-    return asyncio.run(
-        translate_text_with_chatgpt_async(text, filename, target_language, target_country, offer_name, offer_price)
+def _segment_batches(pending: list, max_chars: int) -> list:
+    """Режет сегменты (в порядке страницы) на пачки не длиннее max_chars символов"""
+    batches = []
+    batch = []
+    size = 0
+    for item in pending:
+        segment = item[1]
+        if batch and size + len(segment.text) > max_chars:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(item)
+        size += len(segment.text)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def translate_files(files: Dict[str, str], target_language: str, target_country: str, offer_name: str = None, offer_price: str = None, on_progress=None, stats: Optional[dict] = None) -> Dict[str, str]:
+    """Переводит все файлы одним конвейером: запросы всех файлов сразу ставятся в
+    общий пул, результаты собираются обратно по файлам.
+
+    HTML в режиме "dom" переводится сегментами (services/html_segments), пачками
+    по TRANSLATION_SEGMENT_BATCH_CHARS; PHP, JS и HTML в режиме "markup" — чанками
+    разметки. Одинаковые сегменты и чанки всех файлов (меню, подвал, дисклеймеры,
+    подписи форм) переводятся один раз и раздаются во все места, где встречаются;
+    перед переводом каждый уникальный фрагмент ищется в памяти переводов.
+
+    on_progress(done, total) — корутина-функция, вызывается после каждого запроса к OpenAI.
+    stats — если передан, в него записываются total (фрагментов во всех файлах),
+    unique (из них уникальных), hits (уникальных из памяти переводов), requests
+    (запросов к OpenAI) и failed (уникальных фрагментов, оставшихся без перевода:
+    чанки с TRANSLATION_FAILED и непереведённые сегменты).
+    """
+    segment_prompt = build_segment_prompt(target_language, target_country)
+    chunk_keys = {}        # filename -> ключи чанков по порядку
+    file_segments = {}     # filename -> (сегменты, их ключи)
+    results = {}           # ключ -> перевод (общий словарь задачи)
+    pending_chunks = {}    # ключ -> (chunk, system_prompt, base_prompt)
+    pending_segments = {}  # ключ -> (segment, system_prompt)
+    total = 0
+
+    for filename, text in files.items():
+        system_prompt, base_prompt = build_prompts(filename, target_language, target_country, offer_name, offer_price)
+        segments = _dom_segments(filename, text)
+
+        if segments is None:
+            keys = []
+            for chunk in split_into_chunks(text, CHUNK_SIZE, filename):
+                key = translation_memory.make_key(chunk, PROMPT_VERSION, system_prompt, base_prompt)
+                keys.append(key)
+                if key not in results and key not in pending_chunks:
+                    pending_chunks[key] = (chunk, system_prompt, base_prompt)
+            chunk_keys[filename] = keys
+            total += len(keys)
+            continue
+
+        keys = []
+        for segment in segments:
+            key = translation_memory.make_key(segment.kind, segment.text, PROMPT_VERSION, system_prompt, segment_prompt)
+            keys.append(key)
+            if key not in pending_segments:
+                pending_segments[key] = (segment, system_prompt)
+        file_segments[filename] = (segments, keys)
+        total += len(keys)
+
+    unique = len(pending_chunks) + len(pending_segments)
+
+    # Сначала память переводов: повторный фрагмент не стоит запроса к OpenAI
+    for pending in (pending_chunks, pending_segments):
+        for key in list(pending):
+            cached = translation_memory.get(key)
+            if cached is not None:
+                results[key] = cached
+                del pending[key]
+    hits = unique - len(pending_chunks) - len(pending_segments)
+
+    items = []  # ("chunk", ...) / ("segments", ...) — запросы к OpenAI
+    for idx, (key, (chunk, system_prompt, base_prompt)) in enumerate(pending_chunks.items()):
+        items.append(("chunk", system_prompt, (idx, chunk, base_prompt, key)))
+    # Пачки собираются из уникальных сегментов всех файлов; системный промпт у
+    # HTML-файлов общий, но группируем по нему, чтобы не смешать разные
+    by_prompt: Dict[str, list] = {}
+    for key, (segment, system_prompt) in pending_segments.items():
+        by_prompt.setdefault(system_prompt, []).append((key, segment))
+    for system_prompt, group in by_prompt.items():
+        for batch in _segment_batches(group, TRANSLATION_SEGMENT_BATCH_CHARS):
+            items.append(("segments", system_prompt, batch))
+
+    requests = len(items)
+    done = failed = 0
+
+    async def run(mode, system_prompt, work):
+        nonlocal done, failed
+        if mode == "chunk":
+            idx, chunk, base_prompt, key = work
+            _, translated = await translate_chunk(idx, chunk, system_prompt, base_prompt)
+            if translated.startswith(_FAILED_MARKER):
+                failed += 1
+            else:
+                translation_memory.put(key, translated)
+            results[key] = translated
+        else:
+            translated = await translate_segment_batch(
+                [(segment.kind, segment.text) for _, segment in work], system_prompt, segment_prompt
+            )
+            for (key, _), text in zip(work, translated):
+                # Непереведённый сегмент остаётся в оригинале и в память не попадает
+                if text is None:
+                    failed += 1
+                else:
+                    translation_memory.put(key, text)
+                    results[key] = text
+        done += 1
+        if on_progress is not None:
+            await on_progress(done, requests)
+
+    tasks = [asyncio.create_task(run(*item)) for item in items]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Ошибка одного запроса роняет перевод — остальные запросы не нужны
+        for task in tasks:
+            task.cancel()
+
+    if stats is not None:
+        stats.update(total=total, unique=unique, hits=hits, requests=requests, failed=failed)
+
+    translated_files = {}
+    for filename, text in files.items():
+        if filename in file_segments:
+            segments, keys = file_segments[filename]
+            translated_files[filename] = html_segments.apply_translations(
+                text, segments, [results.get(key) for key in keys]
+            )
+        else:
+            translated_files[filename] = "".join(results[key] for key in chunk_keys[filename])
+    return translated_files
+
+
+async def translate_text_with_chatgpt_async(text: str, filename: str, target_language: str, target_country: str, offer_name: str = None, offer_price: str = None) -> str:
+    """Асинхронный перевод одного файла по чанкам через общий пул"""
+    translated = await translate_files({filename: text}, target_language, target_country, offer_name, offer_price)
+    return translated[filename]
+
+
+def _result_caption(landing_id: str, total_files: int, target_language: str, target_country: str, offer_name: str = None, offer_price: str = None, stats_caption: str = "") -> str:
+    """Подпись к архиву с готовым переводом"""
+    # Формируем информацию об оффере для финального сообщения
+    offer_caption = ""
+    if offer_name and offer_price:
+        offer_caption = f"💰 Оффер: {offer_name} - {offer_price}\n"
+
+    return (f"✅ <b>Перевод лендинга завершен!</b>\n\n"
+            f"📁 ID лендинга: <code>{landing_id}</code>\n"
+            f"📄 Переведено файлов: {total_files}\n"
+            f"🌍 Язык: {target_language.title()}\n"
+            f"🏳️ Локализация: {target_country.title()}\n"
+            f"{offer_caption}"
+            f"{stats_caption}\n"
+            f"Архив содержит переведенные HTML, PHP, JS файлы с локализацией имен и названий.")
+
+
+async def send_cached_result(message: Message, key: str, cached: dict, caption: str) -> bool:
+    """Отправляет готовый перевод из кэша: по file_id, если он есть, иначе файлом с диска"""
+    if cached["file_id"]:
+        try:
+            await message.answer_document(cached["file_id"], caption=caption, parse_mode="HTML")
+            return True
+        except TelegramBadRequest:
+            # file_id недействителен (например, сменили бота) — отправим файл заново
+            translation_results.set_file_id(key, None)
+
+    loop = asyncio.get_event_loop()
+    try:
+        data = await loop.run_in_executor(None, translation_results.read, key)
+    except OSError:
+        return False
+    sent = await message.answer_document(
+        BufferedInputFile(data, filename=cached["filename"]), caption=caption, parse_mode="HTML"
     )
+    if sent.document:
+        translation_results.set_file_id(key, sent.document.file_id)
+    return True
 
 
 async def process_translation_in_background(landing_id: str, target_language: str, target_country: str, message: Message, status_msg: Message, offer_name: str = None, offer_price: str = None):
@@ -524,6 +785,22 @@ async def process_translation_in_background(landing_id: str, target_language: st
             await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
             return
 
+        # Тот же архив с теми же параметрами уже переводили — отдаём готовый результат
+        archive_digest = await loop.run_in_executor(None, translation_results.archive_hash, archive_path)
+        translation_results.invalidate_landing(landing_id, archive_digest)
+        result_key = translation_results.make_key(
+            archive_digest, target_language, target_country, offer_name, offer_price,
+            PROMPT_VERSION, TRANSLATION_HTML_MODE
+        )
+        cached = translation_results.get(result_key)
+        if cached is not None:
+            caption = _result_caption(landing_id, cached["file_count"], target_language, target_country,
+                                      offer_name, offer_price, "⚡ Готовый перевод из кэша\n")
+            if await send_cached_result(message, result_key, cached, caption):
+                await status_msg.delete()
+                await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
+                return
+
         # Загружаем архив из файла
         await status_msg.edit_text(f"📂 Чтение архива...")
 
@@ -553,29 +830,35 @@ async def process_translation_in_background(landing_id: str, target_language: st
             await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
             return
 
-        # Переводим файлы
+        # Переводим все файлы одним конвейером на event loop бота
         total_files = len(translatable_files)
-        translated_files = {}
-
-        for i, (filename, content) in enumerate(translatable_files.items(), 1):
-            await status_msg.edit_text(
-                f"🌍 Перевод файлов на {target_language}...\n\n"
-                f"Обрабатываю: {filename}\n"
-                f"Прогресс: {i}/{total_files}"
-            )
+        await status_msg.edit_text(
+            f"🌍 Перевод файлов на {target_language}...\n\n"
+            f"Файлов: {total_files}"
+        )
 
-            # Выполняем перевод в executor
-            translated_content = await loop.run_in_executor(
-                None,
-                translate_text_with_chatgpt,
-                content,
-                filename,
-                target_language,
-                target_country,
-                offer_name,
-                offer_price
-            )
-            translated_files[filename] = translated_content
+        last_edit = 0.0
+
+        async def on_progress(done: int, total: int):
+            nonlocal last_edit
+            now = loop.time()
+            if done != total and now - last_edit < TRANSLATION_PROGRESS_INTERVAL:
+                return
+            last_edit = now
+            try:
+                await status_msg.edit_text(
+                    f"🌍 Перевод файлов на {target_language}...\n\n"
+                    f"Файлов: {total_files}\n"
+                    f"Прогресс: {done}/{total} запросов"
+                )
+            except Exception:
+                pass
+
+        memory_stats = {}
+        translated_files = await translate_files(
+            translatable_files, target_language, target_country, offer_name, offer_price, on_progress,
+            stats=memory_stats
+        )
 
         # Создаем новый архив с переведенными файлами
         await status_msg.edit_text("📦 Создание архива с переведенными файлами...")
@@ -599,22 +882,38 @@ async def process_translation_in_background(landing_id: str, target_language: st
         # Отправляем архив
         translated_file = BufferedInputFile(translated_zip, filename=translated_filename)
 
-        # Формируем информацию об оффере для финального сообщения
-        offer_caption = ""
-        if offer_name and offer_price:
-            offer_caption = f"💰 Оффер: {offer_name} - {offer_price}\n"
+        # Повторы между файлами и память переводов
+        total_fragments = memory_stats['total']
+        dedup_percent = (1 - memory_stats['unique'] / total_fragments) * 100 if total_fragments else 0
+        stats_caption = (
+            f"🔁 Фрагментов: {total_fragments}, уникальных: {memory_stats['unique']} "
+            f"(повторы: {dedup_percent:.0f}%)\n"
+            f"♻️ Из памяти переводов: {memory_stats['hits']}/{memory_stats['unique']}, "
+            f"запросов к OpenAI: {memory_stats['requests']}\n"
+        )
+        complete = not memory_stats['failed']
+        if not complete:
+            stats_caption += (
+                f"⚠️ Не переведено фрагментов: {memory_stats['failed']} — остались в оригинале. "
+                f"Запустите перевод ещё раз, чтобы перевести их\n"
+            )
+
+        # Сохраняем для повторных запросов только полный перевод: частичный
+        # результат при следующем запросе переводится заново
+        if complete:
+            await loop.run_in_executor(
+                None, translation_results.put,
+                result_key, landing_id, archive_digest, translated_filename, total_files, translated_zip
+            )
 
-        await message.answer_document(
+        sent = await message.answer_document(
             translated_file,
-            caption=f"✅ <b>Перевод лендинга завершен!</b>\n\n"
-                   f"📁 ID лендинга: <code>{landing_id}</code>\n"
-                   f"📄 Переведено файлов: {total_files}\n"
-                   f"🌍 Язык: {target_language.title()}\n"
-                   f"🏳️ Локализация: {target_country.title()}\n"
-                   f"{offer_caption}\n"
-                   f"Архив содержит переведенные HTML, PHP, JS файлы с локализацией имен и названий.",
+            caption=_result_caption(landing_id, total_files, target_language, target_country,
+                                    offer_name, offer_price, stats_caption),
             parse_mode="HTML"
         )
+        if complete and sent.document:
+            translation_results.set_file_id(result_key, sent.document.file_id)
 
         await status_msg.delete()
         await message.answer("Выберите действие:", reply_markup=get_menu_keyboard(message.from_user.id))
@@ -684,7 +983,7 @@ def create_translated_zip(original_zip: bytes, translated_files: Dict[str, str])
 @router.message(F.text == "🌍 Перевод лендинга")
 async def translate_landing_start(message: Message, state: FSMContext):
     """Начинает процесс перевода лендинга"""
-    if not is_user_allowed(message.from_user.id):
+    if not await is_user_allowed(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
 
@@ -264,7 +264,7 @@ async def process_archive_multiple(bot: Bot, file_id: str, user_id: int, archive
 @router.message(F.text == "🖼️ Уникализатор")
 async def images_unicalization_initiation(message: Message, state: FSMContext):
     """Начинает процесс уникализации изображений"""
-    if not is_user_allowed(message.from_user.id):
+    if not await is_user_allowed(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
 
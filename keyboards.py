@@ -115,10 +115,16 @@ def get_admin_processing_keyboard(user_id: int):
         [InlineKeyboardButton(text="❌ Отклонено", callback_data=f"decline:{user_id}")]
     ])
 
-def get_google_sms_keyboard():
+def get_google_sms_keyboard(watching: bool = False):
     """Клавиатура для получения SMS кода Google Ads"""
+    watch_button = (
+        InlineKeyboardButton(text="🔕 Не ждать новые коды", callback_data="sms_watch:stop")
+        if watching else
+        InlineKeyboardButton(text="🔔 Ждать новые коды", callback_data="sms_watch:start")
+    )
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Получить код Google Ads", callback_data="get_google_sms")]
+        [InlineKeyboardButton(text="🔄 Получить код Google Ads", callback_data="get_google_sms")],
+        [watch_button]
     ])
 
 
@@ -29,6 +29,8 @@ from handlers import (
     card_actions,
     card_group_expenses
 )
+from services import card_directory, http_client, jobs, number_directory, sheets, sheets_queue
+from utils import allowlist_refresher
 
 async def main():
     """Главная функция запуска бота"""
@@ -53,9 +55,28 @@ async def main():
     dp.include_router(card_actions.router)
     dp.include_router(card_group_expenses.router)
 
-    # Удаляем вебхук и запускаем polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Общий пул HTTP-соединений к внешним API (банки, luboydomen)
+    await http_client.start()
+
+    # Фоновые задачи: живут, пока работает polling
+    background_tasks = [
+        asyncio.create_task(allowlist_refresher()),
+        asyncio.create_task(sheets_queue.flusher()),
+        asyncio.create_task(expenses.expenses_refresher()),
+        asyncio.create_task(card_directory.card_directory_refresher()),
+        asyncio.create_task(number_directory.number_directory_refresher()),
+        asyncio.create_task(jobs.worker(bot)),
+    ]
+    try:
+        # Удаляем вебхук и запускаем polling
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await http_client.close()
+        sheets.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
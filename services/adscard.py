@@ -15,7 +15,8 @@ import logging
 import aiohttp
 import bugsnag
 
-from config import ADSCARD_TOKEN, ADSCARD_AUTH_TOKEN, BUGSNAG_TOKEN
+from config import ADSCARD_TOKEN, ADSCARD_AUTH_TOKEN, BUGSNAG_TOKEN, SINGLEFLIGHT_TTL
+from services import http_client, singleflight
 
 logger = logging.getLogger(__name__)
 
@@ -63,24 +64,24 @@ async def _post(endpoint: str, payload: dict | None = None) -> dict:
 
     timeout = aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT)
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, headers=headers, json=body) as resp:
-                status = resp.status
-                text = await resp.text()
-
-                if status != 200:
-                    snippet = text[:300]
-                    _report(f"HTTP {status}: {snippet}", endpoint, status=status)
-                    return {"success": False, "error": f"http_{status}",
-                            "details": f"HTTP {status}: {snippet}"}
-
-                try:
-                    return json.loads(text)
-                except ValueError:
-                    snippet = text[:300]
-                    _report(f"невалидный JSON: {snippet}", endpoint)
-                    return {"success": False, "error": "bad_json",
-                            "details": f"Некорректный ответ AdsCard: {snippet}"}
+        session = http_client.get_session()
+        async with session.post(url, headers=headers, json=body, timeout=timeout) as resp:
+            status = resp.status
+            text = await resp.text()
+
+            if status != 200:
+                snippet = text[:300]
+                _report(f"HTTP {status}: {snippet}", endpoint, status=status)
+                return {"success": False, "error": f"http_{status}",
+                        "details": f"HTTP {status}: {snippet}"}
+
+            try:
+                return json.loads(text)
+            except ValueError:
+                snippet = text[:300]
+                _report(f"невалидный JSON: {snippet}", endpoint)
+                return {"success": False, "error": "bad_json",
+                        "details": f"Некорректный ответ AdsCard: {snippet}"}
     except aiohttp.ClientError as e:
         _report(e, endpoint, kind="network_error")
         return {"success": False, "error": "network_error", "details": str(e)}
@@ -163,5 +164,11 @@ async def get_team_transactions(time: str = "month") -> dict:
 
     Эндпоинт не принимает card_id и отдаёт транзакции всей команды за период;
     фильтрация по конкретной карте делается на стороне бота. time обязателен.
+    Одновременные вызовы с тем же time разделяют один запрос (single-flight).
     """
-    return await _post("teams/cards_transactions", {"time": time})
+    payload = {"time": time}
+    return await singleflight.do(
+        singleflight.make_key("POST", "teams/cards_transactions", payload),
+        lambda: _post("teams/cards_transactions", payload),
+        ttl=SINGLEFLIGHT_TTL,
+    )
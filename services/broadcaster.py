@@ -0,0 +1,138 @@
+"""
+Массовая отправка сообщений в Telegram (рассылки) с учётом лимитов Bot API.
+
+Telegram разрешает боту около 30 сообщений в секунду суммарно и примерно одно
+сообщение в секунду в один чат. Рассылка по одному получателю за раз упиралась
+в сетевые задержки, а первый же flood-wait (RetryAfter) превращался в ошибки
+доставки.
+
+- Общая корзина токенов (services/rate_limit): не больше BROADCAST_RATE_PER_SEC
+  сообщений в секунду на всю рассылку.
+- Сообщения одному получателю идут по порядку с интервалом не меньше
+  BROADCAST_CHAT_INTERVAL; получателей параллельно обслуживают BROADCAST_WORKERS
+  воркеров задачи рассылки (handlers/broadcast.py, services/jobs).
+- TelegramRetryAfter приостанавливает всю отправку на retry_after (flood-wait
+  общий для бота), после чего сообщение повторяется; сетевые ошибки и 5xx —
+  повтор с экспоненциальной задержкой, до BROADCAST_MAX_RETRIES раз.
+- Заблокировавшие бота и удалённые аккаунты (403, «chat not found») — постоянная
+  ошибка: получатель запоминается в DATA_DIR/broadcast.db и пропускается в
+  следующих рассылках, пока сам снова не напишет боту (/start).
+
+Части сообщения для получателя (parts): {"text": ..., "parse_mode": ...} —
+отправка текста, {"from_chat_id": ..., "message_id": ...} — копия сообщения.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+from config import BROADCAST_RATE_PER_SEC, BROADCAST_CHAT_INTERVAL, BROADCAST_MAX_RETRIES
+from services import storage
+from services.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+_BASE_BACKOFF = 1.0   # сек
+_MAX_BACKOFF = 30.0   # сек
+
+# Ошибки 400, после которых писать этому получателю бессмысленно
+_GONE_MARKERS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+_limiter = RateLimiter("telegram_broadcast", [(BROADCAST_RATE_PER_SEC, 1.0, 1)])
+
+_conn = None
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = storage.connect("broadcast.db")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocked_users ("
+            " user_id INTEGER PRIMARY KEY,"
+            " reason TEXT,"
+            " blocked_at REAL NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def blocked_user_ids() -> set[int]:
+    """Получатели, которым рассылка больше не отправляется."""
+    return {row[0] for row in _db().execute("SELECT user_id FROM blocked_users")}
+
+
+def mark_blocked(user_id: int, reason: str) -> None:
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO blocked_users (user_id, reason, blocked_at) VALUES (?, ?, ?)",
+            (user_id, reason, time.time()),
+        )
+
+
+def unblock(user_id: int) -> None:
+    """Пользователь снова написал боту — рассылки ему возобновляются."""
+    conn = _db()
+    with conn:
+        conn.execute("DELETE FROM blocked_users WHERE user_id = ?", (user_id,))
+
+
+async def _send_part(bot, chat_id: int, part: dict) -> None:
+    if "text" in part:
+        await bot.send_message(chat_id, text=part["text"], parse_mode=part.get("parse_mode"))
+    else:
+        await bot.copy_message(chat_id=chat_id, from_chat_id=part["from_chat_id"],
+                               message_id=part["message_id"])
+
+
+async def send_to_chat(bot, chat_id: int, parts: list[dict], start: int = 0) -> tuple[str, int, str | None]:
+    """Отправляет получателю части parts[start:] по порядку.
+
+    Возвращает (статус SENT/FAILED/BLOCKED, сколько частей отправлено всего,
+    текст ошибки). По числу отправленных частей прерванную отправку можно
+    продолжить, не повторяя уже доставленное.
+    """
+    sent = start
+    next_at = 0.0
+    for part in parts[start:]:
+        retries = 0
+        backoff = _BASE_BACKOFF
+        while True:
+            # Интервал между сообщениями одному получателю — без удержания общей очереди
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await _limiter.acquire()
+            try:
+                await _send_part(bot, chat_id, part)
+                break
+            except TelegramRetryAfter as e:
+                _limiter.penalize(e.retry_after)
+                retries += 1
+            except TelegramForbiddenError as e:
+                return BLOCKED, sent, str(e)
+            except TelegramBadRequest as e:
+                if any(marker in str(e).lower() for marker in _GONE_MARKERS):
+                    return BLOCKED, sent, str(e)
+                return FAILED, sent, str(e)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                retries += 1
+                if retries > BROADCAST_MAX_RETRIES:
+                    return FAILED, sent, str(e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, _MAX_BACKOFF)
+                continue
+            except Exception as e:
+                return FAILED, sent, str(e)
+            if retries > BROADCAST_MAX_RETRIES:
+                return FAILED, sent, "flood-wait: превышено число повторов"
+        sent += 1
+        next_at = time.monotonic() + BROADCAST_CHAT_INTERVAL
+    return SENT, sent, None
@@ -0,0 +1,170 @@
+"""
+Справочник карт банков (AdsCard, MultiCards, eCards) в памяти.
+
+Раньше каждый поиск карты по номеру выкачивал весь список карт банка и
+перебирал его. Теперь список банка загружается один раз и раскладывается в
+хэш-индексы: полные цифры номера, последние 4 цифры, ID карты. Поиск в
+card_actions.card_number_entered идёт по индексам без запросов к API.
+
+- Фоновая задача card_directory_refresher обновляет справочники банков, к
+  которым уже обращались (CARD_DIRECTORY_REFRESH_INTERVAL).
+- Промах по полному номеру: AdsCard/MultiCards — внеочередное обновление
+  справочника (не чаще CARD_DIRECTORY_MISS_COOLDOWN); eCards — серверный
+  поиск ecards.find_card_by_number, найденная карта добавляется в справочник.
+- После блокировки или смены лимита card_actions вызывает invalidate(bank):
+  следующий поиск перечитает список, чтобы не показать устаревшие статус/лимит.
+- Одновременные обновления одного банка схлопываются в одно (services/singleflight).
+
+Контракт find_card совпадает с find_card_by_number сервисов банков:
+{"card": <карта>, "multiple": bool} | {"error": ..., "details": ...} | None.
+"""
+import asyncio
+import logging
+import time
+
+from config import CARD_DIRECTORY_REFRESH_INTERVAL, CARD_DIRECTORY_MISS_COOLDOWN
+from services import adscard, ecards, multicards, singleflight
+
+logger = logging.getLogger(__name__)
+
+
+class _Directory:
+    """Снимок списка карт банка с индексами."""
+
+    def __init__(self, bank: str, cards: list):
+        self.loaded_at = time.monotonic()
+        self.stale = False
+        self.by_digits: dict[str, list] = {}
+        self.by_last4: dict[str, list] = {}
+        self.by_id: dict[str, dict] = {}
+        for card in cards:
+            self.add(bank, card)
+
+    def add(self, bank: str, card: dict) -> None:
+        if not isinstance(card, dict):
+            return
+        digits = _DIGITS[bank](card)
+        cid = _card_id(bank, card)
+        if cid is not None:
+            old = self.by_id.get(str(cid))
+            if old is not None:
+                self._remove(bank, old)
+            self.by_id[str(cid)] = card
+        if digits:
+            self.by_digits.setdefault(digits, []).append(card)
+            self.by_last4.setdefault(digits[-4:], []).append(card)
+
+    def _remove(self, bank: str, card: dict) -> None:
+        digits = _DIGITS[bank](card)
+        for index, key in ((self.by_digits, digits), (self.by_last4, digits[-4:])):
+            bucket = index.get(key)
+            if bucket and card in bucket:
+                bucket.remove(card)
+                if not bucket:
+                    del index[key]
+
+
+_DIGITS = {
+    "adscard": adscard.card_digits,
+    "multicards": multicards.card_digits,
+    "ecards": ecards.card_digits,
+}
+
+_directories: dict[str, _Directory] = {}
+_last_miss_refresh: dict[str, float] = {}
+
+
+def _card_id(bank: str, card: dict):
+    return ecards.card_id(card) if bank == "ecards" else card.get("id")
+
+
+async def _load(bank: str) -> dict | list:
+    """Полный список карт банка (список или dict с ошибкой)."""
+    if bank == "adscard":
+        result = await adscard.get_team_cards()
+        if adscard._has_error(result):
+            return result
+        data = result.get("data", {})
+        # data приходит как объект {"0": {...}, "1": {...}}
+        return list(data.values()) if isinstance(data, dict) else (data or [])
+    if bank == "ecards":
+        return await ecards.get_all_cards()
+    result = await multicards.get_cards()
+    if multicards._is_error(result):
+        return result
+    return result if isinstance(result, list) else []
+
+
+async def _do_refresh(bank: str) -> dict | None:
+    cards = await _load(bank)
+    if isinstance(cards, dict):
+        return cards
+    _directories[bank] = _Directory(bank, cards)
+    logger.info("[card_directory] %s: загружено карт %s", bank, len(cards))
+    return None
+
+
+async def refresh(bank: str) -> dict | None:
+    """Перечитывает справочник банка. None при успехе, иначе dict с ошибкой.
+
+    Если обновление этого банка уже идёт — ждёт его, а не запускает второе.
+    """
+    return await singleflight.do(("card_directory", bank), lambda: _do_refresh(bank))
+
+
+def invalidate(bank: str) -> None:
+    """Помечает справочник банка устаревшим (после блокировки/смены лимита)."""
+    directory = _directories.get(bank)
+    if directory is not None:
+        directory.stale = True
+
+
+def _match(directory: _Directory, needle: str, by_last4: bool) -> dict | None:
+    found = directory.by_digits.get(needle)
+    if not found and by_last4 and len(needle) >= 4:
+        found = directory.by_last4.get(needle[-4:])
+    if found:
+        return {"card": found[0], "multiple": len(found) > 1}
+    return None
+
+
+async def find_card(bank: str, number: str) -> dict | None:
+    """Ищет карту по номеру: точное совпадение цифр, затем последние 4 цифры."""
+    needle = "".join(ch for ch in str(number or "") if ch.isdigit())
+    if not needle:
+        return None
+
+    directory = _directories.get(bank)
+    if directory is None or directory.stale:
+        error = await refresh(bank)
+        if error is not None and directory is None:
+            return {"error": error.get("error"), "details": error.get("details")}
+        directory = _directories.get(bank, directory)
+
+    found = _match(directory, needle, by_last4=False)
+    if found:
+        return found
+
+    # Промах по полному номеру — возможно, карта выпущена после загрузки.
+    if bank == "ecards":
+        result = await ecards.find_card_by_number(number)
+        if isinstance(result, dict) and result.get("card"):
+            directory.add(bank, result["card"])
+        if result is not None:
+            return result
+    else:
+        now = time.monotonic()
+        if now - _last_miss_refresh.get(bank, 0.0) >= CARD_DIRECTORY_MISS_COOLDOWN:
+            _last_miss_refresh[bank] = now
+            if await refresh(bank) is None:
+                directory = _directories[bank]
+
+    return _match(directory, needle, by_last4=True)
+
+
+async def card_directory_refresher():
+    """Фоновая задача: обновляет справочники банков, к которым уже обращались."""
+    while True:
+        await asyncio.sleep(CARD_DIRECTORY_REFRESH_INTERVAL)
+        for bank in list(_directories):
+            await refresh(bank)
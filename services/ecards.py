@@ -22,6 +22,8 @@ JSON-массив, {items:[...]}, {data:[...]} или {data:{idx:{...}}} — н
 """
 import re
 import json
+import math
+import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
 
@@ -37,7 +39,9 @@ except Exception:  # pragma: no cover - зависит от наличия tzdat
 import aiohttp
 import bugsnag
 
-from config import ECARDS_TOKEN, BUGSNAG_TOKEN
+from config import (ECARDS_TOKEN, BUGSNAG_TOKEN, ECARDS_MAX_CONCURRENCY, ECARDS_PREFETCH_WINDOW,
+                    SINGLEFLIGHT_TTL)
+from services import http_client, singleflight
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +51,18 @@ _REQUEST_TIMEOUT = 30
 _PAGE_LIMIT = 100          # максимум по API.md (0–100)
 _MAX_PAGES = 50            # safety-cap на пагинацию (50*100 = 5000 операций)
 
+# Ограничение одновременных запросов к хосту eCards. Создаётся лениво — внутри
+# работающего event loop.
+_host_semaphore: asyncio.Semaphore | None = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _host_semaphore
+    if _host_semaphore is None:
+        _host_semaphore = asyncio.Semaphore(ECARDS_MAX_CONCURRENCY)
+    return _host_semaphore
+
+
 # Имена полей карты/группы — подтверждены живыми ответами.
 # Карта (GET /card, а также вложенная card в операции) отдаёт полный cardNumber.
 _FIELDS = {
@@ -119,6 +135,92 @@ def _page_is_last(result) -> bool:
     return False
 
 
+def _total_pages(result) -> int | None:
+    """Число страниц по totalPages/totalElements пейджинга, если API их сообщает."""
+    data = result.get("data") if isinstance(result, dict) else None
+    for container in (data, result):
+        if not isinstance(container, dict):
+            continue
+        pages = container.get("totalPages")
+        if isinstance(pages, int) and pages >= 0:
+            return pages
+        total = container.get("totalElements", container.get("total"))
+        if isinstance(total, int) and total >= 0:
+            return math.ceil(total / _PAGE_LIMIT)
+    return None
+
+
+class OperationsList(list):
+    """Список операций; truncated=True — пагинация упёрлась в _MAX_PAGES."""
+    truncated = False
+
+
+class _Pages:
+    """Обход страниц offset/limit с упреждающей загрузкой.
+
+    fetch_page(offset) — корутина, возвращающая ответ одной страницы. Если
+    первая страница сообщила общее число элементов, следующие страницы
+    запрашиваются заранее окном до ECARDS_PREFETCH_WINDOW штук; иначе страница
+    N+1 запрашивается, пока вызывающий разбирает страницу N. Страницы отдаются
+    по порядку; на ответе с ошибкой обход останавливается. После обхода
+    truncated показывает, что остались страницы за пределом _MAX_PAGES.
+
+        async with _Pages(fetch) as pages:
+            async for result in pages:
+                ...
+    """
+
+    def __init__(self, fetch_page):
+        self._fetch_page = fetch_page
+        self._tasks: dict[int, asyncio.Task] = {}
+        self.truncated = False
+
+    def _schedule(self, page: int) -> None:
+        if page < _MAX_PAGES and page not in self._tasks:
+            self._tasks[page] = asyncio.create_task(self._fetch_page(page * _PAGE_LIMIT))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Вызывающий мог выйти раньше (нашёл нужное) — лишние запросы отменяем.
+        for task in self._tasks.values():
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def __aiter__(self):
+        page = 0
+        total_pages = None
+        self._schedule(0)
+        while True:
+            result = await self._tasks.pop(page)
+            if _is_error(result):
+                yield result
+                return
+
+            if total_pages is None:
+                total_pages = _total_pages(result)
+            items = _as_list(result)
+            last = (_page_is_last(result) or len(items) < _PAGE_LIMIT
+                    or (total_pages is not None and page + 1 >= total_pages))
+            if not last:
+                if total_pages is not None:
+                    for ahead in range(page + 1, min(total_pages, page + 1 + ECARDS_PREFETCH_WINDOW)):
+                        self._schedule(ahead)
+                else:
+                    self._schedule(page + 1)
+
+            yield result
+            if last:
+                return
+            page += 1
+            if page >= _MAX_PAGES:
+                self.truncated = True
+                return
+
+
 async def _request(method: str, endpoint: str, params=None, json_body: dict | None = None):
     """Выполняет запрос к API eCards.
 
@@ -138,27 +240,28 @@ async def _request(method: str, endpoint: str, params=None, json_body: dict | No
     }
     timeout = aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT)
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.request(method, url, headers=headers,
-                                       params=params, json=json_body) as resp:
+        session = http_client.get_session()
+        async with _get_semaphore():
+            async with session.request(method, url, headers=headers, params=params,
+                                       json=json_body, timeout=timeout) as resp:
                 status = resp.status
                 text = await resp.text()
 
-                if status not in (200, 201):
-                    snippet = text[:300]
-                    _report(f"HTTP {status}: {snippet}", endpoint, status=status)
-                    return {"success": False, "error": f"http_{status}",
-                            "details": f"HTTP {status}: {snippet}"}
-
-                if not text:
-                    return {}
-                try:
-                    return json.loads(text)
-                except ValueError:
-                    snippet = text[:300]
-                    _report(f"невалидный JSON: {snippet}", endpoint)
-                    return {"success": False, "error": "bad_json",
-                            "details": f"Некорректный ответ eCards: {snippet}"}
+            if status not in (200, 201):
+                snippet = text[:300]
+                _report(f"HTTP {status}: {snippet}", endpoint, status=status)
+                return {"success": False, "error": f"http_{status}",
+                        "details": f"HTTP {status}: {snippet}"}
+
+            if not text:
+                return {}
+            try:
+                return json.loads(text)
+            except ValueError:
+                snippet = text[:300]
+                _report(f"невалидный JSON: {snippet}", endpoint)
+                return {"success": False, "error": "bad_json",
+                        "details": f"Некорректный ответ eCards: {snippet}"}
     except aiohttp.ClientError as e:
         _report(e, endpoint, kind="network_error")
         return {"success": False, "error": "network_error", "details": str(e)}
@@ -360,29 +463,55 @@ async def find_card_by_number(number: str) -> dict | None:
         return None
 
     last4 = needle[-4:] if len(needle) >= 4 else None
-    for page in range(_MAX_PAGES):
-        result = await _request("GET", "card", params=[
-            ("offset", str(page * _PAGE_LIMIT)),
+
+    async def fetch(offset: int):
+        return await _request("GET", "card", params=[
+            ("offset", str(offset)),
             ("limit", str(_PAGE_LIMIT)),
             ("search", number),
         ])
-        if _is_error(result):
-            return {"error": result.get("error"), "details": result.get("details")}
-        cards = _as_list(result)
-
-        exact = [c for c in cards if card_digits(c) == needle]
-        if exact:
-            return {"card": exact[0], "multiple": len(exact) > 1}
-        if last4:
-            by_last4 = [c for c in cards if card_digits(c) and card_digits(c)[-4:] == last4]
-            if by_last4:
-                return {"card": by_last4[0], "multiple": len(by_last4) > 1}
-
-        if _page_is_last(result) or len(cards) < _PAGE_LIMIT:
-            break
+
+    async with _Pages(fetch) as pages:
+        async for result in pages:
+            if _is_error(result):
+                return {"error": result.get("error"), "details": result.get("details")}
+            cards = _as_list(result)
+
+            exact = [c for c in cards if card_digits(c) == needle]
+            if exact:
+                return {"card": exact[0], "multiple": len(exact) > 1}
+            if last4:
+                by_last4 = [c for c in cards if card_digits(c) and card_digits(c)[-4:] == last4]
+                if by_last4:
+                    return {"card": by_last4[0], "multiple": len(by_last4) > 1}
+    if pages.truncated:
+        _report(f"карта не найдена в первых {_MAX_PAGES} страницах", "card")
     return None
 
 
+async def get_all_cards() -> dict | list:
+    """Все карты (GET /card) постранично — для справочника карт.
+
+    Возвращает список карт или dict с ошибкой; при упоре в _MAX_PAGES
+    логирует усечение.
+    """
+    async def fetch(offset: int):
+        return await _request("GET", "card", params=[
+            ("offset", str(offset)),
+            ("limit", str(_PAGE_LIMIT)),
+        ])
+
+    cards: list = []
+    async with _Pages(fetch) as pages:
+        async for result in pages:
+            if _is_error(result):
+                return result
+            cards.extend(_as_list(result))
+    if pages.truncated:
+        _report(f"достигнут предел пагинации {_MAX_PAGES} страниц", "card", collected=len(cards))
+    return cards
+
+
 async def block_card(card_id_value) -> dict:
     """Закрывает карту (POST /card/close). Действие необратимо."""
     return await _request("POST", "card/close", json_body={"cardsIds": [card_id_value]})
@@ -416,30 +545,101 @@ async def get_card_operations(created_from: str | None = None, created_to: str |
     return await _request("GET", "card-operation", params=params)
 
 
-async def get_all_group_operations(group_id_value, created_from: str, created_to: str) -> dict | list:
-    """Все операции группы за период с пагинацией.
+async def _paginate_operations(created_from: str, created_to: str,
+                               group_ids: list) -> dict | OperationsList:
+    """Все операции по фильтру групп за период с пагинацией (см. _Pages).
 
-    Возвращает список операций при успехе или dict с ошибкой. При упоре в
-    safety-cap (_MAX_PAGES) — логирует, чтобы усечение не было тихим.
+    Возвращает OperationsList при успехе или dict с ошибкой. При упоре в
+    safety-cap (_MAX_PAGES) список помечается truncated и ошибка логируется.
     """
-    all_ops: list = []
-    for page in range(_MAX_PAGES):
-        result = await get_card_operations(
-            created_from, created_to, group_ids=[group_id_value],
-            offset=page * _PAGE_LIMIT, limit=_PAGE_LIMIT,
-        )
-        if _is_error(result):
-            return result
-        ops = _as_list(result)
-        all_ops.extend(ops)
-        if _page_is_last(result) or len(ops) < _PAGE_LIMIT:
-            break
-    else:
+    async def fetch(offset: int):
+        return await get_card_operations(created_from, created_to, group_ids=group_ids,
+                                         offset=offset, limit=_PAGE_LIMIT)
+
+    all_ops = OperationsList()
+    async with _Pages(fetch) as pages:
+        async for result in pages:
+            if _is_error(result):
+                return result
+            all_ops.extend(_as_list(result))
+    if pages.truncated:
+        all_ops.truncated = True
         _report(f"достигнут предел пагинации {_MAX_PAGES} страниц", "card-operation",
-                group_id=group_id_value, collected=len(all_ops))
+                group_ids=group_ids, collected=len(all_ops))
     return all_ops
 
 
+async def get_all_group_operations(group_id_value, created_from: str,
+                                   created_to: str) -> dict | OperationsList:
+    """Все операции группы за период с пагинацией (OperationsList или dict с ошибкой)."""
+    return await _paginate_operations(created_from, created_to, [group_id_value])
+
+
+def op_group_ids(op: dict) -> set[str]:
+    """ID групп карты операции (строками), если ответ их содержит.
+
+    Формат не специфицирован: смотрим groupsRelations карты (элементы —
+    {groupId}/{cardGroupId}/{group:{id}}/{cardGroup:{id}}) и плоские
+    cardGroupId/groupId у операции и карты.
+    """
+    ids: set[str] = set()
+    card = op_card(op)
+    relations = card.get("groupsRelations")
+    for rel in relations if isinstance(relations, list) else []:
+        if not isinstance(rel, dict):
+            continue
+        nested = rel.get("group") or rel.get("cardGroup")
+        value = rel.get("groupId") or rel.get("cardGroupId") or (
+            nested.get("id") if isinstance(nested, dict) else None)
+        if value is not None:
+            ids.add(str(value))
+    for obj in (op, card):
+        if isinstance(obj, dict):
+            for key in ("cardGroupId", "groupId"):
+                if obj.get(key) is not None:
+                    ids.add(str(obj[key]))
+    return ids
+
+
+def op_group_id(op: dict):
+    """Группа, к которой отнесена операция (get_all_operations_for_groups), или None."""
+    return op.get("_group_id") if isinstance(op, dict) else None
+
+
+async def get_all_operations_for_groups(group_ids: list, created_from: str,
+                                        created_to: str) -> dict | OperationsList:
+    """Операции всех групп одним пагинированным запросом (filterCardGroupId[] × N).
+
+    Операции дедуплицируются по id. Каждой проставляется ключ "_group_id" —
+    группа из group_ids, к которой относится карта (см. op_group_ids); если
+    группа одна, она проставляется всем; если определить не удалось — None.
+    Возвращает OperationsList (truncated — как у пагинации) или dict с ошибкой.
+    """
+    if not group_ids:
+        return OperationsList()
+    result = await _paginate_operations(created_from, created_to, list(group_ids))
+    if _is_error(result):
+        return result
+
+    wanted = {str(gid): gid for gid in group_ids}
+    single = group_ids[0] if len(group_ids) == 1 else None
+    operations = OperationsList()
+    operations.truncated = result.truncated
+    seen: set = set()
+    for op in result:
+        if not isinstance(op, dict):
+            continue
+        op_id = op.get("id")
+        if op_id is not None:
+            if op_id in seen:
+                continue
+            seen.add(op_id)
+        matched = [wanted[g] for g in op_group_ids(op) if g in wanted]
+        op["_group_id"] = matched[0] if matched else single
+        operations.append(op)
+    return operations
+
+
 def _op_sign(op_type_value) -> float:
     """Знак операции для расхода: +1 списание, -1 возврат, 0 не учитывать.
 
@@ -462,35 +662,20 @@ def _op_sign(op_type_value) -> float:
     return 0.0
 
 
-def sum_spend_by_currency(operations: list) -> dict[str, float]:
-    """Нетто-расход по валютам: + списания, − возвраты; прочие типы игнорируются.
-
-    Сумма — поле value операции, валюта — валюта карты. Оба парсятся толерантно.
-    """
-    totals: dict[str, float] = {}
-    for op in operations:
-        if not isinstance(op, dict):
-            continue
-        sign = _op_sign(op_type(op))
-        if sign == 0.0:
-            continue
-
-        try:
-            amount = abs(float(str(op_value(op)).replace(",", ".")))
-        except (TypeError, ValueError):
-            continue
-
-        currency = str(op_currency(op) or "").upper() or "?"
-        totals[currency] = totals.get(currency, 0.0) + sign * amount
-    return totals
-
-
 # --------------------------------------------------------------------------- #
 # Группы карт
 # --------------------------------------------------------------------------- #
 async def get_card_groups() -> dict | list:
-    """Список групп карт (GET /card-group). Успех — коллекция групп."""
-    return await _request("GET", "card-group", params=[("limit", str(_PAGE_LIMIT))])
+    """Список групп карт (GET /card-group). Успех — коллекция групп.
+
+    Одновременные вызовы разделяют один запрос (single-flight).
+    """
+    params = [("limit", str(_PAGE_LIMIT))]
+    return await singleflight.do(
+        singleflight.make_key("GET", "card-group", params),
+        lambda: _request("GET", "card-group", params=params),
+        ttl=SINGLEFLIGHT_TTL,
+    )
 
 
 # --------------------------------------------------------------------------- #
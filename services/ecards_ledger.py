@@ -0,0 +1,414 @@
+"""
+Локальный журнал операций eCards (DATA_DIR/ecards_ledger.db).
+
+Отчёты о расходе больше не выкачивают весь период из /card-operation: операции
+хранятся в SQLite по ID, с индексами по группе, карте, валюте и createdAt.
+Знак операции (_op_sign) и сумма вычисляются один раз — при записи в журнал,
+поэтому расход за любой период — это агрегатный SQL-запрос.
+
+Синхронизация по группе (таблица sync_state):
+- covered_from — с какого момента у группы есть полная история. Если отчёту
+  нужен более ранний период — догружается только недостающий кусок.
+- synced_to — момент последней синхронизации. Следующая синхронизация
+  забирает операции с synced_to - ECARDS_LEDGER_RECHECK_WINDOW: окно
+  перепроверки ловит смену статуса (отклонение, реверс) у недавних операций.
+  Операции окна, пропавшие из ответа API, удаляются.
+- gap_from/gap_to — пропуск внутри истории: дельта упёрлась в предел
+  пагинации, и операции окна старше самой старой полученной не пришли.
+  Каждая следующая синхронизация догружает пропуск; при новом усечении он
+  сужается до самой старой полученной операции. Пока пропуск не закрыт,
+  отчёты помечаются как неполные.
+
+Дневные итоги (таблица daily_spend): нетто по (группа, карта, валюта,
+киевский день) пересчитываются при каждой записи операций за затронутые дни —
+поздний возврат или реверс внутри окна перепроверки исправляет прошлый день.
+Расход за период (пресеты, 4-недельный цикл, свой период — все выровнены по
+киевским суткам) — сумма не более чем ~60 дневных строк на группу.
+
+Первая синхронизация нескольких групп байера — один общий запрос
+(ecards.get_all_operations_for_groups): операции дедуплицируются и
+раскладываются по группам по op_group_id. Если общий запрос не удался, упёрся
+в предел пагинации или группу какой-то операции определить нельзя — группы
+загружаются по отдельности. Дальше группы синхронизируются параллельно, каждая
+своим запросом (у каждой своё окно). Ошибка группы не прерывает остальные.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone, timedelta
+
+from config import ECARDS_LEDGER_RECHECK_WINDOW, ECARDS_LEDGER_MIN_SYNC_INTERVAL
+from services import ecards, storage
+
+logger = logging.getLogger(__name__)
+
+_conn = None
+_group_locks: dict[str, asyncio.Lock] = {}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = storage.connect("ecards_ledger.db")
+        _conn.executescript(
+            "CREATE TABLE IF NOT EXISTS operations ("
+            " id TEXT PRIMARY KEY,"
+            " group_id TEXT NOT NULL,"
+            " card_id TEXT,"
+            " currency TEXT NOT NULL,"
+            " created_at TEXT NOT NULL,"   # ISO 8601 UTC (формат ecards._iso)
+            " kyiv_day TEXT NOT NULL DEFAULT '',"  # ГГГГ-ММ-ДД по Киеву
+            " type TEXT,"
+            " amount REAL NOT NULL,"
+            " sign REAL NOT NULL,"
+            " raw TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS ix_ops_group_created ON operations (group_id, created_at);"
+            "CREATE INDEX IF NOT EXISTS ix_ops_card_created ON operations (card_id, created_at);"
+            "CREATE INDEX IF NOT EXISTS ix_ops_currency_created ON operations (currency, created_at);"
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " group_id TEXT PRIMARY KEY,"
+            " covered_from TEXT NOT NULL,"
+            " synced_to TEXT NOT NULL,"
+            " synced_at REAL NOT NULL,"
+            " gap_from TEXT,"              # пропуск после усечённой дельты (NULL — нет)
+            " gap_to TEXT);"
+            "CREATE TABLE IF NOT EXISTS daily_spend ("
+            " group_id TEXT NOT NULL,"
+            " card_id TEXT NOT NULL,"      # '' — операция без карты
+            " currency TEXT NOT NULL,"
+            " day TEXT NOT NULL,"          # киевский день, ГГГГ-ММ-ДД
+            " total REAL NOT NULL,"
+            " ops INTEGER NOT NULL,"
+            " PRIMARY KEY (group_id, day, card_id, currency));"
+        )
+        _migrate(_conn)
+        _conn.execute("CREATE INDEX IF NOT EXISTS ix_ops_group_day ON operations (group_id, kyiv_day)")
+        _conn.commit()
+    return _conn
+
+
+def _migrate(conn) -> None:
+    """Доводит схему журнала, созданного раньше: пропуски синхронизации,
+    operations.kyiv_day и дневные итоги."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(sync_state)")}
+    if "gap_from" not in columns:
+        conn.execute("ALTER TABLE sync_state ADD COLUMN gap_from TEXT")
+        conn.execute("ALTER TABLE sync_state ADD COLUMN gap_to TEXT")
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(operations)")}
+    if "kyiv_day" in columns:
+        return
+    conn.execute("ALTER TABLE operations ADD COLUMN kyiv_day TEXT NOT NULL DEFAULT ''")
+    rows = conn.execute("SELECT id, created_at FROM operations").fetchall()
+    conn.executemany("UPDATE operations SET kyiv_day = ? WHERE id = ?",
+                     [(_kyiv_day(r["created_at"]), r["id"]) for r in rows])
+    conn.execute("DELETE FROM daily_spend")
+    _rebuild_days(conn, conn.execute("SELECT DISTINCT group_id, kyiv_day FROM operations").fetchall())
+
+
+def _group_lock(gid: str) -> asyncio.Lock:
+    lock = _group_locks.get(gid)
+    if lock is None:
+        lock = _group_locks[gid] = asyncio.Lock()
+    return lock
+
+
+def _norm_ts(value) -> str:
+    """createdAt операции → ISO 8601 UTC в формате ecards._iso (для сравнения строк)."""
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return str(value or "")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return ecards._iso(dt)
+
+
+def _kyiv_day(iso: str) -> str:
+    """ISO-момент UTC → киевский день ГГГГ-ММ-ДД."""
+    try:
+        dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return str(iso or "")[:10]
+    return dt.astimezone(ecards.KYIV_TZ).strftime("%Y-%m-%d")
+
+
+def _shift(iso: str, seconds: float) -> str:
+    """Сдвигает ISO-момент (формат ecards._iso) на seconds секунд."""
+    dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
+    return ecards._iso(dt + timedelta(seconds=seconds))
+
+
+def _row(op: dict, gid: str) -> tuple | None:
+    """Операция API → строка таблицы operations (None — без даты)."""
+    created_at = _norm_ts(ecards.op_date(op))
+    if not created_at:
+        return None
+    raw = json.dumps(op, ensure_ascii=False, sort_keys=True)
+    op_id = op.get("id")
+    try:
+        amount = abs(float(str(ecards.op_value(op)).replace(",", ".")))
+    except (TypeError, ValueError):
+        amount = 0.0
+    currency = str(ecards.op_currency(op) or "").upper() or "?"
+    card = ecards.op_card_id(op)
+    return (
+        str(op_id) if op_id is not None else "raw:" + hashlib.sha1(raw.encode()).hexdigest(),
+        gid,
+        str(card) if card is not None else None,
+        currency,
+        created_at,
+        _kyiv_day(created_at),
+        ecards.op_type(op),
+        amount,
+        ecards._op_sign(ecards.op_type(op)) if amount else 0.0,
+        raw,
+    )
+
+
+def _rebuild_days(conn, group_days) -> None:
+    """Пересчитывает daily_spend для пар (group_id, day) из журнала операций."""
+    for gid, day in group_days:
+        conn.execute("DELETE FROM daily_spend WHERE group_id = ? AND day = ?", (gid, day))
+        conn.execute(
+            "INSERT INTO daily_spend (group_id, card_id, currency, day, total, ops)"
+            " SELECT group_id, COALESCE(card_id, ''), currency, kyiv_day, SUM(sign * amount), COUNT(*)"
+            " FROM operations WHERE group_id = ? AND kyiv_day = ? AND sign != 0"
+            " GROUP BY COALESCE(card_id, ''), currency",
+            (gid, day),
+        )
+
+
+def _store(gid: str, operations: list, window_from: str, window_to: str, replace: bool) -> str | None:
+    """Записывает операции группы; replace — удаляет операции окна, которых нет в ответе.
+
+    Дневные итоги затронутых дней (старых и новых строк) пересчитываются в той
+    же транзакции. Возвращает createdAt самой старой записанной операции (или None).
+    """
+    rows = [r for r in (_row(op, gid) for op in operations if isinstance(op, dict)) if r]
+    conn = _db()
+    with conn:
+        affected = {(gid, r[5]) for r in rows}
+        # Операция могла раньше числиться за другой группой — её итоги тоже пересчитать.
+        for i in range(0, len(rows), 500):
+            chunk = [r[0] for r in rows[i:i + 500]]
+            affected.update(
+                (r["group_id"], r["kyiv_day"]) for r in conn.execute(
+                    f"SELECT group_id, kyiv_day FROM operations WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+        if replace:
+            affected.update(
+                (r["group_id"], r["kyiv_day"]) for r in conn.execute(
+                    "SELECT DISTINCT group_id, kyiv_day FROM operations"
+                    " WHERE group_id = ? AND created_at >= ? AND created_at <= ?",
+                    (gid, window_from, window_to),
+                )
+            )
+            conn.execute(
+                "DELETE FROM operations WHERE group_id = ? AND created_at >= ? AND created_at <= ?",
+                (gid, window_from, window_to),
+            )
+        conn.executemany(
+            "INSERT OR REPLACE INTO operations"
+            " (id, group_id, card_id, currency, created_at, kyiv_day, type, amount, sign, raw)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        _rebuild_days(conn, affected)
+    return min((r[4] for r in rows), default=None)
+
+
+async def _fetch_into(gid: str, window_from: str, window_to: str) -> dict:
+    """Загружает операции группы за окно в журнал. {"error"/"details"} или {"truncated": bool, "oldest": ...}."""
+    result = await ecards.get_all_group_operations(gid, window_from, window_to)
+    if ecards._is_error(result):
+        return result
+    # При усечении (desc-сортировка) самые старые операции окна не пришли —
+    # удалять «пропавшие» нельзя.
+    oldest = _store(gid, result, window_from, window_to, replace=not result.truncated)
+    return {"truncated": result.truncated, "oldest": oldest}
+
+
+async def _sync_group(gid: str, created_from: str) -> dict:
+    """Доводит журнал группы до «сейчас» и назад до created_from.
+
+    Возвращает {"truncated": bool} или dict с ошибкой.
+    """
+    async with _group_lock(gid):
+        conn = _db()
+        state = conn.execute(
+            "SELECT covered_from, synced_to, synced_at, gap_from, gap_to FROM sync_state WHERE group_id = ?",
+            (gid,)
+        ).fetchone()
+        now = ecards._iso(datetime.now(timezone.utc))
+        truncated = False
+
+        if state is None:
+            fetched = await _fetch_into(gid, created_from, now)
+            if ecards._is_error(fetched):
+                return fetched
+            truncated = fetched["truncated"]
+            covered_from = fetched["oldest"] if truncated and fetched["oldest"] else created_from
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (group_id, covered_from, synced_to, synced_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (gid, covered_from, now, time.time()),
+                )
+            return {"truncated": truncated}
+
+        covered_from, synced_to, synced_at = state["covered_from"], state["synced_to"], state["synced_at"]
+        gap_from, gap_to = state["gap_from"], state["gap_to"]
+
+        # Дельта: от последней синхронизации (минус окно перепроверки) до сейчас.
+        if time.time() - synced_at >= ECARDS_LEDGER_MIN_SYNC_INTERVAL:
+            window_from = _shift(synced_to, -ECARDS_LEDGER_RECHECK_WINDOW)
+            fetched = await _fetch_into(gid, window_from, now)
+            if ecards._is_error(fetched):
+                return fetched
+            if fetched["truncated"] and fetched["oldest"]:
+                # Пришли только самые новые операции окна: всё от window_from до
+                # самой старой полученной — пропуск (объединяется с прежним)
+                gap_from = min(gap_from, window_from) if gap_from else window_from
+                gap_to = max(gap_to, fetched["oldest"]) if gap_to else fetched["oldest"]
+            synced_to = now
+            with conn:
+                conn.execute(
+                    "UPDATE sync_state SET synced_to = ?, synced_at = ?, gap_from = ?, gap_to = ?"
+                    " WHERE group_id = ?",
+                    (synced_to, time.time(), gap_from, gap_to, gid),
+                )
+
+        # Догрузка пропуска, оставленного усечённой дельтой.
+        if gap_from:
+            fetched = await _fetch_into(gid, gap_from, gap_to)
+            if ecards._is_error(fetched):
+                return fetched
+            if fetched["truncated"] and fetched["oldest"] and fetched["oldest"] < gap_to:
+                gap_to = fetched["oldest"]
+            elif not fetched["truncated"]:
+                gap_from = gap_to = None
+            truncated = gap_from is not None
+            with conn:
+                conn.execute("UPDATE sync_state SET gap_from = ?, gap_to = ? WHERE group_id = ?",
+                             (gap_from, gap_to, gid))
+
+        # Догрузка истории, если отчёту нужен более ранний период.
+        if created_from < covered_from:
+            fetched = await _fetch_into(gid, created_from, covered_from)
+            if ecards._is_error(fetched):
+                return fetched
+            if fetched["truncated"]:
+                truncated = True
+                covered_from = fetched["oldest"] or covered_from
+            else:
+                covered_from = created_from
+            with conn:
+                conn.execute("UPDATE sync_state SET covered_from = ? WHERE group_id = ?",
+                             (covered_from, gid))
+
+        return {"truncated": truncated}
+
+
+async def _initial_sync_combined(group_ids: list[str], created_from: str) -> None:
+    """Первая загрузка нескольких групп одним общим запросом.
+
+    Группы, которые не удалось так загрузить, остаются без sync_state — их
+    загрузит _sync_group отдельным запросом.
+    """
+    now = ecards._iso(datetime.now(timezone.utc))
+    result = await ecards.get_all_operations_for_groups(group_ids, created_from, now)
+    if ecards._is_error(result) or result.truncated:
+        return
+    by_group: dict[str, list] = {gid: [] for gid in group_ids}
+    for op in result:
+        gid = ecards.op_group_id(op)
+        if gid is None or str(gid) not in by_group:
+            return  # группа операции неизвестна — разложить по группам нельзя
+        by_group[str(gid)].append({k: v for k, v in op.items() if k != "_group_id"})
+
+    conn = _db()
+    for gid, operations in by_group.items():
+        async with _group_lock(gid):
+            if conn.execute("SELECT 1 FROM sync_state WHERE group_id = ?", (gid,)).fetchone():
+                continue  # пока шёл запрос, группу уже загрузил другой отчёт
+            _store(gid, operations, created_from, now, replace=True)
+            with conn:
+                conn.execute(
+                    "INSERT INTO sync_state (group_id, covered_from, synced_to, synced_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (gid, created_from, now, time.time()),
+                )
+
+
+async def sync_groups(group_ids: list, created_from: str) -> dict:
+    """Синхронизирует журнал групп (параллельно) начиная с created_from.
+
+    Возвращает {"failed": {group_id: details}, "truncated": bool}.
+    """
+    conn = _db()
+    fresh = [str(gid) for gid in group_ids
+             if not conn.execute("SELECT 1 FROM sync_state WHERE group_id = ?", (str(gid),)).fetchone()]
+    if len(fresh) > 1:
+        await _initial_sync_combined(fresh, created_from)
+
+    results = await asyncio.gather(*(_sync_group(str(gid), created_from) for gid in group_ids))
+    failed: dict = {}
+    truncated = False
+    for gid, result in zip(group_ids, results):
+        if ecards._is_error(result):
+            failed[gid] = result.get("details") or result.get("error")
+        else:
+            truncated = truncated or result["truncated"]
+    return {"failed": failed, "truncated": truncated}
+
+
+def sum_spend(group_ids: list, created_from: str, created_to: str) -> dict[str, float]:
+    """Нетто-расход групп по валютам за период: + списания, − возвраты (знак — ecards._op_sign).
+
+    Считается по дневным итогам: период берётся целыми киевскими сутками.
+    """
+    if not group_ids:
+        return {}
+    placeholders = ",".join("?" * len(group_ids))
+    rows = _db().execute(
+        f"SELECT currency, SUM(total) AS total FROM daily_spend"
+        f" WHERE group_id IN ({placeholders}) AND day >= ? AND day <= ?"
+        f" GROUP BY currency",
+        [str(gid) for gid in group_ids] + [_kyiv_day(created_from), _kyiv_day(created_to)],
+    ).fetchall()
+    return {r["currency"]: r["total"] for r in rows}
+
+
+def daily_breakdown(group_ids: list, created_from: str, created_to: str) -> list[tuple[str, str, float]]:
+    """Нетто по дням периода: [(ГГГГ-ММ-ДД, валюта, сумма)] по возрастанию дня."""
+    if not group_ids:
+        return []
+    placeholders = ",".join("?" * len(group_ids))
+    rows = _db().execute(
+        f"SELECT day, currency, SUM(total) AS total FROM daily_spend"
+        f" WHERE group_id IN ({placeholders}) AND day >= ? AND day <= ?"
+        f" GROUP BY day, currency ORDER BY day, currency",
+        [str(gid) for gid in group_ids] + [_kyiv_day(created_from), _kyiv_day(created_to)],
+    ).fetchall()
+    return [(r["day"], r["currency"], r["total"]) for r in rows]
+
+
+async def get_spend(group_ids: list, created_from: str, created_to: str) -> dict:
+    """Синхронизирует журнал и считает нетто-расход групп за период.
+
+    Возвращает {"totals": {валюта: сумма}, "days": [(день, валюта, сумма)],
+    "failed": {group_id: details}, "truncated": bool}. Группы, которые не
+    удалось синхронизировать, в итог не входят (как и при прямой загрузке).
+    """
+    synced = await sync_groups(group_ids, created_from)
+    ok_groups = [gid for gid in group_ids if gid not in synced["failed"]]
+    return {
+        "totals": sum_spend(ok_groups, created_from, created_to),
+        "days": daily_breakdown(ok_groups, created_from, created_to),
+        "failed": synced["failed"],
+        "truncated": synced["truncated"],
+    }
@@ -0,0 +1,185 @@
+"""
+Извлечение переводимого текста из HTML (режим перевода по сегментам).
+
+Раньше в модель уходила вся разметка со скриптами и стилями с просьбой
+сохранить теги: большая часть токенов — разметка, а ответы с потерянными
+мета-тегами или обрезанные целиком переспрашивались. Здесь HTML разбирается
+html.parser, и наружу отдаются только переводимые места исходного текста:
+
+- текстовые узлы (кроме <script>/<style>), в том числе содержимое <title>;
+- атрибуты alt, title, placeholder и value кнопок формы;
+- content мета-тегов description/keywords и og:/twitter: title/description;
+- атрибут lang тега <html> (вид LANG — его заменяют кодом языка).
+
+Сегмент помнит положение в исходной строке; apply_translations вставляет
+переводы на эти места, не трогая ни одного символа разметки вокруг.
+"""
+import html
+import re
+from html.parser import HTMLParser
+
+TEXT = "text"
+LANG = "lang"
+
+# Не переводятся: содержимое этих тегов — код
+_SKIP_TAGS = {"script", "style"}
+
+_TEXT_ATTRS = {"alt", "title", "placeholder"}
+_BUTTON_TYPES = {"submit", "button", "reset"}
+_META_KEYS = {"description", "keywords", "og:title", "og:description", "og:site_name",
+              "twitter:title", "twitter:description"}
+
+_ATTR_RE = re.compile(
+    r"""([^\s/>"'=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?"""
+)
+
+
+class Segment:
+    """Переводимое место в исходном тексте: text == source[start:end]."""
+
+    def __init__(self, start: int, end: int, text: str, kind: str = TEXT, quote: str | None = None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.kind = kind
+        # Кавычка значения атрибута ('"', "'" или "" — без кавычек); None — текстовый узел
+        self.quote = quote
+
+
+def _has_letters(text: str) -> bool:
+    return any(ch.isalpha() for ch in text)
+
+
+class _Extractor(HTMLParser):
+    def __init__(self, source: str):
+        super().__init__(convert_charrefs=True)
+        self.source = source
+        self.line_starts = [0]
+        for match in re.finditer("\n", source):
+            self.line_starts.append(match.end())
+        self.segments: list[Segment] = []
+        self.skip: str | None = None
+        self.data_start: int | None = None
+
+    def _offset(self) -> int:
+        line, col = self.getpos()
+        return self.line_starts[line - 1] + col
+
+    def _flush(self, end: int) -> None:
+        """Закрывает текстовый узел, начатый в data_start: он длится до следующей конструкции."""
+        start, self.data_start = self.data_start, None
+        if start is None or self.skip:
+            return
+        raw = self.source[start:end]
+        stripped = raw.strip()
+        if not stripped or not _has_letters(html.unescape(stripped)):
+            return
+        lead = len(raw) - len(raw.lstrip())
+        self.segments.append(Segment(start + lead, start + lead + len(stripped), stripped))
+
+    def _mark(self) -> None:
+        self._flush(self._offset())
+
+    def handle_data(self, data):
+        if self.data_start is None:
+            self.data_start = self._offset()
+
+    def handle_starttag(self, tag, attrs):
+        self._mark()
+        self._attributes(tag, attrs)
+        if tag in _SKIP_TAGS:
+            self.skip = tag
+
+    def handle_startendtag(self, tag, attrs):
+        self._mark()
+        self._attributes(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._mark()
+        if tag == self.skip:
+            self.skip = None
+
+    def handle_comment(self, data):
+        self._mark()
+
+    def handle_decl(self, decl):
+        self._mark()
+
+    def handle_pi(self, data):
+        self._mark()
+
+    def unknown_decl(self, data):
+        self._mark()
+
+    def close(self):
+        super().close()
+        self._flush(len(self.source))
+
+    def _wanted(self, tag: str, attrs: dict) -> dict[str, str]:
+        """Какие атрибуты тега переводить: имя атрибута -> вид сегмента."""
+        wanted = {name: TEXT for name in _TEXT_ATTRS if attrs.get(name)}
+        if tag == "html" and attrs.get("lang"):
+            wanted["lang"] = LANG
+        if tag == "input" and (attrs.get("type") or "").lower() in _BUTTON_TYPES and attrs.get("value"):
+            wanted["value"] = TEXT
+        if tag == "meta" and attrs.get("content"):
+            key = (attrs.get("name") or attrs.get("property") or "").lower()
+            if key in _META_KEYS:
+                wanted["content"] = TEXT
+        return wanted
+
+    def _attributes(self, tag: str, attrs: list) -> None:
+        wanted = self._wanted(tag, {name: value for name, value in attrs})
+        if not wanted:
+            return
+        raw = self.get_starttag_text()
+        start = self._offset()
+        if raw is None or self.source[start:start + len(raw)] != raw:
+            return  # не удалось сопоставить тег с исходником — лучше не трогать
+        # Пропускаем «<tag» и разбираем атрибуты с их положением
+        pos = 1 + len(tag)
+        for match in _ATTR_RE.finditer(raw, pos):
+            name = match.group(1).lower()
+            kind = wanted.pop(name, None)
+            if kind is None:
+                continue
+            for group, quote in ((2, '"'), (3, "'"), (4, "")):
+                value = match.group(group)
+                if value is None:
+                    continue
+                if kind == LANG or _has_letters(html.unescape(value)):
+                    self.segments.append(Segment(start + match.start(group), start + match.end(group),
+                                                 value, kind, quote))
+                break
+
+
+def extract_segments(source: str) -> list[Segment]:
+    """Переводимые сегменты HTML в порядке следования в документе."""
+    parser = _Extractor(source)
+    parser.feed(source)
+    parser.close()
+    return sorted(parser.segments, key=lambda s: s.start)
+
+
+def _escape(segment: Segment, translated: str) -> str:
+    if segment.quote is None:
+        # Текстовый узел: перевод не должен открыть тег
+        return translated.replace("<", "&lt;").replace(">", "&gt;")
+    if segment.quote == "'":
+        return translated.replace("'", "&#39;")
+    escaped = translated.replace('"', "&quot;")
+    return escaped if segment.quote else f'"{escaped}"'
+
+
+def apply_translations(source: str, segments: list[Segment], translations: list[str | None]) -> str:
+    """Вставляет переводы на места сегментов; None — сегмент остаётся как был."""
+    parts = []
+    pos = 0
+    for segment, translated in zip(segments, translations):
+        if translated is None:
+            continue
+        parts.append(source[pos:segment.start])
+        parts.append(_escape(segment, translated))
+        pos = segment.end
+    parts.append(source[pos:])
+    return "".join(parts)
@@ -0,0 +1,62 @@
+"""
+Общий пул HTTP-соединений для внешних API (AdsCard, MultiCards, eCards, luboydomen).
+
+Одна долгоживущая aiohttp.ClientSession на процесс: TCPConnector держит пулы
+соединений по хостам (keep-alive), кэширует DNS и ограничивает общее число
+соединений. Так пагинация и поллинг не платят TCP+TLS-рукопожатие на каждую
+страницу.
+
+Сессия создаётся при старте бота (main.main -> start) и закрывается при
+остановке (close). Тайм-ауты задаются на уровне запроса — у каждого сервиса
+свои. Лимиты настраиваются через .env (см. config.HTTP_*).
+"""
+import logging
+
+import aiohttp
+
+from config import (HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST,
+                    HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+_session: aiohttp.ClientSession | None = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,                   # всего соединений
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,  # пул на один хост
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,        # кэш DNS, сек
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def start() -> None:
+    """Создаёт общую сессию (вызывается при старте бота)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+        logger.info("[http] пул соединений создан (limit=%s, per_host=%s)",
+                    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Возвращает общую сессию.
+
+    Если start() не вызывался (скрипт, отладка) — создаёт её лениво, чтобы
+    сервисы работали и вне main.main().
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+async def close() -> None:
+    """Закрывает общую сессию и все соединения пула (при остановке бота)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("[http] пул соединений закрыт")
+    _session = None
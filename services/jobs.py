@@ -0,0 +1,315 @@
+"""
+Фоновые массовые задачи с сохранением прогресса (DATA_DIR/jobs.db).
+
+Массовая операция (покупка номеров, автопродление, ...) не выполняется внутри
+обработчика сообщения: обработчик ставит задачу в очередь (enqueue) и сразу
+отвечает пользователю номером задачи. Задача состоит из единиц работы (units),
+каждая единица после выполнения записывается на диск. После перезапуска бота
+worker продолжает незавершённые задачи с первой невыполненной единицы.
+
+Вид задачи регистрирует модуль, которому она принадлежит (register):
+- run_unit(bot, params, payload) -> dict — выполняет единицу; результат
+  сохраняется как есть, признак успеха — ключ "ok" (статус единицы done/failed;
+  ключ "status" задаёт свой, например blocked). Исключение — ошибка единицы.
+  Ключ "resume" (dict) — с чего продолжить: при повторе (retry_failed) он
+  вливается в payload, и единица не повторяет уже сделанное.
+- prepare(params, payload) -> dict — необязательно: дополняет payload перед
+  выполнением (например, генерирует имя); дополненный payload сохраняется до
+  запроса, чтобы recover знал, что именно отправлялось.
+- recover(params, payload) -> dict | None — необязательно: вызывается для
+  единицы, прерванной перезапуском посреди запроса, чтобы не повторить
+  неидемпотентную операцию (None — выполнить единицу заново).
+- progress_text(job, units) -> str — текст сообщения о прогрессе.
+- finish(bot, job, units) — итог пользователю после последней единицы.
+
+Единицы одной задачи выполняются по очереди (concurrency > 1 — столькими
+параллельными воркерами), разные задачи — параллельно; темп задают
+ограничители сервисов (luboydomen, рассылки). Сообщение о прогрессе
+редактируется не чаще JOBS_PROGRESS_INTERVAL и только при изменении.
+retry_failed возвращает в работу только единицы со статусом failed (с учётом "resume").
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import bugsnag
+
+from config import BUGSNAG_TOKEN, JOBS_PROGRESS_INTERVAL
+from services import storage
+
+logger = logging.getLogger(__name__)
+
+_conn = None
+_wakeup: asyncio.Event | None = None
+_kinds: dict[str, dict] = {}
+_tasks: dict[str, asyncio.Task] = {}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = storage.connect("jobs.db")
+        _conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " chat_id INTEGER NOT NULL,"
+            " message_id INTEGER,"
+            " params TEXT NOT NULL,"
+            " status TEXT NOT NULL,"          # queued / running / done
+            " created_at REAL NOT NULL,"
+            " finished_at REAL);"
+            "CREATE TABLE IF NOT EXISTS job_units ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"          # pending / running / done / failed
+            " result TEXT,"
+            " PRIMARY KEY (job_id, seq));"
+        )
+        _conn.commit()
+    return _conn
+
+
+def _get_wakeup() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+def register(kind: str, *, run_unit, progress_text, finish, prepare=None, recover=None,
+             concurrency: int = 1) -> None:
+    """Регистрирует вид задачи (вызывается при импорте модуля-владельца)."""
+    _kinds[kind] = {"run_unit": run_unit, "prepare": prepare, "recover": recover,
+                    "progress_text": progress_text, "finish": finish,
+                    "concurrency": max(1, concurrency)}
+
+
+def enqueue(kind: str, user_id: int, chat_id: int, params: dict, units: list[dict],
+            message_id: int | None = None) -> str:
+    """Ставит задачу в очередь (запись на диск сразу) и возвращает её ID.
+
+    message_id — сообщение, в котором worker показывает прогресс.
+    """
+    job_id = uuid.uuid4().hex[:8]
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, user_id, chat_id, message_id, params, status, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, kind, user_id, chat_id, message_id,
+             json.dumps(params, ensure_ascii=False), time.time()),
+        )
+        conn.executemany(
+            "INSERT INTO job_units (job_id, seq, payload, status) VALUES (?, ?, ?, 'pending')",
+            [(job_id, seq, json.dumps(payload, ensure_ascii=False)) for seq, payload in enumerate(units)],
+        )
+    logger.info("[jobs] %s %s: поставлена, единиц %s", kind, job_id, len(units))
+    _get_wakeup().set()
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    """Задача по ID: поля таблицы jobs, params — распарсенный dict."""
+    row = _db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    return job
+
+
+def get_units(job_id: str) -> list[dict]:
+    """Единицы задачи по порядку: seq, payload, status, result."""
+    units = []
+    for row in _db().execute(
+        "SELECT seq, payload, status, result FROM job_units WHERE job_id = ? ORDER BY seq", (job_id,)
+    ):
+        units.append({
+            "seq": row["seq"],
+            "payload": json.loads(row["payload"]),
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+        })
+    return units
+
+
+def active_jobs(kind: str | None = None) -> list[dict]:
+    """Незавершённые задачи (для админов и проверок перед запуском новой)."""
+    query = "SELECT id FROM jobs WHERE status != 'done'"
+    args: tuple = ()
+    if kind is not None:
+        query += " AND kind = ?"
+        args = (kind,)
+    return [get_job(row["id"]) for row in _db().execute(query + " ORDER BY created_at", args)]
+
+
+def retry_failed(job_id: str, message_id: int | None = None) -> int:
+    """Возвращает в работу единицы задачи со статусом failed. Сколько единиц вернули.
+
+    message_id — новое сообщение для прогресса (None — оставить прежнее).
+    """
+    conn = _db()
+    job = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None or job["status"] != "done" or job_id in _tasks:
+        return 0  # задача ещё выполняется — повторять нечего
+    failed = conn.execute(
+        "SELECT seq, payload, result FROM job_units WHERE job_id = ? AND status = 'failed'", (job_id,)
+    ).fetchall()
+    count = len(failed)
+    with conn:
+        for row in failed:
+            payload = json.loads(row["payload"])
+            result = json.loads(row["result"]) if row["result"] else {}
+            resume = result.get("resume") if isinstance(result, dict) else None
+            if isinstance(resume, dict):
+                payload.update(resume)
+            conn.execute(
+                "UPDATE job_units SET status = 'pending', result = NULL, payload = ? WHERE job_id = ? AND seq = ?",
+                (json.dumps(payload, ensure_ascii=False), job_id, row["seq"]),
+            )
+        if count:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', finished_at = NULL,"
+                " message_id = COALESCE(?, message_id) WHERE id = ?",
+                (message_id, job_id),
+            )
+    if count:
+        logger.info("[jobs] %s: повтор %s единиц", job_id, count)
+        _get_wakeup().set()
+    return count
+
+
+def _set_unit(job_id: str, seq: int, status: str, result: dict | None = None,
+              payload: dict | None = None) -> None:
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE job_units SET status = ?, result = ? WHERE job_id = ? AND seq = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, job_id, seq),
+        )
+        if payload is not None:
+            conn.execute(
+                "UPDATE job_units SET payload = ? WHERE job_id = ? AND seq = ?",
+                (json.dumps(payload, ensure_ascii=False), job_id, seq),
+            )
+
+
+def _report(error: Exception, job: dict) -> None:
+    logger.error("[jobs] %s %s: %s", job["kind"], job["id"], error)
+    if BUGSNAG_TOKEN:
+        try:
+            bugsnag.notify(error, meta_data={"jobs": {"id": job["id"], "kind": job["kind"]}})
+        except Exception as e:
+            logger.error("[jobs] bugsnag.notify failed: %s", e)
+
+
+async def _execute(bot, kind: dict, job: dict, unit: dict) -> dict:
+    if unit["status"] == "running" and kind["recover"] is not None:
+        # Прервано перезапуском посреди запроса — сначала проверяем, не выполнено ли уже
+        result = await kind["recover"](job["params"], unit["payload"])
+        if result is not None:
+            return result
+    payload = unit["payload"]
+    if kind["prepare"] is not None:
+        payload = kind["prepare"](job["params"], payload)
+    _set_unit(job["id"], unit["seq"], "running", payload=payload)
+    return await kind["run_unit"](bot, job["params"], payload)
+
+
+class _Progress:
+    """Редактирование сообщения о прогрессе: не чаще интервала и только при изменении."""
+
+    def __init__(self, bot, job: dict):
+        self.bot = bot
+        self.job = job
+        self.text = None
+        self.edited_at = 0.0
+
+    async def update(self, render, force: bool = False) -> None:
+        """render() — текст прогресса; вызывается, только если пора редактировать."""
+        if self.job["message_id"] is None:
+            return
+        if not force and time.monotonic() - self.edited_at < JOBS_PROGRESS_INTERVAL:
+            return
+        text = render()
+        if text == self.text:
+            return
+        self.text = text
+        self.edited_at = time.monotonic()
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.job["chat_id"],
+                                             message_id=self.job["message_id"], parse_mode="HTML")
+        except Exception as e:
+            logger.warning("[jobs] %s: не удалось обновить прогресс: %s", self.job["id"], e)
+
+
+async def _run_job(bot, job_id: str) -> None:
+    job = get_job(job_id)
+    kind = _kinds.get(job["kind"])
+    if kind is None:
+        logger.error("[jobs] %s: неизвестный вид задачи %s", job_id, job["kind"])
+        return
+
+    conn = _db()
+    with conn:
+        conn.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+    progress = _Progress(bot, job)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for unit in get_units(job_id):
+        if unit["status"] in ("pending", "running"):
+            queue.put_nowait(unit)
+
+    async def _unit_worker():
+        while not queue.empty():
+            unit = queue.get_nowait()
+            try:
+                result = await _execute(bot, kind, job, unit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _report(e, job)
+                result = {"ok": False, "error": str(e)}
+            status = result.get("status") or ("done" if result.get("ok") else "failed")
+            _set_unit(job_id, unit["seq"], status, result)
+            await progress.update(lambda: kind["progress_text"](job, get_units(job_id)))
+
+    workers = [asyncio.create_task(_unit_worker()) for _ in range(min(kind["concurrency"], queue.qsize()))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    units = get_units(job_id)
+    await progress.update(lambda: kind["progress_text"](job, units), force=True)
+    with conn:
+        conn.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ?", (time.time(), job_id))
+    logger.info("[jobs] %s %s: завершена", job["kind"], job_id)
+    try:
+        await kind["finish"](bot, job, units)
+    except Exception as e:
+        _report(e, job)
+
+
+async def worker(bot):
+    """Фоновая задача: запускает поставленные и незавершённые (после перезапуска) задачи."""
+    wakeup = _get_wakeup()
+    while True:
+        wakeup.clear()
+        for row in _db().execute("SELECT id FROM jobs WHERE status != 'done' ORDER BY created_at").fetchall():
+            job_id = row["id"]
+            if job_id not in _tasks:
+                task = _tasks[job_id] = asyncio.create_task(_run_job(bot, job_id))
+                task.add_done_callback(lambda t, job_id=job_id: _tasks.pop(job_id, None))
+        try:
+            await wakeup.wait()
+        except asyncio.CancelledError:
+            for task in list(_tasks.values()):
+                task.cancel()
+            raise
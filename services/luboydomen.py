@@ -1,56 +1,67 @@
 """
 Сервис для работы с API luboydomen.info
 
-Добавлена обработка rate limit: уважение правила "1 request per second for identical requests",
-обработка 429 с чтением поля wait_time и заголовка Retry-After, а также экспоненциальные ретраи.
-Также введена сериализация запросов с помощью asyncio.Lock чтобы избежать гонок, когда
-несколько корутин одновременно начинают одинаковый запрос.
+Лимиты API: 10 запросов в минуту на IP, 20 в минуту на токен и не чаще
+1 запроса в секунду для одинаковых запросов. Все вызовы проходят через общий
+ограничитель services.rate_limit (корзины токенов + очередь с приоритетами):
+слот резервируется до запроса, блокировки не держатся во время сетевого обмена.
+Чтение (SMS, список номеров) идёт как PRIORITY_INTERACTIVE — вперёд массовых
+изменений (покупка, автопродление, PRIORITY_BULK), которым дополнительно
+разрешено не больше LUBOYDOMEN_BULK_PER_MIN запросов в минуту.
+Ответ 429 (поле wait_time или заголовок Retry-After) приостанавливает весь
+ограничитель, запрос повторяется с экспоненциальной задержкой.
 """
 import asyncio
-import time
 import json
 import aiohttp
-from config import LUBOYDOMEN_API_TOKEN
+from config import (LUBOYDOMEN_API_TOKEN, SINGLEFLIGHT_TTL,
+                    LUBOYDOMEN_RATE_PER_IP, LUBOYDOMEN_RATE_PER_TOKEN, LUBOYDOMEN_RATE_BURST,
+                    LUBOYDOMEN_BULK_PER_MIN)
+from services import http_client, singleflight
+from services.rate_limit import RateLimiter, PRIORITY_INTERACTIVE, PRIORITY_BULK
 
 LUBOYDOMEN_API_BASE = "https://luboydomen.info/api/ggl"
 
-# Простое хранилище времени последних идентичных запросов (monotonic seconds)
-_last_request_timestamps: dict = {}
-# Хранилище времени последних запросов по endpoint (без учета params/body)
-_last_endpoint_timestamps: dict = {}
-
-# Локы для сериализации: по идентичным запросам и по endpoint
-_identical_locks: dict = {}
-_endpoint_locks: dict = {}
-
 # Параметры retry/ backoff
 _MAX_RETRIES = 6
 _BASE_BACKOFF = 1.0  # seconds
 _MAX_BACKOFF = 60.0  # seconds
 
-# Rate limit derived safe intervals (в секундах)
-# Per IP: 10 req/min => 6.0s per request
-# Per token: 20 req/min => 3.0s per request
-# Чтобы быть максимально безопасными, используем max => 6.0
-_ENDPOINT_MIN_INTERVAL = 6.0
 _IDENTICAL_MIN_INTERVAL = 1.0
 
+# Per IP: 10 req/min, per token: 20 req/min (лимиты в минуту, пачка — LUBOYDOMEN_RATE_BURST)
+_limiter = RateLimiter(
+    "luboydomen",
+    [(LUBOYDOMEN_RATE_PER_IP, 60.0, LUBOYDOMEN_RATE_BURST),
+     (LUBOYDOMEN_RATE_PER_TOKEN, 60.0, LUBOYDOMEN_RATE_BURST)],
+    identical_interval=_IDENTICAL_MIN_INTERVAL,
+    bulk_limits=[(LUBOYDOMEN_BULK_PER_MIN, 60.0, 1)],
+)
 
-def _get_lock(d: dict, key: str) -> asyncio.Lock:
-    """Получить или создать asyncio.Lock для ключа"""
-    lock = d.get(key)
-    if lock is None:
-        lock = asyncio.Lock()
-        d[key] = lock
-    return lock
 
+def limiter_stats() -> dict:
+    """Очередь и ожидание ограничителя по приоритетам (для админов)."""
+    return _limiter.stats()
 
-async def _fetch_json_with_rate_handling(session: aiohttp.ClientSession, method: str, url: str, *, headers=None, params=None, json_body=None) -> dict:
-    """Выполняет HTTP-запрос и обрабатывает 429/RateLimit и правило 1 req/sec для идентичных запросов.
 
-    Возвращает распарсенный JSON (если возможен) или словарь с ошибкой в формате, совместимом с текущим кодом.
-    """
-    # Формируем ключ для идентификации «идентичных» запросов
+def _retry_delay(text: str, retry_after_header) -> float | None:
+    """Пауза из ответа 429: поле wait_time, иначе заголовок Retry-After."""
+    try:
+        wait_time = json.loads(text).get("wait_time")
+        if wait_time is not None:
+            return float(wait_time)
+    except Exception:
+        pass
+    try:
+        if retry_after_header is not None:
+            return float(retry_after_header)
+    except Exception:
+        pass
+    return None
+
+
+def _identical_key(method: str, url: str, params=None, json_body=None) -> str:
+    """Ключ для идентификации «идентичных» запросов в ограничителе."""
     try:
         params_key = json.dumps(params, sort_keys=True, ensure_ascii=False) if params else ""
     except Exception:
@@ -61,149 +72,141 @@ async def _fetch_json_with_rate_handling(session: aiohttp.ClientSession, method:
     except Exception:
         body_key = str(json_body)
 
-    identical_key = f"{method.upper()}:{url}:{params_key}:{body_key}"
-    # endpoint_key не учитывает params/body — нужен для подсчёта общего лимита по endpoint
-    endpoint_key = f"{method.upper()}:{url}"
+    return f"{method.upper()}:{url}:{params_key}:{body_key}"
+
+
+async def _fetch_json_with_rate_handling(method: str, url: str, *, headers=None, params=None, json_body=None,
+                                         priority: int = PRIORITY_INTERACTIVE) -> dict:
+    """Выполняет HTTP-запрос с учётом лимитов API и ретраями на 429/сетевых ошибках.
 
-    # Получаем/создаём локи (endpoint lock всегда берём первым чтобы избежать дедлока)
-    endpoint_lock = _get_lock(_endpoint_locks, endpoint_key)
-    identical_lock = _get_lock(_identical_locks, identical_key)
+    Возвращает распарсенный JSON (если возможен) или словарь с ошибкой в формате, совместимом с текущим кодом.
+    """
+    identical_key = _identical_key(method, url, params, json_body)
 
     retries = 0
     backoff = _BASE_BACKOFF
 
     while True:
-        # Сериализуем обращения к endpoint и к идентичному запросу
-        async with endpoint_lock:
-            async with identical_lock:
-                # Enforce minimal interval between any requests to this endpoint
-                now = time.monotonic()
-                last_ep = _last_endpoint_timestamps.get(endpoint_key)
-                if last_ep is not None:
-                    elapsed_ep = now - last_ep
-                    if elapsed_ep < _ENDPOINT_MIN_INTERVAL:
-                        wait_for = _ENDPOINT_MIN_INTERVAL - elapsed_ep
-                        await asyncio.sleep(wait_for)
-
-                # Enforce minimal interval for identical requests
-                last_id = _last_request_timestamps.get(identical_key)
-                now = time.monotonic()
-                if last_id is not None:
-                    elapsed_id = now - last_id
-                    if elapsed_id < _IDENTICAL_MIN_INTERVAL:
-                        wait_for = _IDENTICAL_MIN_INTERVAL - elapsed_id
-                        await asyncio.sleep(wait_for)
-
-                try:
-                    async with session.request(method, url, headers=headers, params=params, json=json_body) as resp:
-                        status = resp.status
-                        text = await resp.text()
-
-                        # Update timestamps after getting response
-                        ts = time.monotonic()
-                        _last_request_timestamps[identical_key] = ts
-                        _last_endpoint_timestamps[endpoint_key] = ts
-
-                        # Handle rate limit 429
-                        if status == 429:
-                            # Try to parse JSON body to get wait_time
-                            wait_time = None
-                            try:
-                                body_json = json.loads(text)
-                                wait_time = body_json.get("wait_time")
-                            except Exception:
-                                body_json = None
-
-                            # Check Retry-After header
-                            retry_after = None
-                            try:
-                                header_val = resp.headers.get("Retry-After")
-                                if header_val is not None:
-                                    retry_after = int(float(header_val))
-                            except Exception:
-                                retry_after = None
-
-                            # Determine sleep time (prefer server-provided wait_time / retry_after)
-                            sleep_time = None
-                            if wait_time is not None:
-                                try:
-                                    sleep_time = float(wait_time)
-                                except Exception:
-                                    sleep_time = None
-                            if sleep_time is None and retry_after is not None:
-                                sleep_time = float(retry_after)
-
-                            # Fallback to exponential backoff
-                            if sleep_time is None:
-                                sleep_time = backoff
-
-                            # Cap
-                            if sleep_time > _MAX_BACKOFF:
-                                sleep_time = _MAX_BACKOFF
-
-                            retries += 1
-                            if retries > _MAX_RETRIES:
-                                return {"success": False, "error": "rate_limited", "detail": "Exceeded retry attempts due to 429 responses"}
-
-                            # Sleep outside of locks to avoid long blocking others: release locks, sleep, then retry loop
-                            pass_sleep = sleep_time
-                        else:
-                            # For other statuses, try to return JSON if possible
-                            try:
-                                return json.loads(text)
-                            except Exception:
-                                return {"success": False, "error": f"http_{status}", "details": text}
-
-                except aiohttp.ClientError as e:
-                    retries += 1
-                    if retries > _MAX_RETRIES:
-                        return {"success": False, "error": "network_error", "details": str(e)}
-                    # Sleep outside locks
-                    pass_sleep = backoff
-
-        # Если мы сюда попали, значит нужно подождать и повторить (rate limited or transient network)
-        # Увеличиваем backoff только для сетевых/429 последовательных
-        await asyncio.sleep(pass_sleep)
+        await _limiter.acquire(identical_key, priority)
+        try:
+            session = http_client.get_session()
+            async with session.request(method, url, headers=headers, params=params, json=json_body) as resp:
+                status = resp.status
+                text = await resp.text()
+                retry_after_header = resp.headers.get("Retry-After")
+        except aiohttp.ClientError as e:
+            retries += 1
+            if retries > _MAX_RETRIES:
+                return {"success": False, "error": "network_error", "details": str(e)}
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF)
+            continue
+
+        if status != 429:
+            # For other statuses, try to return JSON if possible
+            try:
+                return json.loads(text)
+            except Exception:
+                return {"success": False, "error": f"http_{status}", "details": text}
+
+        retries += 1
+        if retries > _MAX_RETRIES:
+            return {"success": False, "error": "rate_limited", "detail": "Exceeded retry attempts due to 429 responses"}
+
+        # Сервер сообщил паузу — её соблюдают все ожидающие, а не только этот запрос
+        sleep_time = _retry_delay(text, retry_after_header)
+        if sleep_time is None:
+            sleep_time = backoff
+        _limiter.penalize(min(sleep_time, _MAX_BACKOFF))
         backoff = min(backoff * 2, _MAX_BACKOFF)
-        continue
 
 
-async def get_all_phone_numbers() -> dict:
-    """Получает список всех номеров телефонов из API с учетом пагинации"""
+# Ключ single-flight для полного списка номеров (сбрасывается после покупки/автопродления)
+_NUMBERS_KEY = singleflight.make_key("GET", "numbers")
+
+
+class _NumbersPass:
+    """Идущий проход по страницам списка номеров: приоритет можно поднять на ходу."""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.page_key: str | None = None   # ключ страницы, ожидающей слота в ограничителе
+
+
+_numbers_pass: _NumbersPass | None = None
+
+
+def raise_numbers_priority(priority: int) -> None:
+    """К идущему проходу по номерам присоединился вызов с более высоким приоритетом.
+
+    Оставшиеся страницы (и та, что уже ждёт слота) идут с этим приоритетом —
+    пользователь не ждёт в темпе фонового обновления.
+    """
+    current = _numbers_pass
+    if current is None or priority >= current.priority:
+        return
+    current.priority = priority
+    if current.page_key is not None:
+        _limiter.promote(current.page_key, priority)
+
+
+async def get_all_phone_numbers(priority: int = PRIORITY_INTERACTIVE) -> dict:
+    """Получает список всех номеров телефонов из API с учетом пагинации.
+
+    Одновременные вызовы разделяют один проход по страницам (single-flight);
+    приоритет прохода — самый высокий из приоритетов ожидающих его вызовов.
+    """
+    raise_numbers_priority(priority)
+    return await singleflight.do(_NUMBERS_KEY, lambda: _fetch_all_phone_numbers(priority),
+                                 ttl=SINGLEFLIGHT_TTL)
+
+
+async def _fetch_all_phone_numbers(priority: int) -> dict:
+    global _numbers_pass
+    state = _numbers_pass = _NumbersPass(priority)
+    try:
+        return await _fetch_numbers_pages(state)
+    finally:
+        if _numbers_pass is state:
+            _numbers_pass = None
+
+
+async def _fetch_numbers_pages(state: _NumbersPass) -> dict:
     headers = {"Authorization": f"Token {LUBOYDOMEN_API_TOKEN}"}
+    url = f"{LUBOYDOMEN_API_BASE}/numbers"
     all_numbers = []
     offset = 0
     limit = 100
     total = None
 
-    async with aiohttp.ClientSession() as session:
-        while True:
-            params = {"limit": limit, "offset": offset}
-            result = await _fetch_json_with_rate_handling(
-                session,
-                "GET",
-                f"{LUBOYDOMEN_API_BASE}/numbers",
-                headers=headers,
-                params=params
-            )
+    while True:
+        params = {"limit": limit, "offset": offset}
+        state.page_key = _identical_key("GET", url, params)
+        result = await _fetch_json_with_rate_handling(
+            "GET",
+            url,
+            headers=headers,
+            params=params,
+            priority=state.priority
+        )
 
-            # Если вернулась ошибка (формат не success True)
-            if not result.get("success"):
-                return result
+        # Если вернулась ошибка (формат не success True)
+        if not result.get("success"):
+            return result
 
-            data = result.get("data", {})
-            numbers = data.get("numbers", [])
-            pagination = data.get("pagination", {})
+        data = result.get("data", {})
+        numbers = data.get("numbers", [])
+        pagination = data.get("pagination", {})
 
-            all_numbers.extend(numbers)
+        all_numbers.extend(numbers)
 
-            if total is None:
-                total = pagination.get("total", len(numbers))
+        if total is None:
+            total = pagination.get("total", len(numbers))
 
-            # Проверяем, есть ли ещё номера
-            offset += limit
-            if offset >= total or not numbers:
-                break
+        # Проверяем, есть ли ещё номера
+        offset += limit
+        if offset >= total or not numbers:
+            break
 
     return {
         "success": True,
@@ -218,8 +221,9 @@ async def get_all_phone_numbers() -> dict:
     }
 
 
-async def purchase_number(custom_name: str, country_code: str = "GB", duration_months: int = 1, auto_renew: bool = False) -> dict:
-    """Покупает один номер телефона через API"""
+async def purchase_number(custom_name: str, country_code: str = "GB", duration_months: int = 1, auto_renew: bool = False,
+                          quantity: int = 1) -> dict:
+    """Покупает номер телефона через API (quantity > 1 — несколько номеров одним запросом)"""
     headers = {
         "Authorization": f"Token {LUBOYDOMEN_API_TOKEN}",
         "Content-Type": "application/json"
@@ -231,16 +235,18 @@ async def purchase_number(custom_name: str, country_code: str = "GB", duration_m
         "auto_renew": auto_renew,
         "custom_name": custom_name
     }
+    if quantity > 1:
+        payload["quantity"] = quantity
 
-    async with aiohttp.ClientSession() as session:
-        result = await _fetch_json_with_rate_handling(
-            session,
-            "POST",
-            f"{LUBOYDOMEN_API_BASE}/numbers/purchase/",
-            headers=headers,
-            json_body=payload
-        )
-        return result
+    result = await _fetch_json_with_rate_handling(
+        "POST",
+        f"{LUBOYDOMEN_API_BASE}/numbers/purchase/",
+        headers=headers,
+        json_body=payload,
+        priority=PRIORITY_BULK
+    )
+    singleflight.forget(_NUMBERS_KEY)
+    return result
 
 
 async def toggle_auto_renewal(number_id: str, auto_renew: bool) -> dict:
@@ -258,31 +264,30 @@ async def toggle_auto_renewal(number_id: str, auto_renew: bool) -> dict:
     logger.info(f"[toggle_auto_renewal] number_id={number_id}, auto_renew={auto_renew}, "
                 f"url={LUBOYDOMEN_API_BASE}/numbers/{number_id}/auto-renewal/, method=PATCH")
 
-    async with aiohttp.ClientSession() as session:
-        result = await _fetch_json_with_rate_handling(
-            session,
-            "PATCH",
-            f"{LUBOYDOMEN_API_BASE}/numbers/{number_id}/auto-renewal/",
-            headers=headers,
-            json_body=payload
-        )
+    result = await _fetch_json_with_rate_handling(
+        "PATCH",
+        f"{LUBOYDOMEN_API_BASE}/numbers/{number_id}/auto-renewal/",
+        headers=headers,
+        json_body=payload,
+        priority=PRIORITY_BULK
+    )
 
-        logger.info(f"[toggle_auto_renewal] number_id={number_id}, response={result}")
-        return result
+    logger.info(f"[toggle_auto_renewal] number_id={number_id}, response={result}")
+    singleflight.forget(_NUMBERS_KEY)
+    return result
 
 
-async def get_sms_messages(number_id: str, limit: int = 100, offset: int = 0) -> dict:
-    """Получает список SMS для номера по его ID"""
+async def get_sms_messages(number_id: str, limit: int = 100, offset: int = 0,
+                           priority: int = PRIORITY_INTERACTIVE) -> dict:
+    """Получает список SMS для номера по его ID (priority — очередь ограничителя)"""
     headers = {"Authorization": f"Token {LUBOYDOMEN_API_TOKEN}"}
 
     params = {"limit": limit, "offset": offset}
 
-    async with aiohttp.ClientSession() as session:
-        result = await _fetch_json_with_rate_handling(
-            session,
-            "GET",
-            f"{LUBOYDOMEN_API_BASE}/numbers/{number_id}/sms",
-            headers=headers,
-            params=params
-        )
-        return result
+    return await _fetch_json_with_rate_handling(
+        "GET",
+        f"{LUBOYDOMEN_API_BASE}/numbers/{number_id}/sms",
+        headers=headers,
+        params=params,
+        priority=priority
+    )
@@ -21,6 +21,7 @@ import aiohttp
 import bugsnag
 
 from config import MULTICARDS_EMAIL, MULTICARDS_PASSWORD, BUGSNAG_TOKEN
+from services import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -69,21 +70,21 @@ async def _login() -> dict | str:
     body = {"email": MULTICARDS_EMAIL, "password": MULTICARDS_PASSWORD}
     timeout = aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT)
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, json=body) as resp:
-                status = resp.status
-                text = await resp.text()
-                if status != 200:
-                    snippet = text[:300]
-                    _report(f"HTTP {status}: {snippet}", "auth/login", status=status)
-                    return {"success": False, "error": f"http_{status}",
-                            "details": f"Логин MultiCards не удался (HTTP {status})"}
-                try:
-                    token = json.loads(text).get("token")
-                except ValueError:
-                    _report(f"невалидный JSON: {text[:300]}", "auth/login")
-                    return {"success": False, "error": "bad_json",
-                            "details": "Некорректный ответ логина MultiCards"}
+        session = http_client.get_session()
+        async with session.post(url, json=body, timeout=timeout) as resp:
+            status = resp.status
+            text = await resp.text()
+            if status != 200:
+                snippet = text[:300]
+                _report(f"HTTP {status}: {snippet}", "auth/login", status=status)
+                return {"success": False, "error": f"http_{status}",
+                        "details": f"Логин MultiCards не удался (HTTP {status})"}
+            try:
+                token = json.loads(text).get("token")
+            except ValueError:
+                _report(f"невалидный JSON: {text[:300]}", "auth/login")
+                return {"success": False, "error": "bad_json",
+                        "details": "Некорректный ответ логина MultiCards"}
     except aiohttp.ClientError as e:
         _report(e, "auth/login", kind="network_error")
         return {"success": False, "error": "network_error", "details": str(e)}
@@ -131,30 +132,11 @@ async def _request(method: str, endpoint: str, json_body: dict | None = None, _r
     }
     timeout = aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT)
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.request(method, url, headers=headers, json=json_body) as resp:
-                status = resp.status
-                text = await resp.text()
-
-                if status == 401 and _retry:
-                    _invalidate_token()
-                    return await _request(method, endpoint, json_body, _retry=False)
-
-                if status != 200:
-                    snippet = text[:300]
-                    _report(f"HTTP {status}: {snippet}", endpoint, status=status)
-                    return {"success": False, "error": f"http_{status}",
-                            "details": f"HTTP {status}: {snippet}"}
-
-                if not text:
-                    return {}
-                try:
-                    return json.loads(text)
-                except ValueError:
-                    snippet = text[:300]
-                    _report(f"невалидный JSON: {snippet}", endpoint)
-                    return {"success": False, "error": "bad_json",
-                            "details": f"Некорректный ответ MultiCards: {snippet}"}
+        session = http_client.get_session()
+        async with session.request(method, url, headers=headers, json=json_body,
+                                   timeout=timeout) as resp:
+            status = resp.status
+            text = await resp.text()
     except aiohttp.ClientError as e:
         _report(e, endpoint, kind="network_error")
         return {"success": False, "error": "network_error", "details": str(e)}
@@ -162,6 +144,27 @@ async def _request(method: str, endpoint: str, json_body: dict | None = None, _r
         _report(e, endpoint, kind="unexpected")
         return {"success": False, "error": "unexpected", "details": str(e)}
 
+    # Повтор после 401 делаем уже после возврата соединения в пул.
+    if status == 401 and _retry:
+        _invalidate_token()
+        return await _request(method, endpoint, json_body, _retry=False)
+
+    if status != 200:
+        snippet = text[:300]
+        _report(f"HTTP {status}: {snippet}", endpoint, status=status)
+        return {"success": False, "error": f"http_{status}",
+                "details": f"HTTP {status}: {snippet}"}
+
+    if not text:
+        return {}
+    try:
+        return json.loads(text)
+    except ValueError:
+        snippet = text[:300]
+        _report(f"невалидный JSON: {snippet}", endpoint)
+        return {"success": False, "error": "bad_json",
+                "details": f"Некорректный ответ MultiCards: {snippet}"}
+
 
 def _is_error(result) -> bool:
     """Признак ошибочного ответа нашего формата (успех card/list — это список)."""
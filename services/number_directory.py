@@ -0,0 +1,243 @@
+"""
+Справочник номеров luboydomen в памяти.
+
+Раньше каждый поиск номера (получение SMS, автопродление) выкачивал весь
+список постранично — при лимитах API это десятки секунд — и перебирал его.
+Теперь список загружается в фоне и раскладывается в индексы: цифры номера,
+хвосты номера (от 3 цифр), custom_name в нижнем регистре, piv_num_id.
+Поиск идёт по индексам без запросов к API; подстрочный перебор в памяти
+остаётся только запасным вариантом, чтобы сохранить прежнюю семантику поиска.
+
+- Фоновая задача number_directory_refresher загружает справочник при старте и
+  обновляет его раз в NUMBER_DIRECTORY_REFRESH_INTERVAL (приоритет PRIORITY_BULK —
+  не мешает запросам пользователей).
+- После покупки и смены автопродления обработчики вносят изменения точечно:
+  add_numbers / set_auto_renew — без перечитывания всего списка.
+- Промах (номер купили не через бота) — внеочередное обновление, не чаще
+  NUMBER_DIRECTORY_MISS_COOLDOWN.
+"""
+import asyncio
+import logging
+import time
+
+from config import NUMBER_DIRECTORY_REFRESH_INTERVAL, NUMBER_DIRECTORY_MISS_COOLDOWN
+from services import luboydomen, singleflight
+from services.rate_limit import PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Хвосты номера короче этого не индексируются (их ищет запасной перебор)
+_MIN_SUFFIX = 3
+
+_PHONE_CHARS = set("0123456789+-() ")
+
+
+class _Directory:
+    """Снимок списка номеров с индексами."""
+
+    def __init__(self, numbers: list, started_at: float):
+        # Момент начала загрузки: снимок, запрошенный раньше, не заменяет более свежий
+        self.started_at = started_at
+        self.loaded_at = time.monotonic()
+        self.numbers: list[dict] = []
+        self.by_id: dict[str, dict] = {}
+        self.by_phone: dict[str, list] = {}
+        self.by_suffix: dict[str, list] = {}
+        self.by_name: dict[str, list] = {}
+        for number in numbers:
+            self.add(number)
+
+    def add(self, number: dict) -> None:
+        if not isinstance(number, dict):
+            return
+        # Копия: список из API общий для ожидающих single-flight
+        number = dict(number)
+        nid = number.get("piv_num_id")
+        if nid is not None:
+            old = self.by_id.get(str(nid))
+            if old is not None:
+                self._remove(old)
+            self.by_id[str(nid)] = number
+        self.numbers.append(number)
+        digits = _digits(number.get("phone_number"))
+        if digits:
+            self.by_phone.setdefault(digits, []).append(number)
+            for size in range(_MIN_SUFFIX, len(digits)):
+                self.by_suffix.setdefault(digits[-size:], []).append(number)
+        name = _name(number)
+        if name:
+            self.by_name.setdefault(name, []).append(number)
+
+    def _remove(self, number: dict) -> None:
+        self.numbers.remove(number)
+        digits = _digits(number.get("phone_number"))
+        keys = [(self.by_phone, digits), (self.by_name, _name(number))]
+        keys += [(self.by_suffix, digits[-size:]) for size in range(_MIN_SUFFIX, len(digits))]
+        for index, key in keys:
+            bucket = index.get(key)
+            if bucket and number in bucket:
+                bucket.remove(number)
+                if not bucket:
+                    del index[key]
+
+    def candidates(self, query: str):
+        """Номера, подходящие под запрос, от точных совпадений к подстрочным."""
+        query_lower = query.lower().strip()
+        if not query_lower:
+            return
+        if set(query_lower) <= _PHONE_CHARS:
+            digits = _digits(query_lower)
+            if digits:
+                yield from self.by_phone.get(digits, ())
+                yield from self.by_suffix.get(digits, ())
+                yield from (n for n in self.numbers if digits in _digits(n.get("phone_number")))
+        yield from self.by_name.get(query_lower, ())
+        yield from (n for n in self.numbers if query_lower in _name(n))
+
+
+_directory: _Directory | None = None
+_last_miss_refresh = 0.0
+
+
+def _digits(value) -> str:
+    return "".join(ch for ch in str(value or "") if ch.isdigit())
+
+
+def _name(number: dict) -> str:
+    return str(number.get("custom_name") or "").lower().strip()
+
+
+async def _do_refresh(priority: int) -> dict | None:
+    global _directory
+    started_at = time.monotonic()
+    result = await luboydomen.get_all_phone_numbers(priority)
+    if not result.get("success"):
+        logger.warning("[number_directory] не удалось загрузить список: %s", result)
+        return result
+    if _directory is not None and _directory.started_at > started_at:
+        return None  # пока шла загрузка, установлен снимок, запрошенный позже
+    numbers = result.get("data", {}).get("numbers", [])
+    _directory = _Directory(numbers, started_at)
+    logger.info("[number_directory] загружено номеров %s", len(numbers))
+    return None
+
+
+async def refresh(priority: int = PRIORITY_INTERACTIVE, fresh: bool = False) -> dict | None:
+    """Перечитывает справочник. None при успехе, иначе dict с ошибкой API.
+
+    Если обновление уже идёт — ждёт его, а не запускает второе. fresh=True —
+    нужно состояние не старше момента вызова (проверка после изменений):
+    начатое раньше обновление не ждём, а запускаем своё.
+    """
+    if fresh:
+        singleflight.forget(("number_directory",))
+    # Присоединяясь к фоновому обновлению, не ждём в его темпе
+    luboydomen.raise_numbers_priority(priority)
+    return await singleflight.do(("number_directory",), lambda: _do_refresh(priority))
+
+
+async def ensure() -> dict | None:
+    """Загружает справочник, если его ещё нет. None — справочник готов."""
+    if _directory is not None:
+        return None
+    return await refresh()
+
+
+def count() -> int:
+    """Сколько номеров в справочнике."""
+    return len(_directory.numbers) if _directory is not None else 0
+
+
+async def _refresh_after_miss() -> bool:
+    """Внеочередное обновление после промаха (с ограничением частоты)."""
+    global _last_miss_refresh
+    now = time.monotonic()
+    if now - _last_miss_refresh < NUMBER_DIRECTORY_MISS_COOLDOWN:
+        return False
+    _last_miss_refresh = now
+    return await refresh() is None
+
+
+def _match(query: str, exclude: set) -> dict | None:
+    for number in _directory.candidates(query):
+        if str(number.get("piv_num_id")) not in exclude:
+            return number
+    return None
+
+
+async def find(query: str) -> dict | None:
+    """Ищет номер по номеру телефона (полностью, хвост, подстрока) или custom_name."""
+    if await ensure() is not None:
+        return None
+    found = _match(query, set())
+    if found is None and await _refresh_after_miss():
+        found = _match(query, set())
+    return found
+
+
+async def find_many(queries: list[str]) -> tuple[list[dict], list[str]]:
+    """Ищет номера по списку запросов; один номер не попадает в результат дважды.
+
+    Возвращает (найденные_номера, ненайденные_запросы). Справочник должен быть
+    загружен (ensure), иначе все запросы считаются ненайденными.
+    """
+    if _directory is None:
+        return [], list(queries)
+
+    def _run(items: list[str], found: list, found_ids: set) -> list[str]:
+        missed = []
+        for query in items:
+            number = _match(query, found_ids)
+            if number is None:
+                missed.append(query)
+                continue
+            found.append(number)
+            found_ids.add(str(number.get("piv_num_id")))
+        return missed
+
+    found: list[dict] = []
+    found_ids: set[str] = set()
+    not_found = _run(queries, found, found_ids)
+    if not_found and await _refresh_after_miss():
+        # После обновления ссылки на старые записи неактуальны — ищем заново
+        found, found_ids = [], set()
+        not_found = _run(queries, found, found_ids)
+    return found, not_found
+
+
+def get(number_id) -> dict | None:
+    """Номер по piv_num_id (None — нет в справочнике или справочник не загружен)."""
+    if _directory is None:
+        return None
+    return _directory.by_id.get(str(number_id))
+
+
+def numbers_named(custom_name: str) -> list[dict]:
+    """Номера с точно таким custom_name (без учёта регистра)."""
+    if _directory is None:
+        return []
+    return list(_directory.by_name.get(custom_name.lower().strip(), ()))
+
+
+def add_numbers(numbers: list[dict]) -> None:
+    """Добавляет купленные номера (ответ purchase_number) в справочник."""
+    if _directory is None:
+        return
+    for number in numbers or []:
+        _directory.add(number)
+
+
+def set_auto_renew(number_id, auto_renew: bool) -> None:
+    """Отмечает новое состояние автопродления номера после успешного переключения."""
+    if _directory is None:
+        return
+    number = _directory.by_id.get(str(number_id))
+    if number is not None:
+        number["auto_renew"] = auto_renew
+
+
+async def number_directory_refresher():
+    """Фоновая задача: загружает справочник при старте и периодически обновляет."""
+    while True:
+        await refresh(PRIORITY_BULK)
+        await asyncio.sleep(NUMBER_DIRECTORY_REFRESH_INTERVAL)
@@ -0,0 +1,171 @@
+"""
+Ограничитель частоты запросов к внешним API (token bucket + очередь с приоритетами).
+
+Лимит «N запросов за period секунд» моделируется корзиной токенов в форме
+GCRA (хранится одно число — теоретическое время следующего запроса). Корзина
+с burst > 1 разрешает короткую пачку запросов подряд, а интервал между
+токенами выбирается так, чтобы в любом окне длиной period было не больше N
+запросов.
+
+RateLimiter объединяет несколько корзин (например, «на IP» и «на токен»),
+правило минимального интервала для одинаковых запросов (ключ — строка
+вызывающего; состояние — ограниченный LRU) и очередь с приоритетами: сначала
+обслуживаются запросы с меньшим priority (PRIORITY_INTERACTIVE — человек ждёт
+ответа), внутри одного приоритета — строго в порядке обращения. Для фоновых
+запросов (priority > 0) действуют дополнительные корзины bulk_limits — так
+массовые операции не выбирают весь лимит и интерактивным остаётся запас.
+Слот резервируется до запроса и никакая блокировка не удерживается во время
+сетевого обмена. stats() — глубина очереди и время ожидания по приоритетам.
+
+Ответ 429 (wait_time / Retry-After) передаётся в penalize(): все ожидающие
+ждут указанное время, а не только получивший 429. promote() поднимает приоритет
+уже ожидающего запроса — когда результата фонового запроса ждёт пользователь.
+
+    limiter = RateLimiter("api", [(10, 60, 2)], identical_interval=1.0)
+    await limiter.acquire(key, priority=PRIORITY_BULK)
+    ... запрос ...
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0   # пользователь ждёт ответа на экране
+PRIORITY_BULK = 1          # массовые операции (покупка, автопродление)
+
+_PRIORITY_LABELS = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+
+class _Bucket:
+    """Лимит limit запросов за period секунд с пачкой до burst подряд (GCRA)."""
+
+    def __init__(self, limit: int, period: float, burst: int = 1):
+        burst = max(1, min(burst, limit))
+        # Интервал между токенами: burst + (period / interval - 1) <= limit
+        self.interval = period / (limit - burst + 1)
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0   # теоретическое время прибытия следующего запроса (monotonic)
+
+    def earliest(self, now: float) -> float:
+        return max(now, self.tat - self.tolerance)
+
+    def commit(self, at: float) -> None:
+        self.tat = max(self.tat, at) + self.interval
+
+    def hold_until(self, at: float) -> None:
+        self.tat = max(self.tat, at + self.tolerance)
+
+
+class RateLimiter:
+    """Набор корзин + интервал для одинаковых запросов + очередь с приоритетами."""
+
+    def __init__(self, name: str, limits: list[tuple[int, float, int]],
+                 identical_interval: float = 0.0, identical_cache: int = 1024,
+                 bulk_limits: list[tuple[int, float, int]] | None = None):
+        self.name = name
+        self._buckets = [_Bucket(limit, period, burst) for limit, period, burst in limits]
+        self._bulk_buckets = [_Bucket(limit, period, burst) for limit, period, burst in bulk_limits or []]
+        self._identical_interval = identical_interval
+        self._identical_cache = identical_cache
+        self._recent: OrderedDict[str, float] = OrderedDict()  # ключ -> время последнего слота
+        self._queue: list = []                                  # куча (priority, seq, enqueued_at, future, key)
+        self._seq = itertools.count()
+        self._dispatcher: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._waits: dict[int, deque] = {}                      # priority -> последние ожидания, сек
+        self._served: dict[int, int] = {}
+
+    def _buckets_for(self, priority: int) -> list[_Bucket]:
+        return self._buckets + self._bulk_buckets if priority > PRIORITY_INTERACTIVE else self._buckets
+
+    def _earliest(self, now: float, key: str | None, priority: int) -> float:
+        at = max((b.earliest(now) for b in self._buckets_for(priority)), default=now)
+        if key is not None and self._identical_interval:
+            last = self._recent.get(key)
+            if last is not None:
+                at = max(at, last + self._identical_interval)
+        return at
+
+    def _commit(self, at: float, key: str | None, priority: int) -> None:
+        for bucket in self._buckets_for(priority):
+            bucket.commit(at)
+        if key is not None and self._identical_interval:
+            self._recent[key] = at
+            self._recent.move_to_end(key)
+            while len(self._recent) > self._identical_cache:
+                self._recent.popitem(last=False)
+
+    async def acquire(self, key: str | None = None, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Ждёт своей очереди (с учётом приоритета) и слота во всех корзинах."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), time.monotonic(), future, key))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            # Новый запрос может оказаться важнее того, чей слот сейчас ожидается.
+            self._wakeup.set()
+        await future
+
+    def penalize(self, seconds: float) -> None:
+        """Сервер попросил подождать (429): ни одного запроса раньше, чем через seconds."""
+        at = time.monotonic() + max(0.0, seconds)
+        for bucket in self._buckets + self._bulk_buckets:
+            bucket.hold_until(at)
+        logger.warning("[rate_limit] %s: пауза %.1f с по ответу сервера", self.name, seconds)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def promote(self, key: str, priority: int) -> None:
+        """Поднимает до priority ожидающие запросы с ключом key.
+
+        Запрос ставится в очередь повторно с новым приоритетом (и прежним
+        временем постановки); старая запись пропускается, когда будущее уже выполнено.
+        """
+        promoted = False
+        for item_priority, _, enqueued_at, future, item_key in list(self._queue):
+            if item_key == key and item_priority > priority and not future.done():
+                heapq.heappush(self._queue, (priority, next(self._seq), enqueued_at, future, key))
+                promoted = True
+        if promoted and self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Очередь и ожидание по приоритетам: {метка: {queued, served, avg_wait, max_wait}}."""
+        result = {}
+        for priority in sorted(set(self._waits) | {item[0] for item in self._queue}):
+            waits = self._waits.get(priority, ())
+            result[_PRIORITY_LABELS.get(priority, str(priority))] = {
+                "queued": sum(1 for item in self._queue if item[0] == priority and not item[3].done()),
+                "served": self._served.get(priority, 0),
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "max_wait": max(waits, default=0.0),
+            }
+        return result
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            priority, _, enqueued_at, future, key = self._queue[0]
+            if future.done():  # ожидающий отменён
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            at = self._earliest(now, key, priority)
+            if at > now:
+                # Спим до слота; penalize() и новый запрос будят, чтобы пересчитать.
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._queue)
+            self._commit(now, key, priority)
+            self._waits.setdefault(priority, deque(maxlen=100)).append(now - enqueued_at)
+            self._served[priority] = self._served.get(priority, 0) + 1
+            future.set_result(None)
@@ -0,0 +1,109 @@
+"""
+Шлюз к Google Sheets (таблица GOOGLE_SHEET_ID).
+
+Авторизация сервисным аккаунтом выполняется один раз на процесс, объект
+Spreadsheet и листы кэшируются. gspread синхронный, поэтому каждый вызов
+выполняется в ограниченном пуле потоков (SHEETS_MAX_WORKERS) и наружу отдаётся
+async API — обработчики не блокируют event loop.
+
+Листы адресуются по индексу, как раньше через get_worksheet(N):
+WS_LANDINGS (0) — заявки на лендинги, WS_USERS (1) — разрешённые пользователи,
+WS_PIXELS (2) — пиксели, WS_EXPENSES (3) — расходы байеров.
+
+Ошибки не маскируются: исключения gspread пробрасываются вызывающему коду,
+который сам решает, как сообщить о них пользователю.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+
+from config import GOOGLE_SHEET_ID, SHEETS_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+CREDENTIALS_FILE = "credentials.json"
+
+# Индексы листов таблицы
+WS_LANDINGS = 0
+WS_USERS = 1
+WS_PIXELS = 2
+WS_EXPENSES = 3
+
+_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+# Кэш клиента/таблицы/листов. Доступ из потоков пула — под блокировкой.
+_handles_lock = threading.Lock()
+_spreadsheet: gspread.Spreadsheet | None = None
+_worksheets: dict[int, gspread.Worksheet] = {}
+
+
+def _get_worksheet(index: int) -> gspread.Worksheet:
+    """Лист по индексу из кэша; при первом обращении авторизуется и открывает таблицу."""
+    global _spreadsheet
+    with _handles_lock:
+        worksheet = _worksheets.get(index)
+        if worksheet is not None:
+            return worksheet
+        if _spreadsheet is None:
+            gc = gspread.service_account(filename=CREDENTIALS_FILE)
+            _spreadsheet = gc.open_by_key(GOOGLE_SHEET_ID)
+            logger.info("[sheets] таблица открыта")
+        worksheet = _spreadsheet.get_worksheet(index)
+        if worksheet is None:
+            raise gspread.WorksheetNotFound(f"лист с индексом {index} не найден")
+        _worksheets[index] = worksheet
+        return worksheet
+
+
+def reset() -> None:
+    """Сбрасывает кэш таблицы и листов (следующий вызов переоткроет их)."""
+    global _spreadsheet
+    with _handles_lock:
+        _spreadsheet = None
+        _worksheets.clear()
+
+
+async def _run(fn, *args, **kwargs):
+    """Выполняет блокирующий вызов gspread в пуле потоков шлюза."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def col_values(ws_index: int, col: int) -> list[str]:
+    """Значения столбца col (нумерация с 1) листа ws_index."""
+    return await _run(lambda: _get_worksheet(ws_index).col_values(col))
+
+
+async def get_all_values(ws_index: int) -> list[list[str]]:
+    """Все значения листа ws_index (включая строку заголовка)."""
+    return await _run(lambda: _get_worksheet(ws_index).get_all_values())
+
+
+async def batch_get(ws_index: int, ranges: list[str]) -> list[list[list[str]]]:
+    """Несколько диапазонов (A1-нотация) листа одним запросом.
+
+    Возвращает список матриц значений в порядке ranges.
+    """
+    result = await _run(lambda: _get_worksheet(ws_index).batch_get(ranges))
+    return [list(value_range) for value_range in result]
+
+
+async def append_row(ws_index: int, row: list) -> None:
+    """Добавляет одну строку в конец листа ws_index."""
+    await _run(lambda: _get_worksheet(ws_index).append_row(row))
+
+
+async def append_rows(ws_index: int, rows: list[list]) -> None:
+    """Добавляет несколько строк в конец листа ws_index одним запросом."""
+    if not rows:
+        return
+    await _run(lambda: _get_worksheet(ws_index).append_rows(rows))
+
+
+def shutdown() -> None:
+    """Останавливает пул потоков шлюза (при остановке бота)."""
+    _executor.shutdown(wait=False, cancel_futures=True)
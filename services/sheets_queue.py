@@ -0,0 +1,196 @@
+"""
+Очередь отложенной записи строк в Google Sheets (write-behind).
+
+Обработчик кладёт строку в локальную SQLite-очередь (DATA_DIR/sheets_queue.db)
+и сразу отвечает пользователю. Фоновая задача flusher собирает накопившиеся
+строки по листам и отправляет каждую пачку одним append_rows. При временной
+ошибке (квота 429, 5xx, сеть) строки остаются в очереди и отправка повторяется
+с экспоненциальной задержкой. Постоянная ошибка (400/403, неверный лист или
+значение) не повторяется: пачка отправляется по строке, записываемые строки
+уходят в таблицу, а отвергнутые переносятся в таблицу failed_rows (dead-letter)
+с текстом ошибки и не блокируют очередь листа. Очередь переживает перезапуск:
+всё, что не успели записать, уйдёт при следующем старте.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import bugsnag
+import google.auth.exceptions
+import gspread
+
+from config import BUGSNAG_TOKEN, SHEETS_FLUSH_DELAY, SHEETS_FLUSH_BATCH
+from services import sheets, storage
+
+logger = logging.getLogger(__name__)
+
+_BASE_BACKOFF = 5.0    # сек
+_MAX_BACKOFF = 300.0   # сек
+
+_conn = None
+_wakeup: asyncio.Event | None = None
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = storage.connect("sheets_queue.db")
+        _conn.executescript(
+            "CREATE TABLE IF NOT EXISTS pending_rows ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " ws_index INTEGER NOT NULL,"
+            " row TEXT NOT NULL,"
+            " created_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS failed_rows ("
+            " id INTEGER PRIMARY KEY,"
+            " ws_index INTEGER NOT NULL,"
+            " row TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " failed_at REAL NOT NULL,"
+            " error TEXT NOT NULL);"
+        )
+        _conn.commit()
+    return _conn
+
+
+def _get_wakeup() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+def enqueue_row(ws_index: int, row: list) -> None:
+    """Ставит строку в очередь на запись в лист ws_index (запись на диск сразу)."""
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT INTO pending_rows (ws_index, row, created_at) VALUES (?, ?, ?)",
+            (ws_index, json.dumps(row, ensure_ascii=False), time.time()),
+        )
+    _get_wakeup().set()
+
+
+def pending_count() -> int:
+    """Сколько строк ещё не записано в таблицу."""
+    return _db().execute("SELECT COUNT(*) FROM pending_rows").fetchone()[0]
+
+
+def _is_quota_error(error: Exception) -> bool:
+    if not isinstance(error, gspread.exceptions.APIError):
+        return False
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def failed_count() -> int:
+    """Сколько строк отвергнуто таблицей и лежит в failed_rows."""
+    return _db().execute("SELECT COUNT(*) FROM failed_rows").fetchone()[0]
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Временная ошибка: квота, 5xx или сеть (ошибки requests — подклассы OSError)."""
+    if isinstance(error, gspread.exceptions.APIError):
+        return _is_quota_error(error)
+    return isinstance(error, (OSError, asyncio.TimeoutError, google.auth.exceptions.TransportError))
+
+
+def _dead_letter(ws_index: int, failed: list) -> None:
+    """Переносит отвергнутые строки [(запись очереди, ошибка)] в failed_rows и сообщает о них один раз."""
+    conn = _db()
+    now = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO failed_rows (id, ws_index, row, created_at, failed_at, error)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(r["id"], ws_index, r["row"], r["created_at"], now, str(e)) for r, e in failed],
+        )
+        conn.executemany("DELETE FROM pending_rows WHERE id = ?", [(r["id"],) for r, _ in failed])
+    for record, error in failed:
+        logger.error("[sheets_queue] лист %s отверг строку %s: %s", ws_index, record["row"], error)
+    if BUGSNAG_TOKEN:
+        bugsnag.notify(failed[0][1], meta_data={"sheets_queue": {
+            "ws_index": ws_index, "failed_rows": len(failed),
+        }})
+
+
+async def _isolate(ws_index: int, records: list) -> None:
+    """Пачка отвергнута постоянной ошибкой: пишем её по строке, чтобы найти виноватые.
+
+    Записанная строка сразу удаляется из очереди, чтобы временная ошибка на
+    следующей строке не привела к повторной записи.
+    """
+    conn = _db()
+    failed = []
+    for record in records:
+        try:
+            await sheets.append_rows(ws_index, [json.loads(record["row"])])
+        except Exception as e:
+            if _is_retryable(e):
+                if failed:
+                    _dead_letter(ws_index, failed)
+                raise
+            failed.append((record, e))
+            continue
+        with conn:
+            conn.execute("DELETE FROM pending_rows WHERE id = ?", (record["id"],))
+    if failed:
+        _dead_letter(ws_index, failed)
+
+
+async def _flush_once() -> None:
+    """Отправляет накопленные строки: по одному append_rows на лист.
+
+    Строки удаляются из очереди только после успешной записи. Временная
+    ошибка пробрасывается — повтор с задержкой делает flusher; постоянная
+    переносит отвергнутые строки в failed_rows, остальные листы пишутся дальше.
+    """
+    conn = _db()
+    ws_indexes = [r[0] for r in conn.execute("SELECT DISTINCT ws_index FROM pending_rows")]
+    for ws_index in ws_indexes:
+        records = conn.execute(
+            "SELECT id, row, created_at FROM pending_rows WHERE ws_index = ? ORDER BY id LIMIT ?",
+            (ws_index, SHEETS_FLUSH_BATCH),
+        ).fetchall()
+        if not records:
+            continue
+        try:
+            await sheets.append_rows(ws_index, [json.loads(r["row"]) for r in records])
+        except Exception as e:
+            if _is_retryable(e):
+                raise
+            if len(records) == 1:
+                _dead_letter(ws_index, [(records[0], e)])
+            else:
+                await _isolate(ws_index, records)
+            continue
+        with conn:
+            conn.executemany("DELETE FROM pending_rows WHERE id = ?", [(r["id"],) for r in records])
+        logger.info("[sheets_queue] записано %s строк в лист %s", len(records), ws_index)
+
+
+async def flusher():
+    """Фоновая задача: записывает очередь в Google Sheets с ретраями."""
+    wakeup = _get_wakeup()
+    backoff = _BASE_BACKOFF
+    while True:
+        if not pending_count():
+            await wakeup.wait()
+        wakeup.clear()
+        # Небольшое окно, чтобы собрать соседние строки в одну пачку
+        await asyncio.sleep(SHEETS_FLUSH_DELAY)
+        try:
+            await _flush_once()
+            backoff = _BASE_BACKOFF
+        except Exception as e:
+            if _is_quota_error(e):
+                logger.warning("[sheets_queue] квота/ошибка сервера Sheets, повтор через %.0f с: %s",
+                               backoff, e)
+            else:
+                logger.error("[sheets_queue] не удалось записать строки, повтор через %.0f с: %s",
+                             backoff, e)
+                if BUGSNAG_TOKEN:
+                    bugsnag.notify(e, meta_data={"sheets_queue": {"pending": pending_count()}})
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF)
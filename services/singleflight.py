@@ -0,0 +1,77 @@
+"""
+Схлопывание одинаковых одновременных запросов к внешним API (single-flight).
+
+Если несколько пользователей одновременно запрашивают одно и то же (например,
+список групп eCards утром), наружу уходит один запрос, а остальные ждут его
+результат. Ключ — (метод, эндпоинт, параметры), см. make_key.
+
+Дополнительно успешный результат можно держать ttl секунд, чтобы погасить
+всплеск запросов сразу после ответа. Ошибочные ответы (формат сервисов
+{"success": False, ...} / {"error": ...}) не кэшируются.
+
+Результат общий для всех ожидающих — вызывающий код не должен его изменять.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_inflight: dict[tuple, asyncio.Task] = {}
+_results: dict[tuple, tuple[float, object]] = {}   # ключ -> (monotonic-истечение, результат)
+
+
+def make_key(method: str, endpoint: str, params=None) -> tuple:
+    """Ключ запроса: метод, эндпоинт и параметры в каноническом виде."""
+    if isinstance(params, dict):
+        params = sorted((str(k), str(v)) for k, v in params.items())
+    elif params is not None:
+        params = [tuple(map(str, p)) if isinstance(p, (list, tuple)) else str(p) for p in params]
+    return (method.upper(), endpoint, repr(params))
+
+
+def _is_error(result) -> bool:
+    return isinstance(result, dict) and (bool(result.get("error")) or result.get("success") is False)
+
+
+async def do(key: tuple, fetch, ttl: float = 0.0):
+    """Возвращает результат fetch() для key, разделяя его между одновременными вызовами.
+
+    fetch — функция без аргументов, возвращающая корутину. ttl > 0 — успешный
+    результат отдаётся из памяти ещё ttl секунд.
+    """
+    cached = _results.get(key)
+    if cached is not None:
+        expires_at, value = cached
+        if time.monotonic() < expires_at:
+            return value
+        del _results[key]
+
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.create_task(fetch())
+
+        def _done(t: asyncio.Task) -> None:
+            if _inflight.get(key) is not t:
+                return  # сброшен через forget — результат мог устареть
+            del _inflight[key]
+            if ttl > 0 and not t.cancelled() and t.exception() is None and not _is_error(t.result()):
+                _results[key] = (time.monotonic() + ttl, t.result())
+
+        task.add_done_callback(_done)
+    # shield: отмена одного ожидающего (например, по таймауту) не отменяет общий запрос
+    return await asyncio.shield(task)
+
+
+def forget(key: tuple | None = None) -> None:
+    """Сбрасывает сохранённый результат key (None — все), например после изменения данных.
+
+    Запрос, который уже выполняется, доработает для своих ожидающих, но новые
+    вызовы запустят свежий.
+    """
+    if key is None:
+        _results.clear()
+        _inflight.clear()
+    else:
+        _results.pop(key, None)
+        _inflight.pop(key, None)
@@ -0,0 +1,207 @@
+"""
+Слежение за новыми SMS на номерах luboydomen (коды Google Ads).
+
+Вместо того чтобы пользователь раз за разом нажимал «Получить код» (каждое
+нажатие — отдельный get_sms_messages в общем лимите API), номер ставится на
+слежение: один общий цикл опрашивает все отслеживаемые номера и присылает
+новый код, как только он появился.
+
+- Опросы всех номеров идут по одному расписанию: не чаще SMS_WATCH_POLLS_PER_MIN
+  в минуту суммарно, следующим опрашивается номер с самым ранним сроком.
+- Интервал номера адаптивный: после подписки — SMS_WATCH_MIN_INTERVAL, после
+  каждого пустого опроса растёт в 1.5 раза до SMS_WATCH_MAX_INTERVAL, после
+  нового SMS снова минимальный.
+- Первый опрос номера запоминает уже пришедшие SMS; новыми считаются сообщения
+  с незнакомым id (если id нет — с более поздним received_at). Сообщения,
+  пришедшие после постановки на слежение, но до первого опроса (он ждёт слота
+  расписания и очереди API), тоже новые — их received_at не раньше начала слежения.
+- Опросы идут с приоритетом PRIORITY_BULK: фоновое слежение не отнимает у
+  нажатий пользователей место в общем лимите luboydomen.
+- Несколько пользователей на одном номере делят один опрос.
+- Слежение истекает через SMS_WATCH_TIMEOUT, либо снимается через unwatch.
+
+Сервис не знает про Telegram: on_sms(sms) и on_expire() передаёт обработчик.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from config import (SMS_WATCH_TIMEOUT, SMS_WATCH_MIN_INTERVAL, SMS_WATCH_MAX_INTERVAL,
+                    SMS_WATCH_POLLS_PER_MIN)
+from services.luboydomen import get_sms_messages
+from services.rate_limit import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+_BACKOFF = 1.5
+
+
+class _Watch:
+    """Подписка пользователя на новые SMS номера."""
+
+    def __init__(self, on_sms, on_expire):
+        self.on_sms = on_sms
+        self.on_expire = on_expire
+        self.expires_at = time.monotonic() + SMS_WATCH_TIMEOUT
+
+
+class _Target:
+    """Отслеживаемый номер: подписчики, уже виденные SMS и расписание опроса."""
+
+    def __init__(self, number_id: str):
+        self.number_id = number_id
+        self.watches: dict[int, _Watch] = {}
+        self.seen: set = set()
+        self.last_received = ""
+        self.primed = False
+        # Начало слежения: SMS, пришедшие с этого момента, — новые даже при первом опросе
+        self.started_at = datetime.now(timezone.utc)
+        self.interval = float(SMS_WATCH_MIN_INTERVAL)
+        self.next_at = time.monotonic()
+
+
+_targets: dict[str, _Target] = {}
+_loop_task: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+_last_poll = 0.0
+
+
+def _received_at(sms: dict) -> datetime | None:
+    value = str(sms.get("received_at") or "")
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def _sms_key(sms: dict):
+    sms_id = sms.get("id") or sms.get("sms_id")
+    if sms_id is not None:
+        return str(sms_id)
+    return (sms.get("received_at"), sms.get("from_number"), sms.get("message_body"))
+
+
+def watch(user_id: int, number_id, on_sms, on_expire) -> None:
+    """Ставит номер на слежение для пользователя (повторный вызов продлевает срок).
+
+    on_sms(sms) — корутина-функция, вызывается для каждого нового SMS;
+    on_expire() — корутина-функция, вызывается по истечении срока.
+    """
+    global _loop_task, _wakeup
+    number_id = str(number_id)
+    target = _targets.get(number_id)
+    if target is None:
+        target = _targets[number_id] = _Target(number_id)
+    else:
+        # Новый подписчик — номер снова опрашивается часто
+        target.interval = float(SMS_WATCH_MIN_INTERVAL)
+        target.next_at = min(target.next_at, time.monotonic() + target.interval)
+    target.watches[user_id] = _Watch(on_sms, on_expire)
+
+    if _loop_task is None or _loop_task.done():
+        _wakeup = asyncio.Event()
+        _loop_task = asyncio.create_task(_run())
+    else:
+        _wakeup.set()
+
+
+def unwatch(user_id: int, number_id=None) -> bool:
+    """Снимает слежение пользователя (с номера или со всех). True — что-то снято."""
+    removed = False
+    for key in [str(number_id)] if number_id is not None else list(_targets):
+        target = _targets.get(key)
+        if target is not None and target.watches.pop(user_id, None) is not None:
+            removed = True
+            if not target.watches:
+                del _targets[key]
+    return removed
+
+
+def is_watching(user_id: int, number_id) -> bool:
+    target = _targets.get(str(number_id))
+    return target is not None and user_id in target.watches
+
+
+async def _call(callback, *args) -> None:
+    try:
+        await callback(*args)
+    except Exception:
+        logger.exception("[sms_watcher] ошибка при уведомлении")
+
+
+async def _expire(now: float) -> None:
+    for key, target in list(_targets.items()):
+        for user_id, item in list(target.watches.items()):
+            if item.expires_at <= now:
+                del target.watches[user_id]
+                await _call(item.on_expire)
+        if not target.watches:
+            _targets.pop(key, None)
+
+
+async def _poll(target: _Target) -> None:
+    result = await get_sms_messages(target.number_id, priority=PRIORITY_BULK)
+    if not result.get("success"):
+        logger.warning("[sms_watcher] номер %s: не удалось получить SMS: %s", target.number_id, result)
+        target.interval = float(SMS_WATCH_MAX_INTERVAL)
+        return
+
+    messages = result.get("data", {}).get("messages", [])
+    fresh = []
+    for sms in messages:
+        key = _sms_key(sms)
+        if key in target.seen:
+            continue
+        target.seen.add(key)
+        received = str(sms.get("received_at") or "")
+        if target.primed:
+            if not isinstance(key, tuple) or received > target.last_received:
+                fresh.append(sms)
+        else:
+            received_dt = _received_at(sms)
+            if received_dt is not None and received_dt >= target.started_at:
+                fresh.append(sms)
+    target.last_received = max([target.last_received] + [str(m.get("received_at") or "") for m in messages])
+    target.primed = True
+
+    if not fresh:
+        target.interval = min(target.interval * _BACKOFF, float(SMS_WATCH_MAX_INTERVAL))
+        return
+    target.interval = float(SMS_WATCH_MIN_INTERVAL)
+    # API отдаёт новые сверху — присылаем в порядке прихода
+    for sms in reversed(fresh):
+        for item in list(target.watches.values()):
+            await _call(item.on_sms, sms)
+
+
+async def _run() -> None:
+    """Общий цикл опроса: живёт, пока есть хотя бы одно слежение."""
+    global _last_poll
+    spacing = 60.0 / max(1, SMS_WATCH_POLLS_PER_MIN)
+    while True:
+        now = time.monotonic()
+        await _expire(now)
+        if not _targets:
+            return
+
+        target = min(_targets.values(), key=lambda t: t.next_at)
+        deadline = min(item.expires_at for t in _targets.values() for item in t.watches.values())
+        at = max(target.next_at, _last_poll + spacing)
+        if at > now:
+            # Спим до слота; новая подписка будит, чтобы пересчитать расписание.
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), min(at, deadline) - now)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        _last_poll = now
+        try:
+            await _poll(target)
+        except Exception:
+            logger.exception("[sms_watcher] номер %s: ошибка опроса", target.number_id)
+            target.interval = float(SMS_WATCH_MAX_INTERVAL)
+        target.next_at = time.monotonic() + target.interval
@@ -0,0 +1,24 @@
+"""
+Локальное хранилище бота: SQLite-файлы в каталоге DATA_DIR.
+
+Используется там, где состояние должно переживать перезапуск (очереди записи,
+фоновые задачи, кэши). Каждый модуль держит свой файл БД и сам создаёт схему.
+"""
+import os
+import sqlite3
+
+from config import DATA_DIR
+
+
+def connect(name: str) -> sqlite3.Connection:
+    """Открывает (создаёт) БД DATA_DIR/<name> в режиме WAL.
+
+    Соединение используется из event loop (и при необходимости из потоков
+    пула), поэтому check_same_thread отключён.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DATA_DIR, name), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
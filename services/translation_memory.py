@@ -0,0 +1,105 @@
+"""
+Память переводов (translation memory) для перевода лендингов: DATA_DIR/translation_memory.db.
+
+Лендинги часто переводят повторно на ту же пару язык/страна, а шапки, подвалы
+и юридические блоки повторяются во многих лендингах. Переведённый фрагмент
+сохраняется под ключом — хэшем исходного текста, версии промпта и полного текста
+промптов (в промптах уже есть язык, страна, оффер и их формулировка, так что
+любая правка промпта сама делает старые записи неиспользуемыми). Перед запросом
+к OpenAI фрагмент ищется в памяти; повторный перевод того же лендинга не стоит
+ни одного запроса.
+
+Размер ограничен TRANSLATION_MEMORY_MAX_MB: при превышении удаляются записи,
+которые дольше всего не использовались. stats() — записи, объём и попадания
+с момента запуска (для /stats).
+"""
+import hashlib
+import logging
+import time
+
+from config import TRANSLATION_MEMORY_MAX_MB
+from services import storage
+
+logger = logging.getLogger(__name__)
+
+_MAX_BYTES = TRANSLATION_MEMORY_MAX_MB * 1024 * 1024
+
+_conn = None
+_counters = {"hits": 0, "misses": 0}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = storage.connect("translation_memory.db")
+        _conn.executescript(
+            "CREATE TABLE IF NOT EXISTS memory ("
+            " key TEXT PRIMARY KEY,"
+            " translation TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used);"
+        )
+        _conn.commit()
+    return _conn
+
+
+def make_key(text: str, *context: str) -> str:
+    """Ключ фрагмента: sha256 от текста и всего, что влияет на перевод (версия, промпты)."""
+    digest = hashlib.sha256()
+    for part in (text, *context):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get(key: str) -> str | None:
+    """Перевод из памяти или None. Отмечает использование записи."""
+    conn = _db()
+    row = conn.execute("SELECT translation FROM memory WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        _counters["misses"] += 1
+        return None
+    _counters["hits"] += 1
+    with conn:
+        conn.execute("UPDATE memory SET last_used = ? WHERE key = ?", (time.time(), key))
+    return row["translation"]
+
+
+def put(key: str, translation: str) -> None:
+    """Сохраняет перевод и при превышении лимита вытесняет давно не использованные записи."""
+    conn = _db()
+    now = time.time()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO memory (key, translation, size, created_at, last_used)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, translation, len(translation.encode("utf-8")), now, now),
+        )
+    _evict()
+
+
+def _evict() -> None:
+    conn = _db()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM memory").fetchone()[0]
+    if total <= _MAX_BYTES:
+        return
+    # Освобождаем с запасом (до 90% лимита), чтобы не чистить на каждой записи
+    target = total - int(_MAX_BYTES * 0.9)
+    freed = 0
+    keys = []
+    for row in conn.execute("SELECT key, size FROM memory ORDER BY last_used"):
+        keys.append((row["key"],))
+        freed += row["size"]
+        if freed >= target:
+            break
+    with conn:
+        conn.executemany("DELETE FROM memory WHERE key = ?", keys)
+    logger.info("[translation_memory] вытеснено записей %s (%s байт)", len(keys), freed)
+
+
+def stats() -> dict:
+    """{entries, bytes, hits, misses} — hits/misses с момента запуска бота."""
+    row = _db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM memory").fetchone()
+    return {"entries": row[0], "bytes": row[1], **_counters}
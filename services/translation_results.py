@@ -0,0 +1,162 @@
+"""
+Кэш готовых переводов лендингов целиком: DATA_DIR/translation_results.db и
+архивы в DATA_DIR/translation_results/.
+
+Когда один и тот же лендинг просят на тот же язык, страну и оффер, повторять
+извлечение, перевод и сборку архива незачем. Готовый ZIP сохраняется на диск
+под ключом — хэшем (содержимое архива, язык, страна, оффер, цена, версия
+промпта); после первой отправки запоминается file_id документа в Telegram, и
+повтор отправляется по file_id без загрузки файла.
+
+- Содержимое архива входит в ключ, поэтому изменённый архив в LANDINGS_FOLDER
+  не найдёт старый перевод; invalidate_landing удаляет переводы прежних версий
+  архива. Хэш архива пересчитывается только при изменении размера/mtime файла.
+- Общий объём архивов ограничен TRANSLATION_RESULTS_MAX_MB: при превышении
+  удаляются переводы, которые дольше всего не запрашивали.
+"""
+import hashlib
+import logging
+import os
+import time
+
+from config import DATA_DIR, TRANSLATION_RESULTS_MAX_MB
+from services import storage
+
+logger = logging.getLogger(__name__)
+
+_MAX_BYTES = TRANSLATION_RESULTS_MAX_MB * 1024 * 1024
+_FILES_DIR = os.path.join(DATA_DIR, "translation_results")
+
+_conn = None
+# path -> (size, mtime_ns, sha256): не читать архив заново, если он не менялся
+_archive_hashes: dict[str, tuple] = {}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = storage.connect("translation_results.db")
+        _conn.executescript(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " landing_id TEXT NOT NULL,"
+            " archive_hash TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " file_count INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " file_id TEXT,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS results_landing ON results (landing_id);"
+        )
+        _conn.commit()
+    return _conn
+
+
+def _path(key: str) -> str:
+    return os.path.join(_FILES_DIR, f"{key}.zip")
+
+
+def archive_hash(archive_path: str) -> str:
+    """sha256 содержимого архива (блокирующий вызов — выполнять в executor)."""
+    stat = os.stat(archive_path)
+    cached = _archive_hashes.get(archive_path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(archive_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    _archive_hashes[archive_path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def make_key(archive_digest: str, *params) -> str:
+    """Ключ перевода: хэш архива и всех параметров перевода (None — пустая строка)."""
+    digest = hashlib.sha256(archive_digest.encode("utf-8"))
+    for part in params:
+        digest.update(b"\0")
+        digest.update(str(part or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _delete(keys: list[str]) -> None:
+    conn = _db()
+    with conn:
+        conn.executemany("DELETE FROM results WHERE key = ?", [(key,) for key in keys])
+    for key in keys:
+        try:
+            os.remove(_path(key))
+        except FileNotFoundError:
+            pass
+
+
+def invalidate_landing(landing_id: str, current_hash: str) -> None:
+    """Удаляет переводы лендинга, сделанные из прежних версий архива."""
+    rows = _db().execute(
+        "SELECT key FROM results WHERE landing_id = ? AND archive_hash != ?", (landing_id, current_hash)
+    ).fetchall()
+    if rows:
+        _delete([row["key"] for row in rows])
+        logger.info("[translation_results] %s: архив изменился, удалено переводов %s", landing_id, len(rows))
+
+
+def get(key: str) -> dict | None:
+    """Готовый перевод: filename, file_count, file_id (или None), path. None — нет в кэше."""
+    conn = _db()
+    row = conn.execute("SELECT * FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    if not os.path.exists(_path(key)):
+        _delete([key])
+        return None
+    with conn:
+        conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+    return {**dict(row), "path": _path(key)}
+
+
+def read(key: str) -> bytes:
+    """Байты сохранённого архива (блокирующий вызов — выполнять в executor)."""
+    with open(_path(key), "rb") as f:
+        return f.read()
+
+
+def put(key: str, landing_id: str, archive_digest: str, filename: str, file_count: int, data: bytes) -> None:
+    """Сохраняет готовый архив (блокирующий вызов — выполнять в executor)."""
+    os.makedirs(_FILES_DIR, exist_ok=True)
+    tmp_path = _path(key) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, _path(key))
+    now = time.time()
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO results"
+            " (key, landing_id, archive_hash, filename, file_count, size, file_id, created_at, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+            (key, landing_id, archive_digest, filename, file_count, len(data), now, now),
+        )
+    _evict()
+
+
+def set_file_id(key: str, file_id: str | None) -> None:
+    """Запоминает file_id отправленного документа (None — забыть недействительный)."""
+    conn = _db()
+    with conn:
+        conn.execute("UPDATE results SET file_id = ? WHERE key = ?", (file_id, key))
+
+
+def _evict() -> None:
+    conn = _db()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if total <= _MAX_BYTES:
+        return
+    keys = []
+    for row in conn.execute("SELECT key, size FROM results ORDER BY last_used"):
+        if total <= _MAX_BYTES:
+            break
+        keys.append(row["key"])
+        total -= row["size"]
+    _delete(keys)
+    logger.info("[translation_results] вытеснено переводов %s", len(keys))
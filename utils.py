@@ -1,10 +1,16 @@
 """
 Утилиты для работы с сообщениями и администрированием
 """
-from typing import Dict, List
-import gspread
-from config import ADMIN_ID, TEAMLEADER_ID, GOOGLE_SHEET_ID
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
+from config import (ADMIN_ID, TEAMLEADER_ID,
+                    ALLOWLIST_REFRESH_INTERVAL, ALLOWLIST_FORCE_REFRESH_COOLDOWN)
 from aiogram import Bot
+from services import sheets
+
+logger = logging.getLogger(__name__)
 
 # Глобальные переменные для хранения состояния сообщений
 last_messages: Dict[int, List[int]] = {}
@@ -20,29 +26,102 @@ async def delete_last_messages(user_id: int, bot: Bot):
             pass
     last_messages[user_id] = []
 
-def is_user_allowed(user_id: int) -> bool:
+# Кэш списка разрешённых пользователей (второй лист Google Sheets).
+# Снимок — множество ID для O(1) проверки; обновляется фоновой задачей
+# allowlist_refresher. Пока идёт обновление, отвечаем по старому снимку
+# (stale-while-revalidate). Неизвестный ID вызывает внеочередное обновление,
+# но не чаще ALLOWLIST_FORCE_REFRESH_COOLDOWN. С той же паузой повторяется
+# неудачная загрузка — иначе каждое сообщение при недоступной таблице шло бы в Sheets.
+_allowed_ids: Set[int] = set()
+_allowed_loaded_at: float = 0.0       # monotonic-время последнего успешного обновления
+_last_forced_refresh: float = 0.0     # monotonic-время последнего внеочередного обновления
+_last_failed_refresh: float = 0.0     # monotonic-время последней неудачной загрузки
+_allowlist_lock = asyncio.Lock()
+_background_refresh: Optional[asyncio.Task] = None
+
+
+async def refresh_allowed_users() -> bool:
+    """Перечитывает список разрешённых ID из таблицы. True при успехе.
+
+    Чтение идёт через шлюз services.sheets (пул потоков, без блокировки event
+    loop). При ошибке остаётся прежний снимок.
+    """
+    global _allowed_ids, _allowed_loaded_at, _last_failed_refresh
+    async with _allowlist_lock:
+        try:
+            user_ids = await get_user_ids_from_sheet()
+        except Exception as e:
+            logger.error("[allowlist] не удалось обновить список пользователей: %s", e)
+            _last_failed_refresh = time.monotonic()
+            return False
+        _allowed_ids = set(user_ids)
+        _allowed_loaded_at = time.monotonic()
+        return True
+
+
+def _revalidate_in_background() -> None:
+    """Запускает обновление снимка в фоне, если оно ещё не идёт."""
+    global _background_refresh
+    if _background_refresh is None or _background_refresh.done():
+        _background_refresh = asyncio.create_task(refresh_allowed_users())
+
+
+def _recently_failed() -> bool:
+    """Последняя загрузка не удалась меньше ALLOWLIST_FORCE_REFRESH_COOLDOWN назад."""
+    return bool(_last_failed_refresh) and \
+        time.monotonic() - _last_failed_refresh < ALLOWLIST_FORCE_REFRESH_COOLDOWN
+
+
+async def _ensure_allowlist_loaded() -> None:
+    """Загружает снимок при первом обращении; устаревший — обновляет в фоне."""
+    if not _allowed_loaded_at:
+        if _recently_failed():
+            return  # таблица недоступна — до конца паузы отвечаем по пустому снимку
+        await refresh_allowed_users()
+    elif time.monotonic() - _allowed_loaded_at > ALLOWLIST_REFRESH_INTERVAL * 2:
+        # Фоновая задача не успевает (или не запущена) — отвечаем по старому снимку
+        _revalidate_in_background()
+
+
+async def is_user_allowed(user_id: int) -> bool:
     """Проверяет, разрешен ли пользователю доступ к функциям бота"""
+    global _last_forced_refresh
     # Администратор и тимлидер всегда имеют доступ ко всем функциям
     if user_id == ADMIN_ID or user_id == TEAMLEADER_ID:
         return True
 
-    user_ids = get_user_ids_from_sheet()
-    if not user_ids:
-        return False  # Если список пуст, доступ запрещен
+    await _ensure_allowlist_loaded()
+    if user_id in _allowed_ids:
+        return True
+
+    # Неизвестный ID — возможно, его только что добавили в таблицу
+    now = time.monotonic()
+    if now - _last_forced_refresh >= ALLOWLIST_FORCE_REFRESH_COOLDOWN and not _recently_failed():
+        _last_forced_refresh = now
+        await refresh_allowed_users()
+        return user_id in _allowed_ids
+
+    return False
+
+
+async def get_allowed_user_ids() -> List[int]:
+    """Текущий снимок списка пользователей (тот же, что у is_user_allowed)."""
+    await _ensure_allowlist_loaded()
+    return sorted(_allowed_ids)
+
+
+async def allowlist_refresher():
+    """Фоновая задача: периодически обновляет снимок списка пользователей."""
+    while True:
+        await refresh_allowed_users()
+        await asyncio.sleep(ALLOWLIST_REFRESH_INTERVAL)
 
-    return user_id in user_ids
 
-def get_user_ids_from_sheet() -> List[int]:
-    """Получает список ID пользователей из Google Sheets"""
-    try:
-        gc = gspread.service_account(filename='credentials.json')
-        table = gc.open_by_key(GOOGLE_SHEET_ID)
-        worksheet = table.get_worksheet(1)
-        user_ids = worksheet.col_values(1)
+async def get_user_ids_from_sheet() -> List[int]:
+    """Читает ID пользователей из Google Sheets (ошибки пробрасываются)"""
+    user_ids = await sheets.col_values(sheets.WS_USERS, 1)
 
-        return [int(user_id) for user_id in user_ids if user_id.isdigit()]
-    except Exception:
-        return []
+    return [int(user_id) for user_id in user_ids if user_id.isdigit()]
 
 async def send_notification_to_admins(bot: Bot, message_text: str, reply_markup=None):
     """Отправляет уведомление админу и тимлидеру"""